@@ -1,5 +1,18 @@
-import operators
-import tools
+"""
+pyWigner: Python toolkit for LSC-IVR (classical Wigner) simulations.
+
+Only the numerical core (:mod:`pywigner.tools` and
+:mod:`pywigner.kernels`) is imported with the package. Everything else,
+including the operators (which need OpenPathSampling) and anything that
+uses dynamiq_samplers, is imported on first access, e.g., the first use of
+`pywigner.CoherentProjection`.
+"""
+import importlib
+import sys
+import types
+
+from pywigner import tools
+from pywigner import kernels
 
 def git_rev_actual(): # pragma: no-cover
     from subprocess import check_output
@@ -8,3 +21,79 @@ def git_rev_actual(): # pragma: no-cover
     return check_output(["git", "-C", git_dir, "rev-parse", "HEAD"])[:-1]
     # chops the newline at the end
 
+# name: (module, attribute); attribute None means the module itself
+_LAZY_ATTRIBUTES = {
+    'operators': ('pywigner.operators', None),
+    'Operator': ('pywigner.operators', 'Operator'),
+    'ProductOperator': ('pywigner.operators', 'ProductOperator'),
+    'SumOperator': ('pywigner.operators', 'SumOperator'),
+    'OperatorBank': ('pywigner.operators', 'OperatorBank'),
+    'ProjectionGrid': ('pywigner.operators', 'ProjectionGrid'),
+    'GridWignerOperator': ('pywigner.operators', 'GridWignerOperator'),
+    'PolynomialOperator': ('pywigner.operators', 'PolynomialOperator'),
+    'PositionOperator': ('pywigner.operators', 'PositionOperator'),
+    'MomentumOperator': ('pywigner.operators', 'MomentumOperator'),
+    'CoherentProjection': ('pywigner.operators', 'CoherentProjection'),
+    'ElectronicCoherentProjection': ('pywigner.operators',
+                                     'ElectronicCoherentProjection'),
+    'accumulators': ('pywigner.accumulators', None),
+    'RunningStatistics': ('pywigner.accumulators', 'RunningStatistics'),
+    'RunningCovariance': ('pywigner.accumulators', 'RunningCovariance'),
+    'correlation': ('pywigner.correlation', None),
+    'CorrelationFunction': ('pywigner.correlation', 'CorrelationFunction'),
+    'parallel': ('pywigner.parallel', None),
+    'EnsembleTask': ('pywigner.parallel', 'EnsembleTask'),
+    'run_ensemble': ('pywigner.parallel', 'run_ensemble'),
+    'convergence': ('pywigner.convergence', None),
+    'run_until_converged': ('pywigner.convergence', 'run_until_converged'),
+    'ConvergenceReport': ('pywigner.convergence', 'ConvergenceReport'),
+    'checkpoint': ('pywigner.checkpoint', None),
+    'run_with_checkpoints': ('pywigner.checkpoint', 'run_with_checkpoints'),
+    'shards': ('pywigner.shards', None),
+    'write_shard': ('pywigner.shards', 'write_shard'),
+    'read_shard': ('pywigner.shards', 'read_shard'),
+    'merge': ('pywigner.merge', None),
+    'merge_shards': ('pywigner.merge', 'merge_shards'),
+    'ensemble': ('pywigner.ensemble', None),
+    'EnsembleStore': ('pywigner.ensemble', 'EnsembleStore'),
+    'instrumentation': ('pywigner.instrumentation', None),
+    'Instrumentation': ('pywigner.instrumentation', 'Instrumentation'),
+    'qmc': ('pywigner.qmc', None),
+    'QMCGaussianSampler': ('pywigner.qmc', 'QMCGaussianSampler'),
+    'replica_estimate': ('pywigner.qmc', 'replica_estimate'),
+    'memo': ('pywigner.memo', None),
+    'MemoCache': ('pywigner.memo', 'MemoCache'),
+    'samplers': ('pywigner.samplers', None),
+    'MixtureSampler': ('pywigner.samplers', 'MixtureSampler'),
+    'variance_reduction': ('pywigner.variance_reduction', None),
+    'VarianceReducedCorrelation': ('pywigner.variance_reduction',
+                                   'VarianceReducedCorrelation'),
+}
+
+
+class _LazyModule(types.ModuleType):
+    """Package module that imports `_LAZY_ATTRIBUTES` on first access"""
+    def __getattr__(self, name):
+        try:
+            (module_name, attribute) = _LAZY_ATTRIBUTES[name]
+        except KeyError:
+            raise AttributeError("module 'pywigner' has no attribute '%s'"
+                                 % name)
+        value = importlib.import_module(module_name)
+        if attribute is not None:
+            value = getattr(value, attribute)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__.keys()) | set(_LAZY_ATTRIBUTES))
+
+
+# swap in a module object of our lazy type. The original module must stay
+# alive: on Python 2, a module that is garbage collected has its globals
+# set to None, and __getattr__ uses those globals.
+_module = _LazyModule(__name__, __doc__)
+_module.__dict__.update(dict((k, v) for (k, v) in globals().items()
+                             if k != '_module'))
+_module._original_module = sys.modules[__name__]
+sys.modules[__name__] = _module
@@ -0,0 +1,193 @@
+import numpy as np
+
+class RunningStatistics(object):
+    """Streaming mean and variance, elementwise over an array of values.
+
+    Uses Welford's update for single samples and the pairwise update of
+    Chan et al. for blocks of samples and for merging two accumulators, so
+    only the count, mean, and sum of squared deviations are kept.
+
+    Samples may be shorter than the accumulator along the first axis (e.g.,
+    trajectories of different lengths): they only update the entries they
+    cover, and each entry keeps its own count. The first axis grows if a
+    longer sample arrives.
+
+    Parameters
+    ----------
+    shape : tuple
+        shape of a single sample
+    """
+    def __init__(self, shape):
+        shape = tuple(shape)
+        self.count = np.zeros(shape, dtype=int)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    @property
+    def shape(self):
+        return self.mean.shape
+
+    def _grow(self, length):
+        if len(self.shape) == 0 or length <= self.shape[0]:
+            return
+        extra = (length - self.shape[0],) + self.shape[1:]
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=int)])
+        self.mean = np.concatenate([self.mean, np.zeros(extra)])
+        self.m2 = np.concatenate([self.m2, np.zeros(extra)])
+
+    def _update(self, region, count, mean, m2):
+        # pairwise update of the entries in `region`
+        old_count = self.count[region]
+        total = old_count + count
+        safe_total = np.where(total > 0, total, 1)
+        delta = mean - self.mean[region]
+        self.mean[region] += delta * count / safe_total
+        self.m2[region] += m2 + delta**2 * old_count * count / safe_total
+        self.count[region] = total
+
+    def _region(self, length, offset=0):
+        if len(self.shape) == 0:
+            return Ellipsis
+        self._grow(offset + length)
+        return slice(offset, offset + length)
+
+    def add(self, value, offset=0):
+        """Add a single sample.
+
+        If `offset` is given, the sample starts at that index of the first
+        axis.
+        """
+        value = np.asarray(value, dtype=float)
+        region = self._region(len(value) if value.ndim > 0 else 0, offset)
+        self._update(region, 1, value, 0.0)
+
+    def add_batch(self, values, offset=0):
+        """Add a block of samples, stacked along a new first axis"""
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        region = self._region(values.shape[1] if values.ndim > 1 else 0,
+                              offset)
+        mean = values.mean(axis=0)
+        m2 = ((values - mean)**2).sum(axis=0)
+        self._update(region, len(values), mean, m2)
+
+    def merge(self, other):
+        """Add all the samples accumulated by `other` to this one"""
+        region = self._region(other.shape[0] if len(other.shape) > 0 else 0)
+        self._update(region, other.count, other.mean, other.m2)
+        return self
+
+    @property
+    def variance(self):
+        """Sample variance (NaN where there are fewer than 2 samples)"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > 1,
+                            self.m2 / (self.count - 1), np.nan)
+
+    @property
+    def standard_error(self):
+        """Standard error of the mean"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.sqrt(self.variance / self.count)
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2}
+
+    @classmethod
+    def from_dict(cls, dct):
+        obj = cls(np.shape(dct['mean']))
+        obj.count = np.array(dct['count'], dtype=int)
+        obj.mean = np.array(dct['mean'], dtype=float)
+        obj.m2 = np.array(dct['m2'], dtype=float)
+        return obj
+
+
+class RunningCovariance(object):
+    """Streaming means and covariances of controls and values.
+
+    Keeps what a control-variate estimate needs: the means of the controls
+    (a vector for each sample) and of the values (an array for each
+    sample), the co-moment matrix of the controls, the co-moments of each
+    control with each value, and the squared deviations of the values.
+    Blocks and other accumulators are combined with the same pairwise
+    update as :class:`RunningStatistics`. Every sample must cover the whole
+    shape.
+
+    Parameters
+    ----------
+    n_controls : int
+        number of controls per sample
+    shape : tuple
+        shape of the values of a single sample
+    """
+    def __init__(self, n_controls, shape):
+        shape = tuple(shape)
+        self.count = 0
+        self.control_mean = np.zeros(n_controls)
+        self.mean = np.zeros(shape)
+        self.control_m2 = np.zeros((n_controls, n_controls))
+        self.cross_m2 = np.zeros((n_controls,) + shape)
+        self.m2 = np.zeros(shape)
+
+    @property
+    def shape(self):
+        return self.mean.shape
+
+    def _update(self, count, control_mean, mean, control_m2, cross_m2, m2):
+        total = self.count + count
+        if total == 0:
+            return
+        factor = float(self.count) * count / total
+        d_control = control_mean - self.control_mean
+        d_value = mean - self.mean
+        self.control_m2 += control_m2 + factor * np.outer(d_control,
+                                                          d_control)
+        self.cross_m2 += cross_m2 + factor * np.multiply.outer(d_control,
+                                                               d_value)
+        self.m2 += m2 + factor * d_value**2
+        self.control_mean += d_control * count / total
+        self.mean += d_value * count / total
+        self.count = total
+
+    def add_batch(self, controls, values):
+        """Add a block of samples.
+
+        Parameters
+        ----------
+        controls : array-like
+            shape (n_samples, n_controls)
+        values : array-like
+            shape (n_samples,) + `shape`
+        """
+        controls = np.asarray(controls, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        control_mean = controls.mean(axis=0)
+        mean = values.mean(axis=0)
+        d_control = controls - control_mean
+        d_value = values - mean
+        self._update(len(values), control_mean, mean,
+                     np.dot(d_control.T, d_control),
+                     np.tensordot(d_control, d_value, axes=(0, 0)),
+                     (d_value**2).sum(axis=0))
+
+    def merge(self, other):
+        """Add all the samples accumulated by `other` to this one"""
+        self._update(other.count, other.control_mean, other.mean,
+                     other.control_m2, other.cross_m2, other.m2)
+        return self
+
+    def to_dict(self):
+        return {'count': self.count, 'control_mean': self.control_mean,
+                'mean': self.mean, 'control_m2': self.control_m2,
+                'cross_m2': self.cross_m2, 'm2': self.m2}
+
+    @classmethod
+    def from_dict(cls, dct):
+        obj = cls(len(dct['control_mean']), np.shape(dct['mean']))
+        obj.count = int(dct['count'])
+        for key in ['control_mean', 'mean', 'control_m2', 'cross_m2', 'm2']:
+            setattr(obj, key, np.array(dct[key], dtype=float))
+        return obj
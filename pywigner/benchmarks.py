@@ -0,0 +1,262 @@
+"""
+Performance benchmarks for operators and samplers.
+
+Each benchmark times one hot-path call (per call, best of several
+repeats) for a grid of parameters: number of dofs, exciton pattern,
+product depth, and (for batched evaluation) number of samples. The
+cold-start time of importing the package in a new interpreter is also
+measured. Batched cases are only run when n_samples * n_dofs is at most
+`MAX_BATCH_ENTRIES` (10^6, i.e., 8 MB per input array), so that the full
+grid fits in memory on an ordinary machine. Runs are appended to a
+JSON-lines history file, and runs can be compared to flag regressions::
+
+    python -m pywigner.benchmarks run --history bench_history.jsonl
+    python -m pywigner.benchmarks compare --history bench_history.jsonl
+
+`compare` exits with status 1 if any benchmark got slower than the
+threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+import numpy as np
+
+import pywigner
+from pywigner.operators import (
+    CoherentProjection, ElectronicCoherentProjection, ProductOperator,
+    OperatorBank, ProjectionGrid
+)
+
+N_DOFS = [1, 10, 100, 1000]
+EXCITON_PATTERNS = ['ground', 'single', 'all']
+PRODUCT_DEPTHS = [2, 4, 8]
+N_SAMPLES = [100, 10000, 100000]
+# largest n_samples * n_dofs for the batched cases
+MAX_BATCH_ENTRIES = 10**6
+
+QUICK = {'n_dofs': [1, 10], 'exciton_patterns': ['ground', 'single'],
+         'product_depths': [2], 'n_samples': [100]}
+
+
+def time_call(func, min_time=0.05, repeat=3):
+    """Best time per call of `func()`, in seconds."""
+    n_calls = 1
+    while True:
+        start = timeit.default_timer()
+        for _ in range(n_calls):
+            func()
+        elapsed = timeit.default_timer() - start
+        if elapsed >= min_time or n_calls >= 1000000:
+            break
+        n_calls *= 10
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = timeit.default_timer()
+        for _ in range(n_calls):
+            func()
+        best = min(best, timeit.default_timer() - start)
+    return best / n_calls
+
+
+def run_python(code):
+    """Run `code` in a fresh interpreter with this process's sys.path"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+    subprocess.check_call([sys.executable, '-c', code], env=env)
+
+
+def _excitons(pattern, n_dofs):
+    if pattern == 'ground':
+        return 0
+    elif pattern == 'single':
+        return [1] + [0]*(n_dofs - 1)
+    elif pattern == 'all':
+        return 1
+    raise ValueError("Unknown exciton pattern: " + str(pattern))
+
+
+def _projection(cls, n_dofs, pattern, shift=0.0):
+    return cls(x0=np.zeros(n_dofs) + shift, p0=np.zeros(n_dofs),
+               gamma=np.ones(n_dofs), excitons=_excitons(pattern, n_dofs))
+
+
+def _snapshot(n_dofs, rng):
+    import dynamiq_engine as dynq
+    return dynq.MMSTSnapshot(
+        coordinates=rng.normal(size=n_dofs),
+        momenta=rng.normal(size=n_dofs),
+        electronic_coordinates=rng.normal(size=n_dofs),
+        electronic_momenta=rng.normal(size=n_dofs),
+        topology=None
+    )
+
+
+def _batch(n_samples, n_dofs, rng):
+    return tuple(rng.normal(size=(n_samples, n_dofs)) for _ in range(4))
+
+
+def benchmark_cases(n_dofs=N_DOFS, exciton_patterns=EXCITON_PATTERNS,
+                    product_depths=PRODUCT_DEPTHS, n_samples=N_SAMPLES):
+    """Generate (name, func) pairs for all benchmarks.
+
+    The names encode the parameters, e.g.
+    `CoherentProjection.__call__[n_dofs=10,excitons=single]`.
+    """
+    # cold start: import in a new interpreter (includes interpreter start)
+    for module in ['pywigner', 'pywigner.operators']:
+        yield ("import %s[cold]" % module,
+               lambda module=module: run_python("import " + module))
+
+    rng = np.random.RandomState(0)
+    for n in n_dofs:
+        snap = _snapshot(n, rng)
+        for pattern in exciton_patterns:
+            params = "[n_dofs=%d,excitons=%s]" % (n, pattern)
+            op = _projection(CoherentProjection, n, pattern)
+            elect = _projection(ElectronicCoherentProjection, n, pattern)
+            sampler = op.default_sampler()
+            yield ("CoherentProjection.__call__" + params,
+                   lambda op=op, snap=snap: op(snap))
+            yield ("ElectronicCoherentProjection.__call__" + params,
+                   lambda op=elect, snap=snap: op(snap))
+            yield ("CoherentProjection.correction" + params,
+                   lambda op=op, s=sampler, snap=snap: op.correction(snap, s))
+        sampler = _projection(CoherentProjection, n,
+                              'ground').default_sampler()
+        yield ("default_sampler.generate_initial_snapshot[n_dofs=%d]" % n,
+               lambda s=sampler, snap=snap:
+                   s.generate_initial_snapshot(snap))
+        for depth in product_depths:
+            product = ProductOperator([
+                _projection(CoherentProjection, n, 'ground', shift=0.1*i)
+                for i in range(depth)
+            ])
+            yield ("ProductOperator.__call__[n_dofs=%d,depth=%d]"
+                   % (n, depth), lambda op=product, snap=snap: op(snap))
+        for n_batch in n_samples:
+            if n_batch * n > MAX_BATCH_ENTRIES:
+                continue
+            batch = _batch(n_batch, n, rng)
+            op = _projection(CoherentProjection, n, 'single')
+            sampler = op.default_sampler()
+            params = "[n_dofs=%d,n_samples=%d]" % (n, n_batch)
+            yield ("CoherentProjection.evaluate_batch" + params,
+                   lambda op=op, batch=batch: op.evaluate_batch(*batch))
+            yield ("CoherentProjection.correction_batch" + params,
+                   lambda op=op, s=sampler, batch=batch:
+                       op.correction_batch(s, *batch))
+            # all n single-exciton populations on the electronic dofs
+            bank = OperatorBank([
+                ElectronicCoherentProjection.with_n_dofs(n).excite(k)
+                for k in range(n)
+            ])
+            yield ("OperatorBank.evaluate_batch[populations]" + params,
+                   lambda bank=bank, batch=batch:
+                       bank.evaluate_batch(*batch))
+            if n_batch <= 10000:
+                # 20 x 20 phase-space scan of dof 0
+                axis = np.linspace(-2.0, 2.0, 20)
+                grid = ProjectionGrid(axis, axis, gamma=1.0, dofs=[0])
+                yield ("ProjectionGrid.evaluate_batch[20x20]" + params,
+                       lambda grid=grid, batch=batch:
+                           grid.evaluate_batch(*batch))
+
+
+def run_benchmarks(cases=None, min_time=0.05, repeat=3, stream=None):
+    """Time all cases.
+
+    Returns
+    -------
+    dict
+        run record: metadata plus `results` mapping names to seconds/call
+    """
+    if cases is None:
+        cases = benchmark_cases()
+    results = {}
+    for (name, func) in cases:
+        results[name] = time_call(func, min_time, repeat)
+        if stream is not None:
+            stream.write("%-70s %12.3e s\n" % (name, results[name]))
+    try:
+        revision = pywigner.git_rev_actual().decode('ascii')
+    except Exception:  # not a git checkout
+        revision = None
+    return {'timestamp': time.time(),
+            'git_revision': revision,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.node(),
+            'results': results}
+
+
+def append_history(filename, record):
+    with open(filename, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def load_history(filename):
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare_results(baseline, current, threshold=1.2):
+    """Find benchmarks that are slower in `current` than in `baseline`.
+
+    Parameters
+    ----------
+    baseline, current : dict
+        run records (see :func:`run_benchmarks`)
+    threshold : float
+        ratio of new to old time that counts as a regression
+
+    Returns
+    -------
+    list of tuple
+        (name, old_time, new_time, ratio), worst first
+    """
+    regressions = []
+    for (name, new_time) in current['results'].items():
+        old_time = baseline['results'].get(name)
+        if old_time is None or old_time <= 0:
+            continue
+        ratio = new_time / old_time
+        if ratio > threshold:
+            regressions.append((name, old_time, new_time, ratio))
+    return sorted(regressions, key=lambda r: -r[3])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pyWigner benchmarks")
+    parser.add_argument('command', choices=['run', 'compare'])
+    parser.add_argument('--history', default='bench_history.jsonl',
+                        help="JSON-lines history file")
+    parser.add_argument('--quick', action='store_true',
+                        help="small parameter grid")
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="slowdown ratio flagged as regression")
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        cases = benchmark_cases(**QUICK) if args.quick else None
+        record = run_benchmarks(cases, stream=sys.stdout)
+        append_history(args.history, record)
+        return 0
+
+    history = load_history(args.history)
+    if len(history) < 2:
+        sys.stdout.write("Need at least two runs to compare\n")
+        return 0
+    regressions = compare_results(history[-2], history[-1], args.threshold)
+    for (name, old_time, new_time, ratio) in regressions:
+        sys.stdout.write("%-70s %10.3e -> %10.3e (x%.2f)\n"
+                         % (name, old_time, new_time, ratio))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,266 @@
+"""
+Checkpoint and restart of long ensemble runs.
+
+:func:`run_with_checkpoints` runs the same blocks as :func:`.run_ensemble`
+and, every few blocks, saves the merged statistics along with the position
+in the ensemble (the number of blocks done). If the job is killed, running
+it again with the same arguments picks up after the last checkpoint. Each
+block's random stream is seeded from `(master_seed, block)`, so the
+position is all that is needed to restore the random state, and the
+restarted run gives a result bitwise identical to an uninterrupted one.
+
+Checkpoints are written by a background thread, to a temporary file that
+is then renamed, so sampling doesn't wait on the disk and a checkpoint is
+either complete or absent. A checkpoint of a :class:`.CorrelationFunction`
+is also a valid shard (see :func:`.read_shard`).
+"""
+import os
+import threading
+import numpy as np
+from pywigner.parallel import block_sizes, stream_seed, iter_block_results
+from pywigner.shards import (SHARD_FORMAT_VERSION, ShardMismatchError,
+                             correlation_key)
+
+_POSITION_KEYS = ['format_version', 'key', 'master_seed', 'block_size',
+                  'n_blocks', 'n_done']
+
+
+def write_checkpoint(filename, arrays):
+    """Atomically write a dict of arrays to `filename`.
+
+    The data is flushed to disk before the temporary file replaces the
+    old checkpoint.
+    """
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_filename, filename)
+
+
+def read_checkpoint(filename):
+    """Read a checkpoint file.
+
+    Returns
+    -------
+    tuple
+        (position, statistics): position is a dict with the key,
+        master_seed, block_size, n_blocks, and n_done; statistics is the
+        dict of arrays passed to the statistics' `from_dict`
+    """
+    with np.load(filename) as data:
+        version = int(data['format_version'])
+        if version != SHARD_FORMAT_VERSION:
+            raise ShardMismatchError(
+                "%s has checkpoint format %d; expected %d"
+                % (filename, version, SHARD_FORMAT_VERSION)
+            )
+        position = {'key': str(data['key']),
+                    'master_seed': int(data['master_seed']),
+                    'block_size': int(data['block_size']),
+                    'n_blocks': int(data['n_blocks']),
+                    'n_done': int(data['n_done'])}
+        statistics = dict((name, data[name]) for name in data.files
+                          if name not in _POSITION_KEYS)
+    return (position, statistics)
+
+
+class CheckpointWriter(object):
+    """Writes checkpoints to one file, in a background thread.
+
+    :meth:`submit` returns immediately. If a new checkpoint is submitted
+    before the previous one was written, the previous one is skipped, since
+    it is superseded. An error in the writer thread is raised by the next
+    call to :meth:`submit`, :meth:`flush`, or :meth:`close`.
+
+    Parameters
+    ----------
+    filename : str
+        checkpoint file
+    asynchronous : bool
+        if False, :meth:`submit` writes before returning
+
+    Attributes
+    ----------
+    n_written : int
+        number of checkpoints written
+    """
+    def __init__(self, filename, asynchronous=True):
+        self.filename = filename
+        self.asynchronous = asynchronous
+        self.n_written = 0
+        self._condition = threading.Condition()
+        self._pending = None
+        self._busy = False
+        self._closed = False
+        self._error = None
+        self._thread = None
+
+    def _raise_error(self):
+        with self._condition:
+            (error, self._error) = (self._error, None)
+        if error is not None:
+            raise error
+
+    def submit(self, arrays):
+        """Queue a dict of arrays to be written; the arrays must not be
+        modified afterwards"""
+        self._raise_error()
+        if not self.asynchronous:
+            write_checkpoint(self.filename, arrays)
+            self.n_written += 1
+            return
+        with self._condition:
+            if self._closed:
+                raise ValueError("CheckpointWriter is closed")
+            self._pending = arrays
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                (arrays, self._pending) = (self._pending, None)
+                self._busy = True
+            try:
+                write_checkpoint(self.filename, arrays)
+                error = None
+            except Exception as e:
+                error = e
+            with self._condition:
+                self._busy = False
+                if error is None:
+                    self.n_written += 1
+                else:
+                    self._error = error
+                self._condition.notify_all()
+
+    def flush(self):
+        """Wait until the last submitted checkpoint is written"""
+        with self._condition:
+            while self._pending is not None or self._busy:
+                self._condition.wait()
+        self._raise_error()
+
+    def close(self):
+        """Write the last submitted checkpoint and stop the thread"""
+        with self._condition:
+            while self._pending is not None or self._busy:
+                self._condition.wait()
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _checkpoint_arrays(position, result):
+    # copies, since the result keeps changing while the writer works
+    arrays = dict((name, np.array(value))
+                  for (name, value) in result.statistics.to_dict().items())
+    arrays.update(format_version=SHARD_FORMAT_VERSION,
+                  key=np.array(position['key']),
+                  master_seed=position['master_seed'],
+                  block_size=position['block_size'],
+                  n_blocks=position['n_blocks'],
+                  n_done=position['n_done'])
+    return arrays
+
+
+def run_with_checkpoints(task, n_samples, master_seed, filename,
+                         block_size=1000, every=1, max_workers=1,
+                         asynchronous=True):
+    """Run an ensemble as :func:`.run_ensemble`, with checkpoints.
+
+    If `filename` exists, the run continues from that checkpoint. It must
+    come from the same operators, sampler, `master_seed`, and
+    `block_size`; `n_samples` may be larger than in the earlier run, as
+    long as the blocks done so far are the same.
+
+    Parameters
+    ----------
+    task : callable
+        `task(n_samples, seed)` returns a partial result with `merge` and
+        `statistics` (with `to_dict` and `from_dict`), and with the
+        operators and sampler used by :func:`.correlation_key`, e.g., an
+        :class:`.EnsembleTask`; `task(0, seed)` must give an empty result
+    n_samples : int
+        total number of samples
+    master_seed : int
+        seed from which all the block streams are derived
+    filename : str
+        checkpoint file
+    block_size : int
+        samples per block
+    every : int
+        number of blocks between checkpoints; a checkpoint is always
+        written at the end
+    max_workers : int or None
+        as for :func:`.run_ensemble`
+    asynchronous : bool
+        whether to write checkpoints in a background thread
+
+    Returns
+    -------
+    the merged result of all blocks
+    """
+    sizes = block_sizes(n_samples, block_size)
+    seeds = [stream_seed(master_seed, i) for i in range(len(sizes))]
+    result = task(0, stream_seed(master_seed, 0))
+    position = {'key': correlation_key(result), 'master_seed': master_seed,
+                'block_size': block_size, 'n_blocks': 0, 'n_done': 0}
+
+    if os.path.exists(filename):
+        (saved, statistics) = read_checkpoint(filename)
+        for name in ['key', 'master_seed', 'block_size']:
+            if saved[name] != position[name]:
+                raise ShardMismatchError(
+                    "%s was made with a different %s" % (filename, name)
+                )
+        if (saved['n_blocks'] > len(sizes)
+                or sum(sizes[:saved['n_blocks']]) != saved['n_done']):
+            raise ShardMismatchError(
+                "%s has %d samples in %d blocks; can't continue to %d "
+                "samples" % (filename, saved['n_done'], saved['n_blocks'],
+                             n_samples)
+            )
+        position = saved
+        result.statistics = type(result.statistics).from_dict(statistics)
+
+    first = position['n_blocks']
+    writer = CheckpointWriter(filename, asynchronous=asynchronous)
+    partials = iter_block_results(task, sizes[first:], seeds[first:],
+                                  max_workers)
+    try:
+        with writer:
+            # not zip: on Python 2, it would run all the blocks before
+            # the first checkpoint
+            for partial in partials:
+                n = sizes[position['n_blocks']]
+                if position['n_blocks'] == 0:
+                    result = partial
+                else:
+                    result.merge(partial)
+                position['n_blocks'] += 1
+                position['n_done'] += n
+                if (position['n_blocks'] % every == 0
+                        or position['n_blocks'] == len(sizes)):
+                    writer.submit(_checkpoint_arrays(position, result))
+    finally:
+        partials.close()
+    return result
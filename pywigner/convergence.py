@@ -0,0 +1,137 @@
+"""
+Convergence-driven sampling: run blocks until the error is small enough.
+
+Instead of fixing the number of trajectories in advance,
+:func:`run_until_converged` runs the blocks of :func:`.run_ensemble` one
+after another (or several at a time, in parallel) and stops after the
+first block at which every target meets its tolerance, or when the sample
+budget is used up. Since the blocks, their random streams, and the order
+of merging are those of :func:`.run_ensemble`, the result is the same as
+`run_ensemble` for the number of samples used, whatever the number of
+workers.
+"""
+import numpy as np
+from pywigner.parallel import block_sizes, stream_seed, iter_block_results
+
+
+def tolerance_ratio(mean, standard_error, atol=0.0, rtol=0.0):
+    """Standard error relative to the tolerance `atol + rtol * |mean|`.
+
+    A target has converged when its ratio is at most 1. Entries without a
+    standard error yet (fewer than 2 samples) give infinity.
+    """
+    tolerance = atol + rtol * np.abs(mean)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.asarray(standard_error) / tolerance
+    ratio = np.where(np.isnan(ratio), np.inf, ratio)
+    return ratio
+
+
+class ConvergenceReport(object):
+    """Outcome of :func:`run_until_converged`.
+
+    Attributes
+    ----------
+    result :
+        the merged result, e.g., a :class:`.CorrelationFunction`
+    n_samples : int
+        number of samples used
+    n_blocks : int
+        number of blocks used
+    converged : bool
+        whether all targets met their tolerance (otherwise, the budget
+        ran out)
+    ratio : numpy.array
+        final standard error over tolerance for each entry of the result
+    history : list of tuple
+        (n_samples, worst ratio over the targets) after each block
+    """
+    def __init__(self):
+        self.result = None
+        self.n_samples = 0
+        self.n_blocks = 0
+        self.converged = False
+        self.ratio = None
+        self.history = []
+
+    def to_dict(self):
+        return {'n_samples': self.n_samples, 'n_blocks': self.n_blocks,
+                'converged': self.converged,
+                'worst_ratio': self.history[-1][1] if self.history else None}
+
+
+def run_until_converged(task, master_seed, atol=0.0, rtol=0.0,
+                        max_samples=100000, block_size=1000,
+                        min_samples=None, targets=None, max_workers=1):
+    """Sample in blocks until the standard errors meet the tolerances.
+
+    Parameters
+    ----------
+    task : callable
+        `task(n_samples, seed)` returns a partial result with `merge`,
+        `mean`, and `standard_error`, e.g., an :class:`.EnsembleTask`
+        using `a_operator.default_sampler()`
+    master_seed : int
+        seed from which all the block streams are derived
+    atol : float or array-like
+        absolute tolerance on the standard error
+    rtol : float or array-like
+        tolerance on the standard error relative to the magnitude of the
+        mean; a target is converged when its standard error is at most
+        `atol + rtol * abs(mean)`. Arrays must broadcast to the shape of
+        `mean`.
+    max_samples : int
+        budget: the most samples to use
+    block_size : int
+        samples per block; convergence is checked after each block
+    min_samples : int or None
+        don't stop before this many samples; default one block
+    targets : array-like of bool or None
+        which entries of `mean` must converge, e.g., a mask of shape
+        (n_frames, n_b_operators) for a :class:`.CorrelationFunction`;
+        default all
+    max_workers : int or None
+        as for :func:`.run_ensemble`; with more than one worker, blocks
+        past the stopping point may be computed and then discarded
+
+    Returns
+    -------
+    :class:`ConvergenceReport`
+    """
+    if np.all(np.asarray(atol) == 0) and np.all(np.asarray(rtol) == 0):
+        raise ValueError("Need a nonzero atol or rtol")
+    if min_samples is None:
+        min_samples = block_size
+    sizes = block_sizes(max_samples, block_size)
+    seeds = [stream_seed(master_seed, i) for i in range(len(sizes))]
+
+    report = ConvergenceReport()
+    partials = iter_block_results(task, sizes, seeds, max_workers)
+    try:
+        # not zip: on Python 2, it would run all the blocks up front
+        for (i, partial) in enumerate(partials):
+            n = sizes[i]
+            if report.result is None:
+                report.result = partial
+            else:
+                report.result.merge(partial)
+            report.n_samples += n
+            report.n_blocks += 1
+            mean = np.asarray(report.result.mean)
+            report.ratio = tolerance_ratio(mean,
+                                           report.result.standard_error,
+                                           atol, rtol)
+            if targets is None:
+                selected = report.ratio
+            else:
+                mask = np.broadcast_to(np.asarray(targets, dtype=bool),
+                                       mean.shape)
+                selected = report.ratio[mask]
+            worst = float(np.max(selected)) if np.size(selected) else 0.0
+            report.history.append((report.n_samples, worst))
+            if report.n_samples >= min_samples and worst <= 1.0:
+                report.converged = True
+                break
+    finally:
+        partials.close()
+    return report
@@ -0,0 +1,99 @@
+import itertools
+import numpy as np
+from pywigner.accumulators import RunningStatistics
+from pywigner.memo import memoized
+from pywigner.operators.bank import OperatorBank
+
+class CorrelationFunction(object):
+    """Streaming LSC-IVR estimate of :math:`C_{AB}(t)`.
+
+    Each trajectory starts from an initial condition drawn from `sampler`.
+    Its contribution at frame t is the A-operator weight
+    `a_operator.correction(frame_0, sampler)` times
+    `b_operator(frame_t)`. Only running statistics for each time index and
+    B-operator are kept, so memory doesn't grow with the number of
+    trajectories. With a :class:`.MemoCache` enabled, operators shared
+    between the A- and B-operators are evaluated once per frame.
+
+    Parameters
+    ----------
+    a_operator : :class:`.Operator`
+        the operator at time 0
+    b_operators : :class:`.Operator` or list of :class:`.Operator`
+        the operator(s) at time t
+    sampler :
+        the sampler used to generate the initial conditions
+    n_frames : int
+        number of time indices to preallocate; grows as needed
+
+    Attributes
+    ----------
+    statistics : :class:`.RunningStatistics`
+        shape (n_frames, n_b_operators)
+    """
+    def __init__(self, a_operator, b_operators, sampler, n_frames=0):
+        self.a_operator = a_operator
+        try:
+            self.b_operators = list(b_operators)
+        except TypeError:
+            self.b_operators = [b_operators]
+        self.sampler = sampler
+        # for batches: B-operators that share a Gaussian are evaluated
+        # together
+        self._bank = OperatorBank(self.b_operators)
+        self.statistics = RunningStatistics((n_frames,
+                                             len(self.b_operators)))
+
+    def add_trajectory(self, trajectory):
+        """Add a trajectory, given as an iterable of snapshots."""
+        frames = iter(trajectory)
+        try:
+            first = next(frames)
+        except StopIteration:
+            return
+        weight = self.a_operator.correction(first, self.sampler)
+        values = [[weight * memoized(b, frame) for b in self.b_operators]
+                  for frame in itertools.chain([first], frames)]
+        self.statistics.add(values)
+
+    def add_batch(self, frames):
+        """Add a batch of trajectories, streamed one frame at a time.
+
+        Requires that the A-operator has a batched correction for the
+        sampler (see :meth:`.Operator.correction_batch`).
+
+        Parameters
+        ----------
+        frames : iterable of tuple
+            for each time index, (coords, momenta, elec_coords,
+            elec_momenta) stacked over the trajectories, as in
+            :meth:`.Operator.evaluate_batch`
+        """
+        weights = None
+        for (t, frame) in enumerate(frames):
+            if weights is None:
+                weights = self.a_operator.correction_batch(self.sampler,
+                                                           *frame)
+            values = weights[:, np.newaxis] * self._bank.evaluate_batch(
+                *frame
+            )
+            self.statistics.add_batch(values[:, np.newaxis, :], offset=t)
+
+    def merge(self, other):
+        """Add the trajectories accumulated by `other`."""
+        self.statistics.merge(other.statistics)
+        return self
+
+    @property
+    def n_trajectories(self):
+        count = self.statistics.count
+        return int(count[0, 0]) if len(count) > 0 else 0
+
+    @property
+    def mean(self):
+        """Estimate of C_AB(t), shape (n_frames, n_b_operators)"""
+        return self.statistics.mean
+
+    @property
+    def standard_error(self):
+        return self.statistics.standard_error
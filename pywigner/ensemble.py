@@ -0,0 +1,190 @@
+"""
+Contiguous, memory-mapped storage of sampled ensembles.
+
+An alternative to storing each initial condition (or frame) as its own
+snapshot object: all N samples x T frames of each phase-space feature are
+kept in one flat binary file, which is appended to in chunks during
+sampling and memory-mapped for analysis. Slices are views into the map,
+so they can be passed straight to :meth:`.Operator.evaluate_batch`.
+"""
+import json
+import os
+import numpy as np
+from pywigner.tools import stack_snapshots
+
+ENSEMBLE_FORMAT_VERSION = 1
+
+FEATURES = ['coordinates', 'momenta',
+            'electronic_coordinates', 'electronic_momenta']
+
+
+class EnsembleStore(object):
+    """Memory-mapped ensemble of trajectories.
+
+    Each feature is stored sample-major, as an (n_samples, n_frames,
+    n_features) array of float64, so that appending a chunk of samples is
+    a sequential write and scanning a chunk of samples is a sequential
+    read.
+
+    Use :meth:`create` to start a new store; the constructor opens an
+    existing one.
+
+    Parameters
+    ----------
+    directory : str
+        directory of the store
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(self._path('ensemble.json')) as f:
+            metadata = json.load(f)
+        if metadata['format_version'] != ENSEMBLE_FORMAT_VERSION:
+            raise ValueError("Unsupported ensemble format version: %s"
+                             % metadata['format_version'])
+        self.n_frames = metadata['n_frames']
+        self.n_coordinates = metadata['n_coordinates']
+        self.n_electronic = metadata['n_electronic']
+        self.n_samples = metadata['n_samples']
+        self._maps = {}
+
+    @classmethod
+    def create(cls, directory, n_frames, n_coordinates, n_electronic=0):
+        """Create an empty store.
+
+        Parameters
+        ----------
+        directory : str
+            directory for the store; created if needed
+        n_frames : int
+            frames per trajectory (1 for initial conditions only)
+        n_coordinates : int
+            number of (raveled) nuclear coordinates
+        n_electronic : int
+            number of electronic (MMST) coordinates; 0 if none
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        store = cls.__new__(cls)
+        store.directory = directory
+        store.n_frames = n_frames
+        store.n_coordinates = n_coordinates
+        store.n_electronic = n_electronic
+        store.n_samples = 0
+        store._maps = {}
+        for feature in store.features:
+            open(store._path(feature + '.dat'), 'wb').close()
+        store._write_metadata()
+        return store
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _write_metadata(self):
+        metadata = {'format_version': ENSEMBLE_FORMAT_VERSION,
+                    'n_frames': self.n_frames,
+                    'n_coordinates': self.n_coordinates,
+                    'n_electronic': self.n_electronic,
+                    'n_samples': self.n_samples}
+        tmp_filename = self._path('ensemble.json.tmp')
+        with open(tmp_filename, 'w') as f:
+            json.dump(metadata, f)
+        os.rename(tmp_filename, self._path('ensemble.json'))
+
+    @property
+    def features(self):
+        """Names of the features in this store"""
+        if self.n_electronic > 0:
+            return FEATURES
+        return FEATURES[:2]
+
+    def _n_features(self, feature):
+        if feature.startswith('electronic'):
+            return self.n_electronic
+        return self.n_coordinates
+
+    def append(self, coords, momenta, elec_coords=None, elec_momenta=None):
+        """Append a chunk of samples.
+
+        Arrays have shape (n_new, n_frames, n_features); if the store has
+        a single frame, (n_new, n_features) is also accepted.
+        """
+        arrays = [coords, momenta, elec_coords, elec_momenta]
+        n_new = len(coords)
+        # check all the arrays before writing any, so that a bad chunk
+        # leaves the files aligned
+        chunks = []
+        for (feature, arr) in zip(FEATURES, arrays):
+            if feature not in self.features:
+                continue
+            if arr is None:
+                raise ValueError("Missing %s for this ensemble" % feature)
+            shape = (n_new, self.n_frames, self._n_features(feature))
+            values = np.ascontiguousarray(arr, dtype=np.float64)
+            if len(values) != n_new or values.size != np.prod(shape):
+                raise ValueError("Bad shape %s for %s; expected %s"
+                                 % (values.shape, feature, shape))
+            chunks.append((feature, values.reshape(shape)))
+        for (feature, values) in chunks:
+            with open(self._path(feature + '.dat'), 'ab') as f:
+                f.write(values.tobytes())
+        self.n_samples += n_new
+        self._maps = {}
+        self._write_metadata()
+
+    def append_trajectories(self, trajectories):
+        """Append trajectories given as sequences of snapshots"""
+        trajectories = list(trajectories)
+        frames = [stack_snapshots([traj[t] for traj in trajectories])
+                  for t in range(self.n_frames)]
+        arrays = []
+        for (i, feature) in enumerate(FEATURES):
+            if feature in self.features:
+                arrays.append(np.stack([frame[i] for frame in frames],
+                                       axis=1))
+            else:
+                arrays.append(None)
+        self.append(*arrays)
+
+    def feature(self, name):
+        """Memory-mapped (n_samples, n_frames, n_features) array"""
+        if name not in self.features:
+            return None
+        if name not in self._maps:
+            shape = (self.n_samples, self.n_frames, self._n_features(name))
+            if self.n_samples == 0:
+                self._maps[name] = np.empty(shape)
+            else:
+                self._maps[name] = np.memmap(self._path(name + '.dat'),
+                                             dtype=np.float64, mode='r',
+                                             shape=shape)
+        return self._maps[name]
+
+    def frame(self, t, samples=slice(None)):
+        """Features at frame `t`, as views.
+
+        Returns
+        -------
+        tuple
+            (coords, momenta, elec_coords, elec_momenta), each of shape
+            (n_selected, n_features), suitable for `evaluate_batch`
+        """
+        result = []
+        for name in FEATURES:
+            arr = self.feature(name)
+            result.append(None if arr is None else arr[samples, t, :])
+        return tuple(result)
+
+    def frames(self, samples=slice(None)):
+        """Iterate over frames of the selected samples"""
+        for t in range(self.n_frames):
+            yield self.frame(t, samples)
+
+    def chunks(self, chunk_size):
+        """Iterate over contiguous chunks of samples.
+
+        Yields a frame iterator (see :meth:`frames`) for each chunk, e.g.,
+        for :meth:`.CorrelationFunction.add_batch`. Each chunk is a
+        sequential region of the files.
+        """
+        for start in range(0, self.n_samples, chunk_size):
+            yield self.frames(slice(start, start + chunk_size))
@@ -0,0 +1,240 @@
+"""
+Opt-in instrumentation of operator and sampler hot paths.
+
+While enabled, the evaluation methods of every :class:`.Operator` subclass
+are wrapped to record, per operator instance, call counts and wall times,
+plus running statistics of the `correction` weights. Samplers returned by
+`default_sampler` are wrapped so that their calls are recorded under the
+operator that made them. Disabling restores the original methods, so the
+disabled path costs nothing::
+
+    with Instrumentation() as inst:
+        run_my_ensemble()
+    inst.to_json("profile.json")
+
+Only subclasses that exist when instrumentation is enabled are wrapped.
+"""
+import json
+import random
+import threading
+import timeit
+import numpy as np
+from pywigner.operators import Operator
+
+INSTRUMENTED_METHODS = ['__call__', 'evaluate_batch', 'correction',
+                        'correction_batch', 'default_sampler']
+
+
+class TimingStatistics(object):
+    """Call count, total time, and a reservoir sample of call times"""
+    def __init__(self, reservoir_size=1000):
+        self.count = 0
+        self.total_time = 0.0
+        self.reservoir = []
+        self.reservoir_size = reservoir_size
+
+    def record(self, elapsed):
+        self.count += 1
+        self.total_time += elapsed
+        if len(self.reservoir) < self.reservoir_size:
+            self.reservoir.append(elapsed)
+        else:
+            i = random.randint(0, self.count - 1)
+            if i < self.reservoir_size:
+                self.reservoir[i] = elapsed
+
+    def to_dict(self):
+        dct = {'count': self.count, 'total_time': self.total_time}
+        if self.reservoir:
+            percentiles = np.percentile(self.reservoir, [50, 90, 99])
+            dct.update({'p50': percentiles[0], 'p90': percentiles[1],
+                        'p99': percentiles[2]})
+        return dct
+
+
+class WeightStatistics(object):
+    """Running statistics of correction weights.
+
+    The effective sample size is :math:`(\\sum w)^2 / \\sum w^2`.
+    """
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.sum_sq = 0.0
+        self.max = -np.inf
+
+    def record(self, weights):
+        weights = np.atleast_1d(np.asarray(weights, dtype=float))
+        if len(weights) == 0:
+            return
+        self.count += len(weights)
+        self.sum += float(weights.sum())
+        self.sum_sq += float((weights * weights).sum())
+        self.max = max(self.max, float(weights.max()))
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else float('nan')
+
+    @property
+    def effective_sample_size(self):
+        return self.sum**2 / self.sum_sq if self.sum_sq else float('nan')
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'max': self.max,
+                'effective_sample_size': self.effective_sample_size}
+
+
+class OperatorStatistics(object):
+    """Everything recorded for one operator instance"""
+    def __init__(self, label, reservoir_size=1000):
+        self.label = label
+        self.reservoir_size = reservoir_size
+        self.timings = {}
+        self.weights = WeightStatistics()
+
+    def timing(self, name):
+        try:
+            return self.timings[name]
+        except KeyError:
+            stats = TimingStatistics(self.reservoir_size)
+            self.timings[name] = stats
+            return stats
+
+    def to_dict(self):
+        return {'label': self.label,
+                'timings': dict((name, t.to_dict())
+                                for (name, t) in self.timings.items()),
+                'weights': self.weights.to_dict()}
+
+
+class InstrumentedSampler(object):
+    """Wraps a sampler to time its calls; other attributes pass through"""
+    def __init__(self, sampler, statistics):
+        self._sampler = sampler
+        self._statistics = statistics
+
+    def __getattr__(self, name):
+        if name in ('_sampler', '_statistics'):
+            raise AttributeError(name)
+        return getattr(self._sampler, name)
+
+    def __call__(self, snapshot):
+        start = timeit.default_timer()
+        result = self._sampler(snapshot)
+        elapsed = timeit.default_timer() - start
+        self._statistics.timing('sampler.__call__').record(elapsed)
+        return result
+
+    def generate_initial_snapshot(self, snapshot):
+        start = timeit.default_timer()
+        result = self._sampler.generate_initial_snapshot(snapshot)
+        elapsed = timeit.default_timer() - start
+        timing = self._statistics.timing('sampler.generate_initial_snapshot')
+        timing.record(elapsed)
+        return result
+
+
+def _all_subclasses(cls):
+    result = [cls]
+    for sub in cls.__subclasses__():
+        result.extend(c for c in _all_subclasses(sub) if c not in result)
+    return result
+
+
+class Instrumentation(object):
+    """Records per-operator statistics while enabled.
+
+    Parameters
+    ----------
+    reservoir_size : int
+        number of call times kept (per operator and method) to estimate
+        percentiles
+    """
+    def __init__(self, reservoir_size=1000):
+        self.reservoir_size = reservoir_size
+        self.statistics = {}
+        self._originals = []
+        self._active = threading.local()
+
+    def statistics_for(self, operator):
+        key = id(operator)
+        try:
+            return self.statistics[key]
+        except KeyError:
+            label = "%s@%x" % (type(operator).__name__, key)
+            stats = OperatorStatistics(label, self.reservoir_size)
+            self.statistics[key] = stats
+            return stats
+
+    def _wrap(self, name, method):
+        instrumentation = self
+
+        def wrapped(operator, *args, **kwargs):
+            # inner calls on the same operator and method (e.g., super())
+            # are part of the outer call
+            active = instrumentation._active.__dict__.setdefault('calls',
+                                                                 set())
+            call = (id(operator), name)
+            if call in active:
+                return method(operator, *args, **kwargs)
+            active.add(call)
+            try:
+                start = timeit.default_timer()
+                result = method(operator, *args, **kwargs)
+                elapsed = timeit.default_timer() - start
+            finally:
+                active.discard(call)
+            stats = instrumentation.statistics_for(operator)
+            stats.timing(name).record(elapsed)
+            if name.startswith('correction'):
+                stats.weights.record(result)
+            elif name == 'default_sampler':
+                result = InstrumentedSampler(result, stats)
+            return result
+
+        wrapped.__name__ = method.__name__
+        wrapped.__doc__ = method.__doc__
+        return wrapped
+
+    @property
+    def enabled(self):
+        return len(self._originals) > 0
+
+    def enable(self):
+        if self.enabled:
+            return self
+        for cls in _all_subclasses(Operator):
+            for name in INSTRUMENTED_METHODS:
+                if name in cls.__dict__:
+                    method = cls.__dict__[name]
+                    self._originals.append((cls, name, method))
+                    setattr(cls, name, self._wrap(name, method))
+        return self
+
+    def disable(self):
+        for (cls, name, method) in reversed(self._originals):
+            setattr(cls, name, method)
+        self._originals = []
+        return self
+
+    def __enter__(self):
+        return self.enable()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disable()
+
+    def reset(self):
+        self.statistics = {}
+
+    def report(self):
+        """All statistics as a JSON-serializable list of dicts"""
+        return [stats.to_dict() for stats in self.statistics.values()]
+
+    def to_json(self, filename=None):
+        """Export the report as JSON; returns the string if no filename"""
+        text = json.dumps(self.report(), indent=2, sort_keys=True)
+        if filename is None:
+            return text
+        with open(filename, 'w') as f:
+            f.write(text)
@@ -0,0 +1,85 @@
+"""
+Numerical kernels for operators, with no dependencies beyond numpy.
+"""
+import numpy as np
+
+# _fock_table[n, k] is the coefficient of z**k in (-1)**n L_n(z); grown on
+# demand by fock_coefficients
+_fock_table = np.array([[1.0]])
+
+def fock_coefficients(excitons):
+    """Polynomial coefficients of the Fock state correction.
+
+    Row i gives the coefficients (lowest order first) of
+    :math:`(-1)^n L_n(z)` for `n = excitons[i]`, zero-padded to the largest
+    exciton count. The coefficients are cached, so this is just indexing
+    after the first call for a given maximum `n`.
+
+    Parameters
+    ----------
+    excitons : numpy.array of int
+
+    Returns
+    -------
+    numpy.array
+        shape (len(excitons), max(excitons) + 1)
+    """
+    global _fock_table
+    excitons = np.asarray(excitons, dtype=int)
+    max_n = int(excitons.max()) if len(excitons) > 0 else 0
+    if max_n >= len(_fock_table):
+        table = np.zeros((max_n + 1, max_n + 1))
+        for n in range(max_n + 1):
+            # L_n(z) = sum_k (-1)^k binom(n, k) z^k / k!
+            coeff = 1.0
+            for k in range(n + 1):
+                table[n, k] = (-1.0)**(n + k) * coeff
+                coeff *= float(n - k) / ((k + 1)**2)
+        _fock_table = table
+    return _fock_table[excitons, :max_n + 1]
+
+
+def excited_factors(dx, dp, excitons, coefficients=None):
+    """Ratio of excited to ground state Wigner functions, per dof.
+
+    For n excitons, this is :math:`(-1)^n L_n(2 r^2)` with
+    :math:`r^2 = \delta x^2 + \delta p^2`; for n=1 that is
+    :math:`2 (r^2 - 1/2)`. The polynomials are evaluated by Horner's rule
+    for all dofs and samples at once.
+
+    Parameters
+    ----------
+    dx : numpy.array
+        displacements from the center in position, shape (n_samples, k)
+    dp : numpy.array
+        displacements from the center in momentum, shape (n_samples, k)
+    excitons : numpy.array
+        number of excitons for each of the k dofs
+    coefficients : numpy.array or None
+        precomputed `fock_coefficients(excitons)`
+
+    Returns
+    -------
+    numpy.array
+        shape (n_samples, k)
+    """
+    if coefficients is None:
+        coefficients = fock_coefficients(excitons)
+    z = 2.0*(dx*dx + dp*dp)
+    result = np.ones_like(z) * coefficients[:, -1]
+    for order in range(coefficients.shape[1] - 2, -1, -1):
+        result = result * z + coefficients[:, order]
+    return result
+
+
+def default_exciton_sampling_ratio(n_excitons):
+    """Sampling ratio for exciton counts missing from the ratio dict.
+
+    The Wigner function of the n-th Fock state has :math:`<r^2>` larger by
+    a factor of :math:`2n + 1` than the ground state, so we sample from a
+    Gaussian that is wider by that factor. This holds for every n, so the
+    sampler gets wider as n grows; for n = 1, it is close to the ratio that
+    minimizes the variance of the corrections (about 0.46 for gamma = 1;
+    see :meth:`.CoherentProjection.tune_exciton_sampling_ratios`).
+    """
+    return 1.0 / (2*n_excitons + 1)
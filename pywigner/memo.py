@@ -0,0 +1,133 @@
+"""
+Opt-in memoization of per-snapshot operator and sampler values.
+
+In a typical analysis, every frame is evaluated by several B-operators
+that share factors (e.g., the same nuclear :class:`.CoherentProjection`),
+and the first frame is evaluated again inside `correction`. While a
+:class:`MemoCache` is enabled, those evaluations go through the cache, so
+no factor is computed twice for the same frame::
+
+    with MemoCache(max_size=10000) as cache:
+        corr.add_trajectory(trajectory)
+    print(cache.hits, cache.misses)
+
+Entries are keyed on the identities of the snapshot and of the operator
+(or sampler), plus the operator's `_version`, so exciting a projection
+invalidates its entries. Products and sums derive their `_version` from
+those of their terms, so their entries are invalidated too. Snapshots are
+assumed not to change in place.
+The cache holds references to the snapshots and operators of its
+entries, so an identity can't be reused by a new object while its entry
+is cached.
+"""
+import collections
+import threading
+
+# per thread, the stack of enabled caches; the last one is used
+_state = threading.local()
+
+
+def active_cache():
+    """The enabled :class:`MemoCache` of this thread, or None"""
+    stack = getattr(_state, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def memoized(function, snapshot):
+    """`function(snapshot)`, through the enabled cache if there is one"""
+    cache = active_cache()
+    if cache is None:
+        return function(snapshot)
+    return cache.lookup(function, snapshot)
+
+
+class MemoCache(object):
+    """Bounded LRU cache of `function(snapshot)` values.
+
+    Parameters
+    ----------
+    max_size : int
+        maximum number of entries; the least recently used entry is
+        evicted to make room
+
+    Attributes
+    ----------
+    hits : int
+        lookups answered from the cache
+    misses : int
+        lookups that had to evaluate
+    evictions : int
+        entries dropped to stay within `max_size`
+    """
+    def __init__(self, max_size=4096):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self.reset_counters()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+        """Drop all entries (the counters are kept)"""
+        self._entries.clear()
+
+    def lookup(self, function, snapshot):
+        """`function(snapshot)`, evaluated only if not cached"""
+        key = (id(function), getattr(function, '_version', None),
+               id(snapshot))
+        try:
+            (_, _, value) = self._entries[key]
+        except KeyError:
+            pass
+        else:
+            # move to the most recently used end
+            del self._entries[key]
+            self._entries[key] = (function, snapshot, value)
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = function(snapshot)
+        self._entries[key] = (function, snapshot, value)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups > 0 else 0.0
+
+    @property
+    def enabled(self):
+        return self in getattr(_state, 'stack', [])
+
+    def enable(self):
+        stack = _state.__dict__.setdefault('stack', [])
+        stack.append(self)
+        return self
+
+    def disable(self):
+        stack = getattr(_state, 'stack', [])
+        if self in stack:
+            # remove the most recent activation of this cache
+            del stack[len(stack) - 1 - stack[::-1].index(self)]
+        return self
+
+    def __enter__(self):
+        return self.enable()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disable()
+
+    def to_dict(self):
+        return {'max_size': self.max_size, 'size': len(self),
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
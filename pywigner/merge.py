@@ -0,0 +1,73 @@
+"""
+Reduce shard files into a final estimate.
+
+Shards are read one at a time, so any number of them can be merged. From
+the command line::
+
+    python -m pywigner.merge -o merged.npz shard_*.npz
+
+prints the mean and standard error for each time index and B-operator,
+and optionally writes the merged result as a new shard.
+"""
+import argparse
+import sys
+import numpy as np
+from pywigner.shards import read_shard, write_statistics, ShardMismatchError
+
+def merge_shards(filenames, key=None):
+    """Merge shard files.
+
+    Parameters
+    ----------
+    filenames : iterable of str
+        shard files
+    key : str or None
+        expected key (see :func:`.correlation_key`); if None, all shards
+        must match the first
+
+    Returns
+    -------
+    tuple
+        (key, statistics) for the merged result
+    """
+    merged = None
+    for filename in filenames:
+        (shard_key, statistics) = read_shard(filename)
+        if key is None:
+            key = shard_key
+        if shard_key != key:
+            raise ShardMismatchError(
+                "%s was made with different operators or sampler" % filename
+            )
+        if merged is None:
+            merged = statistics
+        else:
+            merged.merge(statistics)
+    if merged is None:
+        raise ValueError("No shards to merge")
+    return (key, merged)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Merge pyWigner shard files"
+    )
+    parser.add_argument('shards', nargs='+', help="shard files")
+    parser.add_argument('-o', '--output', help="write merged shard here")
+    args = parser.parse_args(argv)
+
+    (key, statistics) = merge_shards(args.shards)
+    if args.output:
+        write_statistics(args.output, key, statistics)
+
+    mean = np.atleast_2d(statistics.mean)
+    error = np.atleast_2d(statistics.standard_error)
+    count = np.atleast_2d(statistics.count)
+    for t in range(mean.shape[0]):
+        columns = ["%g +/- %g" % (m, e) for (m, e) in zip(mean[t], error[t])]
+        sys.stdout.write("%d\t%d\t%s\n" % (t, count[t].min(),
+                                          "\t".join(columns)))
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
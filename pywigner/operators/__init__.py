@@ -1,2 +1,15 @@
-from operators import Operator, ProductOperator
-from coherent_states import CoherentProjection, ElectronicCoherentProjection
+from pywigner.operators.operators import (
+    Operator, ProductOperator, SumOperator
+)
+from pywigner.operators.coherent_states import (
+    CoherentProjection, ElectronicCoherentProjection
+)
+from pywigner.operators.bank import OperatorBank
+from pywigner.operators.grid import ProjectionGrid
+from pywigner.operators.grid_wigner import (
+    GridWignerOperator, GridWignerSampler
+)
+from pywigner.operators.polynomial import (
+    PolynomialOperator, ElectronicPolynomialOperator, PositionOperator,
+    MomentumOperator
+)
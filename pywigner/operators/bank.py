@@ -0,0 +1,268 @@
+import numpy as np
+from pywigner.tools import stack_snapshots, signed_log
+from pywigner.kernels import fock_coefficients, excited_factors
+from pywigner.operators.coherent_states import CoherentProjection
+
+
+class _GaussianGroup(object):
+    """Coherent projections on the same features, dofs, and widths.
+
+    They share the prefactor, and the Gaussian separates by dof, so it is
+    built from small per-dof tables instead of being evaluated for each
+    operator. Dofs on which all the operators have the same center give a
+    single shared exponent for each sample. On the other dofs, each
+    distinct center gets a column of the table, and each operator gathers
+    its columns; for projections centered on an M x N grid of (x0, p0),
+    that takes M + N exponentials per sample instead of M N.
+
+    Likewise, each distinct (dof, exciton number, center) needs its excited
+    factor computed once, and is gathered into the product for each
+    operator.
+    """
+    def __init__(self, operators, columns):
+        self.reader = operators[0]
+        self.columns = np.array(columns, dtype=int)
+        self.gamma = self.reader.gamma
+        self.inv_gamma = self.reader.inv_gamma
+        self.log_prefactor = self.reader._log_prefactor
+        x0 = np.array([op.x0 for op in operators])
+        p0 = np.array([op.p0 for op in operators])
+        self.x_part = self._centers(x0, self.gamma)
+        self.p_part = self._centers(p0, self.inv_gamma)
+        # table_index[k] lists the table columns of operator k; the
+        # columns of the p table follow those of the x table
+        n_x_columns = len(self.x_part[1][0])
+        self.table_index = np.concatenate(
+            [self.x_part[1][3], n_x_columns + self.p_part[1][3]], axis=1
+        )
+
+        pairs = []
+        for (op, x, p) in zip(operators, x0, p0):
+            pairs.extend((int(d), int(n), x[d], p[d])
+                         for (d, n) in zip(op._excited, op._excited_n))
+        pairs = sorted(set(pairs))
+        pair_index = dict((pair, i) for (i, pair) in enumerate(pairs))
+        self.pair_dofs = np.array([pair[0] for pair in pairs], dtype=int)
+        self.pair_n = np.array([pair[1] for pair in pairs], dtype=int)
+        self.pair_x0 = np.array([pair[2] for pair in pairs])
+        self.pair_p0 = np.array([pair[3] for pair in pairs])
+        self.pair_coefficients = fock_coefficients(self.pair_n)
+        # factor_index[k] lists the pairs of operator k, padded with
+        # len(pairs), which is a column of ones
+        width = max(len(op._excited) for op in operators)
+        self.factor_index = np.full((len(operators), width), len(pairs),
+                                    dtype=int)
+        for (k, (op, x, p)) in enumerate(zip(operators, x0, p0)):
+            for (j, (d, n)) in enumerate(zip(op._excited, op._excited_n)):
+                self.factor_index[k, j] = pair_index[(int(d), int(n),
+                                                      x[d], p[d])]
+
+    @staticmethod
+    def _centers(centers, widths):
+        """For one of x or p: (shared dofs, their centers and widths) and
+        (table dofs, table centers, table widths, table_index), from the
+        (n_operators, n_dofs) centers"""
+        shared = np.all(centers == centers[0], axis=0)
+        fixed = np.flatnonzero(shared)
+        table_dofs = []
+        table_centers = []
+        table_index = []
+        for dof in np.flatnonzero(~shared):
+            (unique, inverse) = np.unique(centers[:, dof],
+                                          return_inverse=True)
+            table_index.append(len(table_dofs) + np.ravel(inverse))
+            table_dofs.extend([dof] * len(unique))
+            table_centers.extend(unique)
+        table_dofs = np.array(table_dofs, dtype=int)
+        table_index = (np.array(table_index, dtype=int).T if table_index
+                       else np.zeros((len(centers), 0), dtype=int))
+        return ((fixed, centers[0, fixed], widths[fixed]),
+                (table_dofs, np.array(table_centers), widths[table_dofs],
+                 table_index))
+
+    @staticmethod
+    def _exponents(values, part):
+        """(shared exponent for each sample, table of exponents for each
+        sample and distinct center)"""
+        ((fixed, fixed_centers, fixed_widths),
+         (table_dofs, table_centers, table_widths, _)) = part
+        delta = values[:, fixed] - fixed_centers
+        shared = np.dot(delta*delta, fixed_widths)
+        delta = values[:, table_dofs] - table_centers
+        return (shared, table_widths * delta*delta)
+
+    def parts(self, batch, log=False):
+        """(log_gaussian, varying, excited) on a batch.
+
+        `log_gaussian` is the log of the part of the Gaussian shared by all
+        the operators (with the prefactor), for each sample. For each
+        sample and operator, `varying` is the rest of the Gaussian (its log
+        if `log`), and `excited` is the excited part. Either of the last
+        two is None if it is the same for all the operators.
+        """
+        features = self.reader._batch_features(*batch)
+        x = self.reader._select_batch(features[0])
+        p = self.reader._select_batch(features[1])
+        (shared_x, table_x) = self._exponents(x, self.x_part)
+        (shared_p, table_p) = self._exponents(p, self.p_part)
+        log_gaussian = self.log_prefactor - shared_x - shared_p
+
+        varying = None
+        if self.table_index.shape[1] > 0:
+            table = -np.concatenate([table_x, table_p], axis=1)
+            combine = np.add if log else np.multiply
+            if not log:
+                table = np.exp(table, out=table)
+            varying = np.take(table, self.table_index[:, 0], axis=1)
+            for j in range(1, self.table_index.shape[1]):
+                combine(varying, np.take(table, self.table_index[:, j],
+                                         axis=1), out=varying)
+
+        excited = None
+        if self.factor_index.shape[1] > 0:
+            factors = np.empty((len(x), len(self.pair_dofs) + 1))
+            factors[:, :-1] = excited_factors(
+                x[:, self.pair_dofs] - self.pair_x0,
+                p[:, self.pair_dofs] - self.pair_p0,
+                self.pair_n, self.pair_coefficients
+            )
+            factors[:, -1] = 1.0
+            excited = np.take(factors, self.factor_index[:, 0], axis=1)
+            for j in range(1, self.factor_index.shape[1]):
+                excited *= np.take(factors, self.factor_index[:, j], axis=1)
+        return (log_gaussian, varying, excited)
+
+
+class OperatorBank(object):
+    """Many operators, evaluated together on the same samples or frames.
+
+    Coherent projections on the same features, dofs, and widths are
+    evaluated together. If they differ only in their excitons (e.g., all
+    the electronic populations
+    `ElectronicCoherentProjection.with_n_dofs(n).excite(k)`), they share one
+    evaluation of the Gaussian, and their excited parts are computed in one
+    vectorized pass, so evaluating all of them costs about as much as
+    evaluating one. If their centers differ (e.g., projections on a
+    phase-space grid), the Gaussian is built from per-dof tables of the
+    distinct centers. Other operators are evaluated on their own.
+
+    The bank is compiled on first use, and recompiled when the dofs or
+    excitons of one of its operators change.
+
+    Parameters
+    ----------
+    operators : list of :class:`.Operator`
+        the operators; column k of the results is `operators[k]`
+    """
+    def __init__(self, operators):
+        self.operators = list(operators)
+        self._compiled = (None, None)
+
+    def __len__(self):
+        return len(self.operators)
+
+    @staticmethod
+    def _group_key(op):
+        # projections with equal keys differ at most in centers and
+        # excitons
+        if not isinstance(op, CoherentProjection):
+            return None
+        return (op._feature_names, tuple(op._global_dofs()),
+                op.gamma.tobytes())
+
+    def _groups(self):
+        """(groups, others): the Gaussian groups, and (column, operator)
+        for everything else"""
+        key = tuple((id(op), getattr(op, '_version', None))
+                    for op in self.operators)
+        (compiled_key, compiled) = self._compiled
+        if compiled_key == key:
+            return compiled
+        members = {}
+        order = []
+        others = []
+        for (column, op) in enumerate(self.operators):
+            group_key = self._group_key(op)
+            if group_key is None:
+                others.append((column, op))
+                continue
+            if group_key not in members:
+                members[group_key] = []
+                order.append(group_key)
+            members[group_key].append((column, op))
+        groups = [_GaussianGroup([op for (_, op) in members[k]],
+                                 [column for (column, _) in members[k]])
+                  for k in order]
+        compiled = (groups, others)
+        self._compiled = (key, compiled)
+        return compiled
+
+    def _evaluate(self, batch, log):
+        # tuple of (n_samples, n_operators) arrays: (values,) or
+        # (signs, log_values)
+        (groups, others) = self._groups()
+        parts = []
+        for group in groups:
+            (log_gaussian, varying, excited) = group.parts(batch, log)
+            shape = (len(log_gaussian), len(group.columns))
+            if log:
+                if excited is None:
+                    (signs, log_values) = (np.ones(shape), np.zeros(shape))
+                else:
+                    (signs, log_values) = signed_log(excited)
+                log_values += log_gaussian[:, np.newaxis]
+                if varying is not None:
+                    log_values += varying
+                parts.append((group.columns, (signs, log_values)))
+            else:
+                values = np.empty(shape)
+                values[...] = np.exp(log_gaussian)[:, np.newaxis]
+                for factor in (varying, excited):
+                    if factor is not None:
+                        values *= factor
+                parts.append((group.columns, (values,)))
+        for (column, op) in others:
+            if log:
+                parts.append((column, op.log_value_batch(*batch)))
+            else:
+                parts.append((column, (op.evaluate_batch(*batch),)))
+        if len(groups) == 1 and not others:
+            # a single group has all the columns, in order
+            return parts[0][1]
+        shape = (len(batch[0]), len(self.operators))
+        results = tuple(np.empty(shape) for _ in range(2 if log else 1))
+        for (columns, values) in parts:
+            for (result, value) in zip(results, values):
+                result[:, columns] = value
+        return results
+
+    def log_value_batch(self, coords, momenta, elec_coords=None,
+                        elec_momenta=None):
+        """(signs, log_magnitudes) of all operators on all samples.
+
+        Arrays are as in :meth:`.Operator.evaluate_batch`.
+
+        Returns
+        -------
+        tuple
+            (signs, log_magnitudes), each with shape
+            (n_samples, n_operators)
+        """
+        return self._evaluate((coords, momenta, elec_coords, elec_momenta),
+                              log=True)
+
+    def evaluate_batch(self, coords, momenta, elec_coords=None,
+                       elec_momenta=None):
+        """Values of all operators on all samples, shape
+        (n_samples, n_operators)"""
+        return self._evaluate((coords, momenta, elec_coords, elec_momenta),
+                              log=False)[0]
+
+    def evaluate_trajectory(self, trajectory):
+        """Values of all operators on each frame, shape
+        (n_frames, n_operators)"""
+        return self.evaluate_batch(*stack_snapshots(trajectory))
+
+    def __call__(self, snapshot):
+        """Values of all operators on one snapshot, shape (n_operators,)"""
+        return self.evaluate_trajectory([snapshot])[0]
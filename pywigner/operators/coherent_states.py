@@ -1,8 +1,14 @@
-from pywigner.tools import clean_ravel
-from pywigner.operators import Operator
-import pywigner as lsc
-import dynamiq_samplers as samplers
+from pywigner.tools import clean_ravel, as_batch, signed_log, DofIndex
+from pywigner.kernels import (
+    fock_coefficients, excited_factors, default_exciton_sampling_ratio
+)
+from pywigner.operators.operators import Operator
 import numpy as np
+import itertools
+
+# every change to a projection's dofs or excitons gets a new version, so
+# that compiled products know when to recompile
+_versions = itertools.count()
 
 def raveled_numpyify(arr):
     try:
@@ -11,14 +17,30 @@ def raveled_numpyify(arr):
         retval = np.array(arr).ravel()
     return retval
 
+
+def _binomial(n, k):
+    result = 1.0
+    for i in range(k):
+        result *= float(n - i) / (i + 1)
+    return result
+
+
+def _double_factorial(n):
+    result = 1.0
+    while n > 1:
+        result *= n
+        n -= 2
+    return result
+
+
 class CoherentProjection(Operator):
     """
     Coherent projection operator: :math:`|x_0 p_0; \gamma><x_0 p_0; \gamma|`.
 
     Technically, this will support not only coherent states, but all
-    harmonic oscillator wavefunctions. Currently, we only allow at most 1
-    exciton per dof. Excited states can either be set as a list of exciton
-    counts by degree of freedom, or using the `.excite()` method.
+    harmonic oscillator wavefunctions, with any number of excitons per
+    dof. Excited states can either be set as a list of exciton counts by
+    degree of freedom, or using the `.excite()` method.
 
     Notes
     -----
@@ -43,19 +65,27 @@ class CoherentProjection(Operator):
 
     Using excited state wavepackets (for which we assume that the coherent
     state is the ground state of some harmonic oscillator, and then we
-    excite a mode) gives a very simple correction to this. So far, the code
-    only supports the first excitation, where the correction is
+    excite a mode) gives a very simple correction to this:
 
     .. math::
-        (|x_0 p_0; \gamma, n=1><x_0 p_0; \gamma, n=1|)_W(q, p) =
-        D_1(q, p) (|x_0 p_0; \gamma><x_0 p_0; \gamma|)_W(q, p)
+        (|x_0 p_0; \gamma, n><x_0 p_0; \gamma, n|)_W(q, p) =
+        D_n(q, p) (|x_0 p_0; \gamma><x_0 p_0; \gamma|)_W(q, p)
 
     where
 
     .. math::
-        D_1(q, p) = ???
-        
+        D_n(q, p) = (-1)^n L_n(2 r^2), \qquad r^2 = (q-x_0)^2 + (p-p_0)^2
+
+    and :math:`L_n` is the n-th Laguerre polynomial; see
+    :func:`excited_factors`. The sampling ratio for exciton counts that
+    aren't in `exciton_sampling_ratios` comes from
+    :func:`default_exciton_sampling_ratio`.
+
 
+    The per-dof parameters are stored packed, as the rows of one
+    (4, n_dofs) array (x0, p0, gamma, inv_gamma), and the excitons as an
+    integer array, so that large numbers of projections (see
+    :meth:`from_arrays`) are cheap to build and to store.
 
     Attributes
     ----------
@@ -65,74 +95,450 @@ class CoherentProjection(Operator):
     dofs : list
     excitons : list
     """
+    _fusion_key = 'nuclear'
+    # snapshot attributes read by this operator (see _snapshot_features)
+    _feature_names = ('coordinates', 'momenta')
+    # rows of the packed parameter array
+    _X0, _P0, _GAMMA, _INV_GAMMA = range(4)
+
     def __init__(self, x0, p0, gamma, dofs=None, excitons=0):
-        # set gaussian parameters
-        self.x0 = raveled_numpyify(x0)
-        self.p0 = raveled_numpyify(p0)
-        self.gamma = raveled_numpyify(gamma)
-        self.inv_gamma = 1.0 / self.gamma
-        self.dofs = dofs
-        if self.dofs is None:
-            self.n_dofs = len(list(self.x0))
-        else:
-            self.n_dofs = len(dofs)
+        x0 = raveled_numpyify(x0)
+        p0 = raveled_numpyify(p0)
+        gamma = raveled_numpyify(gamma)
 
         # sanity checks for bad input
-        assert(len(self.x0) == len(self.p0))
-        assert(len(self.gamma) == len(self.x0))
-        assert(len(self.p0) == self.n_dofs)
+        assert(len(x0) == len(p0))
+        assert(len(gamma) == len(x0))
+
+        # gaussian parameters, packed as one (4, n_dofs) array
+        parameters = np.empty((4, len(x0)))
+        parameters[self._X0] = x0
+        parameters[self._P0] = p0
+        parameters[self._GAMMA] = gamma
+        parameters[self._INV_GAMMA] = 1.0 / parameters[self._GAMMA]
+        self._initialize(parameters)
+        self.dofs = dofs
+        # set up excitons: must be done AFTER setting self.n_dofs
+        self.excitons = excitons
+
+    def _initialize(self, parameters):
+        """Everything but the dofs and excitons, from packed parameters"""
+        self._parameters = parameters
+        self.n_dofs = parameters.shape[1]
+
+        self._gaussian_x = None
+        self._gaussian_p = None
+
+        # total factor in front of exp(-gamma dx^2 - dp^2/gamma); this is
+        # norm * gaussian_x.norm * gaussian_p.norm, but those overflow and
+        # underflow separately when there are many dofs
+        self._prefactor = 2.0**self.n_dofs
+        self._log_prefactor = self.n_dofs * np.log(2.0)
+
+        # set the sampling_gamma
+        # sampling_gamma = sampling_ratio[n_exciton]*gamma
+        # sampling_inv_gamma = sampling_ratio[n_exciton]*inv_gamma
+        # excited dofs use default_exciton_sampling_ratio
+        self.exciton_sampling_ratios = {0 : 1.0}
+
+    @classmethod
+    def from_arrays(cls, x0, p0, gamma, dofs=None, excitons=0):
+        """Many projections at once, from stacked parameters.
+
+        This is much faster than calling the constructor for each
+        projection, e.g., for one projection per point of a phase-space
+        grid. The projections share one parameter array (each one's
+        parameters are a view of it), and projections with the same
+        excitons share their exciton arrays.
+
+        Parameters
+        ----------
+        x0, p0, gamma : array-like
+            shape (n_projections, n_dofs); 1D arrays are used for all
+            projections
+        dofs : list or None
+            dofs of all the projections
+        excitons : int or array-like of int
+            scalar, (n_dofs,), or (n_projections, n_dofs)
+
+        Returns
+        -------
+        list of :class:`CoherentProjection`
+        """
+        (x0, p0, gamma) = np.broadcast_arrays(
+            *[np.atleast_2d(np.asarray(a, dtype=float))
+              for a in (x0, p0, gamma)]
+        )
+        (n_projections, n_dofs) = x0.shape
+        if dofs is not None:
+            assert(len(dofs) == n_dofs)
+        parameters = np.empty((n_projections, 4, n_dofs))
+        parameters[:, cls._X0] = x0
+        parameters[:, cls._P0] = p0
+        parameters[:, cls._GAMMA] = gamma
+        parameters[:, cls._INV_GAMMA] = 1.0 / gamma
+        excitons = np.broadcast_to(np.asarray(excitons, dtype=int),
+                                   (n_projections, n_dofs))
+        # exciton arrays, shared by the projections with the same excitons
+        exciton_arrays = {}
+        dof_index = DofIndex(dofs)
+
+        projections = []
+        for k in range(n_projections):
+            row = excitons[k].tobytes()
+            if row not in exciton_arrays:
+                exciton_arrays[row] = cls._exciton_arrays(excitons[k],
+                                                          n_dofs)
+            op = cls.__new__(cls)
+            op._initialize(parameters[k])
+            op._dofs = dofs
+            op._dof_index = dof_index
+            op._x_buffer = np.empty(n_dofs)
+            op._p_buffer = np.empty(n_dofs)
+            (op._excitons, op._excited, op._excited_n,
+             op._excited_coefficients) = exciton_arrays[row]
+            op._version = next(_versions)
+            projections.append(op)
+        return projections
+
+    def to_dict(self):
+        """Parameters as arrays: packed (x0, p0, gamma) rows, and the dofs
+        and excitons as integer arrays"""
+        ratios = sorted(self.exciton_sampling_ratios.items())
+        return {
+            'parameters': self._parameters[:self._INV_GAMMA].copy(),
+            'dofs': (None if self.dofs is None
+                     else np.asarray(self.dofs, dtype=int)),
+            'excitons': self._excitons.copy(),
+            'sampling_excitons': np.array([n for (n, _) in ratios],
+                                          dtype=int),
+            'sampling_ratios': np.array([r for (_, r) in ratios])
+        }
+
+    @classmethod
+    def from_dict(cls, dct):
+        packed = np.asarray(dct['parameters'], dtype=float)
+        parameters = np.empty((4, packed.shape[1]))
+        parameters[:cls._INV_GAMMA] = packed
+        parameters[cls._INV_GAMMA] = 1.0 / packed[cls._GAMMA]
+        op = cls.__new__(cls)
+        op._initialize(parameters)
+        dofs = dct['dofs']
+        op.dofs = None if dofs is None else [int(d) for d in dofs]
+        op.excitons = dct['excitons']
+        op.exciton_sampling_ratios = dict(
+            (int(n), float(r)) for (n, r) in zip(dct['sampling_excitons'],
+                                                 dct['sampling_ratios'])
+        )
+        return op
+
+    def _set_parameter(self, row, val):
+        val = raveled_numpyify(val)
+        if len(val) != self.n_dofs:
+            raise ValueError("Need %d values, one per dof; got %d"
+                             % (self.n_dofs, len(val)))
+        self._parameters[row] = val
+        if row == self._GAMMA:
+            self._parameters[self._INV_GAMMA] = 1.0 / self._parameters[row]
+        elif row == self._INV_GAMMA:
+            self._parameters[self._GAMMA] = 1.0 / self._parameters[row]
+        self._gaussian_x = None
+        self._gaussian_p = None
+        self._version = next(_versions)
+
+    def _parameter(self, row):
+        # read-only, so that the parameters only change through the
+        # setters, which keep gamma and inv_gamma consistent and bump the
+        # version (fused products and memo caches depend on it)
+        view = self._parameters[row]
+        view.flags.writeable = False
+        return view
+
+    # x0, p0, gamma, and inv_gamma are read-only views of the packed
+    # parameters; assign to them to change them
+    @property
+    def x0(self):
+        return self._parameter(self._X0)
+
+    @x0.setter
+    def x0(self, val):
+        self._set_parameter(self._X0, val)
+
+    @property
+    def p0(self):
+        return self._parameter(self._P0)
+
+    @p0.setter
+    def p0(self, val):
+        self._set_parameter(self._P0, val)
+
+    @property
+    def gamma(self):
+        return self._parameter(self._GAMMA)
+
+    @gamma.setter
+    def gamma(self, val):
+        self._set_parameter(self._GAMMA, val)
+
+    @property
+    def inv_gamma(self):
+        return self._parameter(self._INV_GAMMA)
+
+    @inv_gamma.setter
+    def inv_gamma(self, val):
+        self._set_parameter(self._INV_GAMMA, val)
 
-        self.gaussian_x = samplers.tools.GaussianFunction(x0=self.x0, 
-                                                          alpha=self.gamma)
-        self.gaussian_p = samplers.tools.GaussianFunction(x0=self.p0,
-                                                          alpha=self.inv_gamma)
+    # The GaussianFunctions are only made on first use, so that evaluating
+    # the operator doesn't need to import dynamiq_samplers.
+    @property
+    def gaussian_x(self):
+        if self._gaussian_x is None:
+            from dynamiq_samplers.tools import GaussianFunction
+            self._gaussian_x = GaussianFunction(x0=self.x0, alpha=self.gamma)
+        return self._gaussian_x
+
+    @property
+    def gaussian_p(self):
+        if self._gaussian_p is None:
+            from dynamiq_samplers.tools import GaussianFunction
+            self._gaussian_p = GaussianFunction(x0=self.p0,
+                                                alpha=self.inv_gamma)
+        return self._gaussian_p
 
+    @property
+    def norm(self):
         # This sets the total factor outside the Wigner function to 1.0,
         # since the norms of the gaussians otherwise carry. Note that we're
         # undoing doing some extra multiplications here; needed to keep
         # `correction` in line -- but there might be a better way.
         # TODO: is this actually correct?
-        self.norm = np.prod([2.0]*self.n_dofs)
-        self.norm *= 1.0/(self.gaussian_x.norm * self.gaussian_p.norm)
+        norm = np.prod([2.0]*self.n_dofs)
+        norm *= 1.0/(self.gaussian_x.norm * self.gaussian_p.norm)
+        return norm
 
-        # set the sampling_gamma
-        # sampling_gamma = sampling_ratio[n_exciton]*gamma
-        # sampling_inv_gamma = sampling_ratio[n_exciton]*inv_gamma
-        self.exciton_sampling_ratios = {0 : 1.0, 1 : 1.1}
+    @property
+    def dofs(self):
+        return self._dofs
+
+    @dofs.setter
+    def dofs(self, val):
+        if val is not None:
+            assert(len(val) == self.n_dofs)
+        self._dofs = val
+        self._dof_index = DofIndex(val)
+        # reusable buffers for selecting features of a single snapshot
+        self._x_buffer = np.empty(self.n_dofs)
+        self._p_buffer = np.empty(self.n_dofs)
+        self._version = next(_versions)
 
-        # set up excitons: must be done AFTER setting self.n_dofs
-        self.excitons = excitons
+    @staticmethod
+    def _exciton_arrays(excitons, n_dofs):
+        """(excitons, excited dofs, their exciton numbers, and their Fock
+        coefficients), all as arrays"""
+        excitons = np.array(clean_ravel(excitons, n_dofs), dtype=int)
+        excited = np.flatnonzero(excitons > 0)
+        excited_n = excitons[excited]
+        return (excitons, excited, excited_n, fock_coefficients(excited_n))
 
     @property
     def excitons(self):
-        return self._excitons
+        return self._excitons.tolist()
 
     @excitons.setter
     def excitons(self, val):
-        self._excitons = clean_ravel(val, self.n_dofs)
-        self._exciton_dict = {i : self._excitons[i] 
-                              for i in range(len(self._excitons)) 
-                              if self._excitons[i] > 0}
+        (self._excitons, self._excited, self._excited_n,
+         self._excited_coefficients) = self._exciton_arrays(val, self.n_dofs)
+        self._version = next(_versions)
+
+    @property
+    def _exciton_dict(self):
+        return dict((int(i), int(self._excitons[i])) for i in self._excited)
 
     @staticmethod
     def _get_feature(feature_array, dofs):
-        if dofs is None:
-            return feature_array.ravel()
+        return DofIndex(dofs)(np.asarray(feature_array).ravel())
+
+    def _select(self, feature_array, out=None):
+        """Select this operator's dofs from one snapshot's features.
+
+        `out` is only used when the selection can't be a view.
+        """
+        features = np.asarray(feature_array, dtype=float).ravel()
+        if self._dof_index.is_view:
+            return self._dof_index(features)
+        return self._dof_index(features, out)
+
+    def _select_batch(self, feature_array, out=None):
+        """Select this operator's dofs from stacked samples or frames."""
+        return self._dof_index(as_batch(feature_array), out)
+
+    def _global_dofs(self):
+        """Indices of this operator's dofs in the raveled features"""
+        if self.dofs is None:
+            return np.arange(self.n_dofs)
         else:
-            return np.array([feature_array.ravel()[i] for i in dofs])
+            return np.asarray(self.dofs, dtype=int).ravel()
 
-    def default_sampler(self, exciton_sampling_ratios=None):
+    @classmethod
+    def _fuse(cls, operators):
+        return FusedCoherentProjection(operators)
+
+    def _snapshot_features(self, snapshot):
+        return (snapshot.coordinates, snapshot.momenta)
+
+    def _batch_features(self, coords, momenta, elec_coords, elec_momenta):
+        return (coords, momenta)
+
+    def _build_sampler(self, **kwargs):
+        from dynamiq_samplers import GaussianInitialConditions
+        return GaussianInitialConditions(**kwargs)
+
+    def tune_exciton_sampling_ratios(self, n_pilot=1000, candidates=None,
+                                     random_state=None):
+        """Sampling ratios that minimize the variance of the corrections.
+
+        Draws a pilot batch of displacements from the widest candidate
+        sampling Gaussian and uses it to estimate, for every candidate
+        ratio r and every dof, the second moment of the correction weight
+        when sampling with ratio r (by reweighting the pilot batch). Since
+        the operator and the sampler are products over dofs, the total
+        second moment is the product of the per-dof ones; for each exciton
+        number, we pick the candidate that minimizes the product over the
+        dofs with that many excitons. The mean of the weights doesn't
+        depend on r, so this minimizes the variance.
+
+        Parameters
+        ----------
+        n_pilot : int
+            number of pilot samples
+        candidates : array-like or None
+            candidate ratios, all less than 2; default is 0.1 to 1.5 in
+            steps of 0.1
+        random_state : int, numpy.random.RandomState, or None
+            source of the pilot samples
+
+        Returns
+        -------
+        dict
+            exciton number to sampling ratio, for the exciton numbers of
+            this operator; suitable for `exciton_sampling_ratios`
+        """
+        if candidates is None:
+            candidates = np.arange(1, 16) / 10.0
+        candidates = np.asarray(candidates, dtype=float)
+        if not isinstance(random_state, np.random.RandomState):
+            random_state = np.random.RandomState(random_state)
+
+        # pilot samples from exp(-s (gamma dx^2 + dp^2 / gamma)), in the
+        # scaled coordinates u = sqrt(gamma) dx, v = dp / sqrt(gamma)
+        pilot = candidates.min()
+        shape = (n_pilot, self.n_dofs)
+        u = random_state.normal(scale=np.sqrt(0.5 / pilot), size=shape)
+        v = random_state.normal(scale=np.sqrt(0.5 / pilot), size=shape)
+        r_sq = u*u + v*v
+        excitons = np.asarray(self.excitons, dtype=int)
+        factors = excited_factors(u / np.sqrt(self.gamma),
+                                  v * np.sqrt(self.gamma), excitons)
+        with np.errstate(divide='ignore'):
+            log_factors_sq = 2.0 * np.log(np.abs(factors))
+
+        # normalized sampling density is (r/pi) exp(-r R^2) per dof, so
+        # E_r[w^2] = E_pilot[op^2 / (q_r q_pilot)]
+        #          ~ E_pilot[D^2 exp(-(2 - r - s) R^2)] / r
+        log_moments = []
+        for ratio in candidates:
+            log_terms = log_factors_sq - (2.0 - ratio - pilot) * r_sq
+            peak = log_terms.max(axis=0)
+            log_mean = np.log(np.mean(np.exp(log_terms - peak), axis=0))
+            log_moments.append(log_mean + peak - np.log(ratio))
+        log_moments = np.array(log_moments)  # (n_candidates, n_dofs)
+
+        tuned = {}
+        for n in np.unique(excitons):
+            total = log_moments[:, excitons == n].sum(axis=1)
+            tuned[int(n)] = float(candidates[np.argmin(total)])
+        return tuned
+
+    def _qmc_sampler(self, alpha_x, alpha_p, method, random_state):
+        from pywigner.qmc import GaussianBlock, QMCGaussianSampler
+        dofs = None if self.dofs is None else self._global_dofs()
+        (x_feature, p_feature) = self._feature_names
+        block = GaussianBlock(x_feature, p_feature, dofs,
+                              self.x0, alpha_x, self.p0, alpha_p)
+        return QMCGaussianSampler([block], method=method,
+                                  random_state=random_state)
+
+    def default_sampler(self, exciton_sampling_ratios=None, adaptive=False,
+                        n_pilot=1000, random_state=None, qmc=None):
+        """Gaussian sampler centered on this operator.
+
+        Parameters
+        ----------
+        exciton_sampling_ratios : dict or None
+            sampling width ratio for each exciton number; default
+            `self.exciton_sampling_ratios`
+        adaptive : bool
+            if True, tune the ratios for the exciton numbers used here
+            with :meth:`tune_exciton_sampling_ratios` (using `n_pilot` and
+            `random_state`) before building the sampler
+        qmc : 'sobol', 'halton', or None
+            if given, return a :class:`.QMCGaussianSampler` that draws
+            from a randomized low-discrepancy sequence of that kind
+            (randomized from `random_state`) instead of pseudo-random
+            numbers; the correction is the same
+        """
         if exciton_sampling_ratios is None:
             exciton_sampling_ratios = self.exciton_sampling_ratios
+        if adaptive:
+            exciton_sampling_ratios = dict(exciton_sampling_ratios)
+            exciton_sampling_ratios.update(
+                self.tune_exciton_sampling_ratios(n_pilot=n_pilot,
+                                                  random_state=random_state)
+            )
+        ratios = np.array([
+            exciton_sampling_ratios[n] if n in exciton_sampling_ratios
+            else default_exciton_sampling_ratio(n)
+            for n in self.excitons
+        ])
         #TODO: check that these gamma->alpha setups are correct
-        alpha_x = [exciton_sampling_ratios[self.excitons[i]]*self.gamma[i]
-                   for i in range(len(self.gamma))]
-        alpha_p = [exciton_sampling_ratios[self.excitons[i]]*self.inv_gamma[i]
-                   for i in range(len(self.inv_gamma))]
-        return samplers.GaussianInitialConditions(
-            x0=self.x0, alpha_x=alpha_x, coordinate_dofs=self.dofs,
-            p0=self.p0, alpha_p=alpha_p, momentum_dofs=self.dofs
-        )
+        alpha_x = ratios * self.gamma
+        alpha_p = ratios * self.inv_gamma
+        if qmc:
+            sampler = self._qmc_sampler(alpha_x, alpha_p, qmc, random_state)
+        else:
+            sampler = self._build_sampler(
+                x0=self.x0, alpha_x=alpha_x, coordinate_dofs=self.dofs,
+                p0=self.p0, alpha_p=alpha_p, momentum_dofs=self.dofs
+            )
+        # sampler(snap) / sampler.norm = exp(-alpha_x dx^2 - alpha_p dp^2),
+        # so the correction is exp((alpha_x - gamma) dx^2 + ...)
+        closed_form = (alpha_x - self.gamma, alpha_p - self.inv_gamma)
+        return self._mark_default_sampler(sampler, closed_form)
+
+    def phase_space_integral(self):
+        """Integral of the Wigner function over the operator's dofs.
+
+        Per dof, this is :math:`2\pi` times the average of the excited
+        factor over the normalized Gaussian, which follows from the
+        Gaussian moments :math:`<\delta x^{2j}> = (2j-1)!! / (2\gamma)^j`
+        (and likewise for p, with :math:`1/\gamma`).
+        """
+        integral = (2.0 * np.pi)**self.n_dofs
+        for (dof, n) in zip(self._excited, self._excited_n):
+            var_x = 0.5 * self.inv_gamma[dof]
+            var_p = 0.5 * self.gamma[dof]
+            coefficients = fock_coefficients([n])[0]
+            average = 0.0
+            for (k, coefficient) in enumerate(coefficients):
+                # <z^k> with z = 2 (dx^2 + dp^2)
+                moment = sum(
+                    _binomial(k, j) * _double_factorial(2*j - 1) * var_x**j
+                    * _double_factorial(2*(k - j) - 1) * var_p**(k - j)
+                    for j in range(k + 1)
+                )
+                average += coefficient * 2.0**k * moment
+            integral *= average
+        return integral
 
     def excite(self, dof, excitons=1):
         try:
@@ -147,26 +553,145 @@ class CoherentProjection(Operator):
         return self
 
     def _call_excited_part(self, x_vals, p_vals):
-        result = 1.0
-        for (i, n) in self._exciton_dict.items():
-            x_i = x_vals[i] - self.x0[i]
-            p_i = p_vals[i] - self.p0[i]
-            if n == 1:
-                result *= 2.0*(x_i*x_i + p_i*p_i - 0.5)
-        return result
+        excited = self._excited
+        dx = np.asarray(x_vals)[excited] - self.x0[excited]
+        dp = np.asarray(p_vals)[excited] - self.p0[excited]
+        factors = excited_factors(dx, dp, self._excited_n,
+                                  self._excited_coefficients)
+        return np.prod(factors)
+
+    def _call_excited_part_batch(self, dx, dp):
+        excited = self._excited
+        factors = excited_factors(dx[:, excited], dp[:, excited],
+                                  self._excited_n,
+                                  self._excited_coefficients)
+        return np.prod(factors, axis=1)
+
+    def _log_excited_part_batch(self, dx, dp):
+        excited = self._excited
+        factors = excited_factors(dx[:, excited], dp[:, excited],
+                                  self._excited_n,
+                                  self._excited_coefficients)
+        (signs, log_values) = signed_log(factors)
+        return (np.prod(signs, axis=1), np.sum(log_values, axis=1))
+
+    def _displacements(self, snapshot):
+        (coordinates, momenta) = self._snapshot_features(snapshot)
+        dx = self._select(coordinates, self._x_buffer) - self.x0
+        dp = self._select(momenta, self._p_buffer) - self.p0
+        return (dx, dp)
+
+    def _displacements_batch(self, coords, momenta, elec_coords,
+                             elec_momenta):
+        (coordinates, momenta) = self._batch_features(coords, momenta,
+                                                      elec_coords,
+                                                      elec_momenta)
+        dx = self._select_batch(coordinates) - self.x0
+        dp = self._select_batch(momenta) - self.p0
+        return (dx, dp)
+
+    def _closed_form_correction(self, dx, dp, closed_form):
+        (coeff_x, coeff_p) = closed_form
+        exponent = np.dot(dx*dx, coeff_x) + np.dot(dp*dp, coeff_p)
+        excited_part = self._call_excited_part_batch(dx, dp)
+        return self._prefactor * np.exp(exponent) * excited_part
+
+    def correction(self, snapshot, sampler):
+        closed_form = self._default_sampler_details(sampler)
+        if closed_form is None:
+            return super(CoherentProjection, self).correction(snapshot,
+                                                              sampler)
+        (dx, dp) = self._displacements(snapshot)
+        return self._closed_form_correction(dx[np.newaxis], dp[np.newaxis],
+                                            closed_form)[0]
+
+    def correction_batch(self, sampler, coords, momenta, elec_coords=None,
+                         elec_momenta=None):
+        closed_form = self._default_sampler_details(sampler)
+        if closed_form is None:
+            return super(CoherentProjection, self).correction_batch(
+                sampler, coords, momenta, elec_coords, elec_momenta
+            )
+        (dx, dp) = self._displacements_batch(coords, momenta, elec_coords,
+                                             elec_momenta)
+        return self._closed_form_correction(dx, dp, closed_form)
+
+    def log_sampler_density_batch(self, sampler, coords, momenta,
+                                  elec_coords=None, elec_momenta=None):
+        closed_form = self._default_sampler_details(sampler)
+        if closed_form is None:
+            return super(CoherentProjection, self).log_sampler_density_batch(
+                sampler, coords, momenta, elec_coords, elec_momenta
+            )
+        (dx, dp) = self._displacements_batch(coords, momenta, elec_coords,
+                                             elec_momenta)
+        # the closed form is (alpha_x - gamma, alpha_p - 1/gamma)
+        (coeff_x, coeff_p) = closed_form
+        return -(np.dot(dx*dx, self.gamma + coeff_x)
+                 + np.dot(dp*dp, self.inv_gamma + coeff_p))
+
+    def _log_kernel(self, dx, dp, coeff_x, coeff_p):
+        # (sign, log) of 2**n_dofs * exp(coeff_x dx^2 + coeff_p dp^2) * D
+        (sign, log_value) = self._log_excited_part_batch(dx, dp)
+        log_value += self._log_prefactor
+        log_value += np.dot(dx*dx, coeff_x) + np.dot(dp*dp, coeff_p)
+        return (sign, log_value)
+
+    def log_value(self, snapshot):
+        (dx, dp) = self._displacements(snapshot)
+        (sign, log_value) = self._log_kernel(dx[np.newaxis], dp[np.newaxis],
+                                             -self.gamma, -self.inv_gamma)
+        return (sign[0], log_value[0])
+
+    def log_value_batch(self, coords, momenta, elec_coords=None,
+                        elec_momenta=None):
+        (dx, dp) = self._displacements_batch(coords, momenta, elec_coords,
+                                             elec_momenta)
+        return self._log_kernel(dx, dp, -self.gamma, -self.inv_gamma)
+
+    def log_correction(self, snapshot, sampler):
+        closed_form = self._default_sampler_details(sampler)
+        if closed_form is None:
+            return super(CoherentProjection, self).log_correction(snapshot,
+                                                                  sampler)
+        (dx, dp) = self._displacements(snapshot)
+        (sign, log_value) = self._log_kernel(dx[np.newaxis], dp[np.newaxis],
+                                             *closed_form)
+        return (sign[0], log_value[0])
+
+    def log_correction_batch(self, sampler, coords, momenta,
+                             elec_coords=None, elec_momenta=None):
+        closed_form = self._default_sampler_details(sampler)
+        if closed_form is None:
+            return super(CoherentProjection, self).log_correction_batch(
+                sampler, coords, momenta, elec_coords, elec_momenta
+            )
+        (dx, dp) = self._displacements_batch(coords, momenta, elec_coords,
+                                             elec_momenta)
+        return self._log_kernel(dx, dp, *closed_form)
 
     def __call__(self, snapshot):
-        x_vals = self._get_feature(snapshot.coordinates.ravel(), self.dofs)
-        p_vals = self._get_feature(snapshot.momenta.ravel(), self.dofs)
-
-        # TODO: correct for excite; check for normalization
-        standard_part = self.gaussian_x(x_vals) * self.gaussian_p(p_vals)
-        excited_part = self._call_excited_part(x_vals, p_vals)
-        result = self.norm * standard_part * excited_part
-        return result
+        (dx, dp) = self._displacements(snapshot)
+        # same as norm * gaussian_x(x) * gaussian_p(p)
+        exponent = np.dot(dx*dx, self.gamma) + np.dot(dp*dp, self.inv_gamma)
+        excited_part = self._call_excited_part_batch(dx[np.newaxis],
+                                                     dp[np.newaxis])[0]
+        return self._prefactor * np.exp(-exponent) * excited_part
+
+    def evaluate_batch(self, coords, momenta, elec_coords=None,
+                       elec_momenta=None):
+        (dx, dp) = self._displacements_batch(coords, momenta, elec_coords,
+                                             elec_momenta)
+        # same as norm * gaussian_x(x) * gaussian_p(p), one row per sample
+        exponent = np.dot(dx*dx, self.gamma) + np.dot(dp*dp, self.inv_gamma)
+        excited_part = self._call_excited_part_batch(dx, dp)
+        return self._prefactor * np.exp(-exponent) * excited_part
 
 
 class ElectronicCoherentProjection(CoherentProjection):
+    _fusion_key = 'electronic'
+    _feature_names = ('electronic_coordinates', 'electronic_momenta')
+
     @classmethod
     def with_n_dofs(cls, n_dofs):
         return cls(
@@ -175,27 +700,120 @@ class ElectronicCoherentProjection(CoherentProjection):
             gamma=np.array([1.0]*n_dofs)
         )
 
+    def _snapshot_features(self, snapshot):
+        return (snapshot.electronic_coordinates, snapshot.electronic_momenta)
+
+    def _batch_features(self, coords, momenta, elec_coords, elec_momenta):
+        if elec_coords is None or elec_momenta is None:
+            raise ValueError("ElectronicCoherentProjection requires "
+                             + "elec_coords and elec_momenta")
+        return (elec_coords, elec_momenta)
+
+    def _build_sampler(self, **kwargs):
+        from dynamiq_samplers import MMSTElectronicGaussianInitialConditions
+        return MMSTElectronicGaussianInitialConditions(**kwargs)
+
+
+class FusedCoherentProjection(object):
+    """Product of coherent projections on the same features, as one kernel.
+
+    Used by :class:`.ProductOperator` to evaluate all of its coherent
+    projections of one kind (nuclear or electronic) with a single Gaussian.
+    Projections on different dofs are concatenated; projections on the
+    same dof are merged analytically, since
+
+    .. math::
+        \exp(-\gamma_1 (x - a_1)^2) \exp(-\gamma_2 (x - a_2)^2)
+        = \exp(-(\gamma_1 + \gamma_2)(x - c)^2 
+                - \frac{\gamma_1 \gamma_2}{\gamma_1 + \gamma_2}
+                  (a_1 - a_2)^2)
+
+    with :math:`c = (\gamma_1 a_1 + \gamma_2 a_2)/(\gamma_1 + \gamma_2)`.
+    Excited-state factors still use the center of their own projection.
+    The parameters are copied at construction; the product recompiles when
+    the dofs or excitons of a projection change.
+
+    Parameters
+    ----------
+    projections : list of :class:`.CoherentProjection`
+        projections of the same class
+    """
+    def __init__(self, projections):
+        # the first projection tells us which features to read
+        self._reader = projections[0]
+
+        dofs = np.concatenate([op._global_dofs() for op in projections])
+        x0 = np.concatenate([op.x0 for op in projections])
+        p0 = np.concatenate([op.p0 for op in projections])
+        gamma = np.concatenate([op.gamma for op in projections])
+        inv_gamma = np.concatenate([op.inv_gamma for op in projections])
+
+        (unique_dofs, merged) = np.unique(dofs, return_inverse=True)
+        self.dofs = unique_dofs
+        self._dof_index = DofIndex(unique_dofs)
+        self.gamma = np.bincount(merged, weights=gamma)
+        self.inv_gamma = np.bincount(merged, weights=inv_gamma)
+        self.x0 = np.bincount(merged, weights=gamma*x0) / self.gamma
+        self.p0 = np.bincount(merged, weights=inv_gamma*p0) / self.inv_gamma
+        # constant left over from completing the square
+        offset = (np.sum(gamma * (x0 - self.x0[merged])**2)
+                  + np.sum(inv_gamma * (p0 - self.p0[merged])**2))
+        self._log_prefactor = (sum(op._log_prefactor for op in projections)
+                               - offset)
+
+        excited = []
+        excited_x0 = []
+        excited_p0 = []
+        excited_n = []
+        start = 0
+        for op in projections:
+            excited.append(merged[start + op._excited])
+            excited_x0.append(op.x0[op._excited])
+            excited_p0.append(op.p0[op._excited])
+            excited_n.append(op._excited_n)
+            start += op.n_dofs
+        self._excited = np.concatenate(excited).astype(int)
+        self._excited_x0 = np.concatenate(excited_x0)
+        self._excited_p0 = np.concatenate(excited_p0)
+        self._excited_n = np.concatenate(excited_n).astype(int)
+        self._excited_coefficients = fock_coefficients(self._excited_n)
+
+    def _log_kernel(self, x, p):
+        dx = x - self.x0
+        dp = p - self.p0
+        exponent = np.dot(dx*dx, self.gamma) + np.dot(dp*dp, self.inv_gamma)
+        factors = excited_factors(x[:, self._excited] - self._excited_x0,
+                                  p[:, self._excited] - self._excited_p0,
+                                  self._excited_n,
+                                  self._excited_coefficients)
+        (signs, log_factors) = signed_log(factors)
+        log_value = (self._log_prefactor - exponent 
+                     + np.sum(log_factors, axis=1))
+        return (np.prod(signs, axis=1), log_value)
+
+    def _features(self, coordinates, momenta):
+        x = self._dof_index(as_batch(coordinates))
+        p = self._dof_index(as_batch(momenta))
+        return (x, p)
+
+    def log_value_batch(self, coords, momenta, elec_coords=None,
+                        elec_momenta=None):
+        features = self._reader._batch_features(coords, momenta,
+                                                elec_coords, elec_momenta)
+        return self._log_kernel(*self._features(*features))
+
+    def evaluate_batch(self, coords, momenta, elec_coords=None,
+                       elec_momenta=None):
+        (signs, log_values) = self.log_value_batch(coords, momenta,
+                                                   elec_coords, elec_momenta)
+        return signs * np.exp(log_values)
+
+    def log_value(self, snapshot):
+        features = [np.asarray(f, dtype=float).ravel()[np.newaxis]
+                    for f in self._reader._snapshot_features(snapshot)]
+        (signs, log_values) = self._log_kernel(*self._features(*features))
+        return (signs[0], log_values[0])
+
     def __call__(self, snapshot):
-        x_vals = self._get_feature(snapshot.electronic_coordinates.ravel(), 
-                                   self.dofs)
-        p_vals = self._get_feature(snapshot.electronic_momenta.ravel(), 
-                                   self.dofs)
-
-        # TODO: correct for excite; check for normalization
-        standard_part = self.gaussian_x(x_vals) * self.gaussian_p(p_vals)
-        excited_part = self._call_excited_part(x_vals, p_vals)
-        result = self.norm * standard_part * excited_part
-        return result
-
-    def default_sampler(self, exciton_sampling_ratios=None):
-        if exciton_sampling_ratios is None:
-            exciton_sampling_ratios = self.exciton_sampling_ratios
-        #TODO: check that these gamma->alpha setups are correct
-        alpha_x = [exciton_sampling_ratios[self.excitons[i]]*self.gamma[i]
-                   for i in range(len(self.gamma))]
-        alpha_p = [exciton_sampling_ratios[self.excitons[i]]*self.inv_gamma[i]
-                   for i in range(len(self.inv_gamma))]
-        return samplers.MMSTElectronicGaussianInitialConditions(
-            x0=self.x0, alpha_x=alpha_x, coordinate_dofs=self.dofs,
-            p0=self.p0, alpha_p=alpha_p, momentum_dofs=self.dofs
-        )
+        (sign, log_value) = self.log_value(snapshot)
+        return sign * np.exp(log_value)
@@ -0,0 +1,164 @@
+import numpy as np
+from pywigner.tools import stack_snapshots
+from pywigner.operators.coherent_states import CoherentProjection
+
+
+def _axes(axes):
+    # one axis per dof; a single array of numbers is one dof
+    if np.ndim(axes[0]) == 0:
+        axes = [axes]
+    return [np.asarray(axis, dtype=float).ravel() for axis in axes]
+
+
+class ProjectionGrid(object):
+    """Coherent projections centered on every point of a phase-space grid.
+
+    For each dof there is an axis of centers x0 and an axis of centers p0,
+    and the grid is their Cartesian product, with shape
+    `(len(x_axes[0]), len(p_axes[0]), len(x_axes[1]), ...)`. All the
+    projections share their widths, so the Gaussian separates: on a batch,
+    each axis gives a table of exponentials for each sample and center, and
+    the values on the whole grid are their outer product. For a single dof
+    with an M x N grid, that is M + N exponentials per sample rather than M
+    N evaluations of the Gaussian.
+
+    The grid can also be used as a list of :class:`.CoherentProjection`
+    (e.g., as the B-operators of a :class:`.CorrelationFunction`), in the
+    order of the flattened grid; :class:`.OperatorBank` evaluates those
+    together from per-dof tables as well. Use :meth:`reshape` to put the
+    results back on the grid.
+
+    Parameters
+    ----------
+    x_axes : array-like or list of array-like
+        centers in position for each dof; a single array is one dof
+    p_axes : array-like or list of array-like
+        centers in momentum for each dof
+    gamma : float or array-like
+        width for each dof
+    dofs : list or None
+        dofs of the projections
+    projection_class : type
+        :class:`.CoherentProjection` or :class:`.ElectronicCoherentProjection`
+
+    Attributes
+    ----------
+    shape : tuple
+        shape of the grid
+    """
+    def __init__(self, x_axes, p_axes, gamma, dofs=None,
+                 projection_class=CoherentProjection):
+        self.x_axes = _axes(x_axes)
+        self.p_axes = _axes(p_axes)
+        if len(self.x_axes) != len(self.p_axes):
+            raise ValueError("Need as many x axes as p axes")
+        n_dofs = len(self.x_axes)
+        self.gamma = np.broadcast_to(np.asarray(gamma, dtype=float),
+                                     (n_dofs,)).copy()
+        self.inv_gamma = 1.0 / self.gamma
+        self.dofs = dofs
+        self.projection_class = projection_class
+        self.shape = tuple(len(axis) for pair in zip(self.x_axes,
+                                                     self.p_axes)
+                           for axis in pair)
+        # reads the features and selects the dofs for the whole grid
+        self._reader = projection_class(x0=np.zeros(n_dofs),
+                                        p0=np.zeros(n_dofs),
+                                        gamma=self.gamma, dofs=dofs)
+        self._projections = None
+
+    @property
+    def n_dofs(self):
+        return len(self.gamma)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def centers(self):
+        """(x0, p0) of all grid points, each shape (size, n_dofs)"""
+        axes = [axis for pair in zip(self.x_axes, self.p_axes)
+                for axis in pair]
+        mesh = np.meshgrid(*axes, indexing='ij')
+        x0 = np.stack([m.ravel() for m in mesh[0::2]], axis=1)
+        p0 = np.stack([m.ravel() for m in mesh[1::2]], axis=1)
+        return (x0, p0)
+
+    @property
+    def projections(self):
+        """The projections at each grid point, in flattened grid order"""
+        if self._projections is None:
+            (x0, p0) = self.centers()
+            self._projections = self.projection_class.from_arrays(
+                x0, p0, self.gamma, dofs=self.dofs
+            )
+        return self._projections
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.projections)
+
+    def __getitem__(self, index):
+        return self.projections[index]
+
+    def reshape(self, values):
+        """Values with the grid points along the last axis, shape
+        (..., size), as shape (...) + shape"""
+        values = np.asarray(values)
+        return values.reshape(values.shape[:-1] + self.shape)
+
+    def _exponents(self, coords, momenta, elec_coords, elec_momenta):
+        # for each axis, (n_samples, n_centers) table of exponents
+        (x, p) = self._reader._batch_features(coords, momenta, elec_coords,
+                                              elec_momenta)
+        x = self._reader._select_batch(x)
+        p = self._reader._select_batch(p)
+        tables = []
+        for dof in range(self.n_dofs):
+            dx = x[:, dof, np.newaxis] - self.x_axes[dof]
+            tables.append(self.gamma[dof] * dx*dx)
+            dp = p[:, dof, np.newaxis] - self.p_axes[dof]
+            tables.append(self.inv_gamma[dof] * dp*dp)
+        return tables
+
+    @staticmethod
+    def _outer(tables, combine):
+        # outer product (or sum) over the axes, for each sample
+        result = tables[0]
+        for table in tables[1:]:
+            result = combine(result[:, :, np.newaxis],
+                             table[:, np.newaxis, :])
+            result = result.reshape(len(result), -1)
+        return result
+
+    def evaluate_batch(self, coords, momenta, elec_coords=None,
+                       elec_momenta=None):
+        """Values of all projections on all samples, shape
+        (n_samples,) + shape"""
+        tables = self._exponents(coords, momenta, elec_coords, elec_momenta)
+        tables = [np.exp(-table) for table in tables]
+        tables[0] *= self._reader._prefactor
+        values = self._outer(tables, np.multiply)
+        return values.reshape((len(values),) + self.shape)
+
+    def log_value_batch(self, coords, momenta, elec_coords=None,
+                        elec_momenta=None):
+        """(signs, log_magnitudes) of all projections on all samples, each
+        with shape (n_samples,) + shape"""
+        tables = self._exponents(coords, momenta, elec_coords, elec_momenta)
+        tables[0] = self._reader._log_prefactor - tables[0]
+        tables[1:] = [-table for table in tables[1:]]
+        log_values = self._outer(tables, np.add)
+        log_values = log_values.reshape((len(log_values),) + self.shape)
+        return (np.ones(log_values.shape), log_values)
+
+    def evaluate_trajectory(self, trajectory):
+        """Values of all projections on each frame, shape
+        (n_frames,) + shape"""
+        return self.evaluate_batch(*stack_snapshots(trajectory))
+
+    def __call__(self, snapshot):
+        """Values of all projections on one snapshot, shape `shape`"""
+        return self.evaluate_trajectory([snapshot])[0]
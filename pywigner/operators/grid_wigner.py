@@ -0,0 +1,353 @@
+"""
+Wigner functions of operators given on a position grid.
+
+For a density matrix :math:`\\rho(x, x')` (or a wavefunction, with
+:math:`\\rho = |\\psi><\\psi|`) on a uniform grid, the Wigner function (in
+the normalization used by :class:`.CoherentProjection`, with
+:math:`\\hbar = 1`)
+
+.. math::
+    A_W(x, p) = \\int dy\\, \\rho(x - y/2, x + y/2)\\, e^{i p y}
+
+is computed once, by FFT over y for all grid points x, and kept as a table
+on the (x, p) grid. Evaluation interpolates the table bilinearly.
+"""
+import hashlib
+import os
+import tempfile
+import numpy as np
+from pywigner.tools import as_batch
+from pywigner.operators.operators import Operator
+
+
+def wigner_transform(density, dx):
+    """Wigner function of a density matrix on a uniform grid.
+
+    With y = 2 s dx, the points x_j +- y/2 stay on the grid, so the
+    transform is a discrete Fourier transform over s for each x_j. The
+    momentum grid has spacing :math:`\\pi / (n\\, dx)` and covers
+    :math:`|p| \\le \\pi / (2\\, dx)`, so the position grid must be fine
+    enough for the momenta of the state.
+
+    Parameters
+    ----------
+    density : numpy.array
+        (n, n) density matrix :math:`\\rho(x_i, x_j)`, or (n,) wavefunction
+        :math:`\\psi(x_i)`, for which :math:`\\rho = |\\psi><\\psi|` is
+        never built
+    dx : float
+        grid spacing
+
+    Returns
+    -------
+    tuple
+        (table, p_axis): the Wigner function, shape (n, n), at
+        (x_j, p_axis[k]), and the momentum grid
+    """
+    density = np.asarray(density)
+    n = len(density)
+    shifts = np.arange(-(n // 2), n - n // 2)
+    rows = np.arange(n)[:, np.newaxis] - shifts
+    columns = np.arange(n)[:, np.newaxis] + shifts
+    inside = (rows >= 0) & (rows < n) & (columns >= 0) & (columns < n)
+    (rows, columns) = (rows.clip(0, n - 1), columns.clip(0, n - 1))
+    if density.ndim == 1:
+        values = density[rows] * density[columns].conj()
+    else:
+        values = density[rows, columns]
+    kernel = np.where(inside, values, 0.0)
+    # ifft sums over s with s = 0 first
+    transform = np.fft.ifft(np.fft.ifftshift(kernel, axes=1), axis=1)
+    table = np.fft.fftshift(transform.real, axes=1) * (2.0 * dx * n)
+    p_axis = np.pi / (n * dx) * shifts
+    return (table, p_axis)
+
+
+def _locate(axis, values):
+    """(cell, fraction, inside): lower grid index of the cell containing
+    each value, position within the cell, and whether it is on the grid"""
+    spacing = axis[1] - axis[0]
+    position = (values - axis[0]) / spacing
+    inside = (position >= 0) & (position <= len(axis) - 1)
+    cell = np.clip(np.floor(position).astype(int), 0, len(axis) - 2)
+    return (cell, position - cell, inside)
+
+
+def _uniform_spacing(axis, name):
+    axis = np.asarray(axis, dtype=float).ravel()
+    spacing = np.diff(axis)
+    if (len(axis) < 2 or not np.all(spacing > 0)
+            or not np.allclose(spacing, spacing[0])):
+        raise ValueError(name + " must be uniform and increasing")
+    return (axis, spacing[0])
+
+
+class GridWignerSampler(object):
+    """Importance sampler for a tabulated Wigner function.
+
+    The density is constant on each cell of the table, proportional to
+    the mean of :math:`|A_W|` at its corners (so it is positive wherever
+    the interpolated Wigner function isn't zero). A cell is picked with
+    `numpy.random` (as the dynamiq samplers do), then a point uniformly
+    within it.
+
+    Follows the sampler convention of dynamiq_samplers:
+    `sampler(snapshot)` is the normalized density, and `norm` is such that
+    `sampler(snapshot) / norm` is the cell weight.
+
+    Parameters
+    ----------
+    table : numpy.array
+        (n_x, n_p) Wigner function
+    x_axis, p_axis : numpy.array
+        uniform grids of the table
+    dof : int
+        dof of the coordinates and momenta that is sampled
+    """
+    def __init__(self, table, x_axis, p_axis, dof=0):
+        (self.x_axis, self.dx) = _uniform_spacing(x_axis, "x_axis")
+        (self.p_axis, self.dp) = _uniform_spacing(p_axis, "p_axis")
+        self.dof = dof
+        table = np.abs(table)
+        self.cell_weights = 0.25 * (table[:-1, :-1] + table[1:, :-1]
+                                    + table[:-1, 1:] + table[1:, 1:])
+        total = np.sum(self.cell_weights)
+        if not total > 0:
+            raise ValueError("Wigner table is zero everywhere")
+        self.probabilities = (self.cell_weights / total).ravel()
+        self.norm = 1.0 / (total * self.dx * self.dp)
+
+    def weight_batch(self, x, p):
+        """Cell weight at each (x, p); zero off the grid"""
+        (i, _, inside_x) = _locate(self.x_axis, x)
+        (k, _, inside_p) = _locate(self.p_axis, p)
+        return np.where(inside_x & inside_p, self.cell_weights[i, k], 0.0)
+
+    def _draw(self, n_samples):
+        cells = np.random.choice(len(self.probabilities), size=n_samples,
+                                 p=self.probabilities)
+        (i, k) = np.unravel_index(cells, self.cell_weights.shape)
+        x = self.x_axis[i] + self.dx * np.random.random_sample(n_samples)
+        p = self.p_axis[k] + self.dp * np.random.random_sample(n_samples)
+        return (x, p)
+
+    def generate_batch(self, n_samples, template):
+        """`n_samples` initial conditions as stacked features, as from
+        :func:`.stack_snapshots`; other features come from `template`"""
+        coords = np.repeat(as_batch([template.coordinates]), n_samples,
+                           axis=0)
+        momenta = np.repeat(as_batch([template.momenta]), n_samples, axis=0)
+        (coords[:, self.dof], momenta[:, self.dof]) = self._draw(n_samples)
+        return (coords, momenta, None, None)
+
+    def generate_initial_snapshot(self, snapshot):
+        new_snapshot = snapshot.copy()
+        (x, p) = self._draw(1)
+        for (name, value) in [('coordinates', x[0]), ('momenta', p[0])]:
+            features = np.array(getattr(snapshot, name), dtype=float)
+            features.ravel()[self.dof] = value
+            setattr(new_snapshot, name, features)
+        return new_snapshot
+
+    def __call__(self, snapshot):
+        x = np.asarray(snapshot.coordinates).ravel()[self.dof]
+        p = np.asarray(snapshot.momenta).ravel()[self.dof]
+        return self.norm * self.weight_batch(np.array([x]),
+                                             np.array([p]))[0]
+
+
+class GridWignerOperator(Operator):
+    """Operator given as a wavefunction or density matrix on a grid.
+
+    The Wigner function is computed by :func:`wigner_transform` on first
+    use. With `cache_dir`, the table is saved there (under a name derived
+    from the operator's contents) and loaded, memory-mapped if `mmap`,
+    whenever an operator with the same contents needs it, including in
+    other processes. Values are bilinear interpolations of the table, and
+    zero off the grid.
+
+    Parameters
+    ----------
+    x_axis : array-like
+        uniform position grid
+    wavefunction : array-like or None
+        :math:`\\psi(x)` on the grid; the operator is
+        :math:`|\\psi><\\psi|`
+    density : array-like or None
+        density matrix :math:`\\rho(x, x')` on the grid, used if no
+        wavefunction is given
+    dof : int
+        dof of the coordinates and momenta the operator acts on
+    cache_dir : str or None
+        directory for the cached table
+    mmap : bool
+        whether to memory-map a cached table
+    """
+    def __init__(self, x_axis, wavefunction=None, density=None, dof=0,
+                 cache_dir=None, mmap=True):
+        super(GridWignerOperator, self).__init__()
+        (self.x_axis, self.dx) = _uniform_spacing(x_axis, "x_axis")
+        n = len(self.x_axis)
+        if wavefunction is not None:
+            self.wavefunction = np.asarray(wavefunction).ravel()
+            self.density = None
+            if len(self.wavefunction) != n:
+                raise ValueError("Wavefunction doesn't match the grid")
+        elif density is not None:
+            self.wavefunction = None
+            self.density = np.asarray(density)
+            if self.density.shape != (n, n):
+                raise ValueError("Density matrix doesn't match the grid")
+        else:
+            raise ValueError("Need a wavefunction or a density matrix")
+        self.dof = dof
+        self.cache_dir = cache_dir
+        self.mmap = mmap
+        self.p_axis = np.pi / (len(self.x_axis) * self.dx) * np.arange(
+            -(len(self.x_axis) // 2), len(self.x_axis) - len(self.x_axis) // 2
+        )
+        self.dp = self.p_axis[1] - self.p_axis[0]
+        self._table = None
+        self._cache_file = None
+
+    @property
+    def _source(self):
+        # what wigner_transform works from
+        if self.wavefunction is not None:
+            return self.wavefunction
+        return self.density
+
+    def __getstate__(self):
+        # a cached table is reloaded rather than sent along; once it is
+        # on disk, the wavefunction or density isn't needed either
+        state = dict(self.__dict__)
+        if self.cache_dir is not None:
+            state['_cache_file'] = self.cache_file
+            state['_table'] = None
+            if os.path.exists(self.cache_file):
+                state['wavefunction'] = None
+                state['density'] = None
+        return state
+
+    @property
+    def cache_file(self):
+        if self.cache_dir is None:
+            return None
+        if self._cache_file is None:
+            digest = hashlib.sha1()
+            for array in [self.x_axis, self._source]:
+                digest.update(np.ascontiguousarray(array).tobytes())
+            self._cache_file = os.path.join(
+                self.cache_dir, "wigner_%s.npy" % digest.hexdigest()
+            )
+        return self._cache_file
+
+    def _write_cache(self, filename):
+        # to a unique temporary file first, so that processes computing
+        # the same table at once don't write over each other
+        (table, _) = wigner_transform(self._source, self.dx)
+        (fd, tmp_filename) = tempfile.mkstemp(dir=self.cache_dir,
+                                              suffix=".tmp.npy")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, table)
+            os.rename(tmp_filename, filename)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    @property
+    def table(self):
+        """Wigner function on the (x_axis, p_axis) grid"""
+        if self._table is None:
+            filename = self.cache_file
+            if filename is None:
+                (self._table, _) = wigner_transform(self._source, self.dx)
+            else:
+                if not os.path.exists(filename):
+                    if self._source is None:
+                        raise IOError("Cached table %s is gone, and this "
+                                      "copy of the operator can't rebuild "
+                                      "it" % filename)
+                    self._write_cache(filename)
+                self._table = np.load(filename,
+                                      mmap_mode='r' if self.mmap else None)
+        return self._table
+
+    def value_batch(self, x, p):
+        """Interpolated Wigner function at each (x, p)"""
+        table = self.table
+        (i, s, inside_x) = _locate(self.x_axis, np.asarray(x, dtype=float))
+        (k, t, inside_p) = _locate(self.p_axis, np.asarray(p, dtype=float))
+        values = ((1.0 - s) * (1.0 - t) * table[i, k]
+                  + s * (1.0 - t) * table[i + 1, k]
+                  + (1.0 - s) * t * table[i, k + 1]
+                  + s * t * table[i + 1, k + 1])
+        return np.where(inside_x & inside_p, values, 0.0)
+
+    def _features_batch(self, coords, momenta):
+        return (as_batch(coords)[:, self.dof], as_batch(momenta)[:, self.dof])
+
+    def evaluate_batch(self, coords, momenta, elec_coords=None,
+                       elec_momenta=None):
+        return self.value_batch(*self._features_batch(coords, momenta))
+
+    def __call__(self, snapshot):
+        x = np.asarray(snapshot.coordinates).ravel()[self.dof]
+        p = np.asarray(snapshot.momenta).ravel()[self.dof]
+        return self.value_batch(np.array([x]), np.array([p]))[0]
+
+    def phase_space_integral(self):
+        """Integral of the interpolated table (the trapezoidal rule); this
+        is :math:`2\\pi` times the trace of the density matrix"""
+        weights_x = np.ones(len(self.x_axis))
+        weights_x[[0, -1]] = 0.5
+        weights_p = np.ones(len(self.p_axis))
+        weights_p[[0, -1]] = 0.5
+        return (np.dot(weights_x, np.dot(self.table, weights_p))
+                * self.dx * self.dp)
+
+    def default_sampler(self):
+        """:class:`GridWignerSampler` on this operator's table"""
+        sampler = GridWignerSampler(self.table, self.x_axis, self.p_axis,
+                                    self.dof)
+        return self._mark_default_sampler(sampler, sampler.weight_batch)
+
+    def correction(self, snapshot, sampler):
+        weight = self._default_sampler_details(sampler)
+        if weight is None:
+            return super(GridWignerOperator, self).correction(snapshot,
+                                                              sampler)
+        x = np.asarray(snapshot.coordinates).ravel()[self.dof]
+        p = np.asarray(snapshot.momenta).ravel()[self.dof]
+        return self._closed_form_correction(weight, np.array([x]),
+                                            np.array([p]))[0]
+
+    def _closed_form_correction(self, weight, x, p):
+        # A_W / (sampler / norm); zero where the sampler can't reach, where
+        # A_W is zero as well
+        weights = weight(x, p)
+        values = self.value_batch(x, p)
+        safe = np.where(weights > 0, weights, 1.0)
+        return np.where(weights > 0, values / safe, 0.0)
+
+    def correction_batch(self, sampler, coords, momenta, elec_coords=None,
+                         elec_momenta=None):
+        weight = self._default_sampler_details(sampler)
+        if weight is None:
+            return super(GridWignerOperator, self).correction_batch(
+                sampler, coords, momenta, elec_coords, elec_momenta
+            )
+        return self._closed_form_correction(
+            weight, *self._features_batch(coords, momenta)
+        )
+
+    def log_sampler_density_batch(self, sampler, coords, momenta,
+                                  elec_coords=None, elec_momenta=None):
+        weight = self._default_sampler_details(sampler)
+        if weight is None:
+            return super(GridWignerOperator, self).log_sampler_density_batch(
+                sampler, coords, momenta, elec_coords, elec_momenta
+            )
+        with np.errstate(divide='ignore'):
+            return np.log(weight(*self._features_batch(coords, momenta)))
@@ -1,16 +1,36 @@
 from openpathsampling.netcdfplus import StorableObject
+import numbers
 import numpy as np
-import dynamiq_samplers as samplers
-import pywigner as lsc
+from pywigner.tools import signed_log
+from pywigner.memo import active_cache, memoized
 
 
 class Operator(StorableObject):
+    # operators with the same (not None) _fusion_key can be combined into
+    # a single kernel with `type(op)._fuse(operators)`; see ProductOperator
+    _fusion_key = None
+
     def __init__(self):
         self.sampler = None
 
     def __mul__(self, other):
+        if isinstance(other, numbers.Number):
+            return SumOperator([self], [other])
         return ProductOperator([self, other])
 
+    def __rmul__(self, other):
+        # only reached for scalar * operator
+        return self.__mul__(other)
+
+    def __add__(self, other):
+        return SumOperator([self, other])
+
+    def __sub__(self, other):
+        return SumOperator([self, other], [1.0, -1.0])
+
+    def __neg__(self):
+        return SumOperator([self], [-1.0])
+
     def correction(self, snapshot, sampler):
         """ Op.correction(snapshot) = Op(snapshot) / Op.sampler(snapshot)
 
@@ -19,36 +39,450 @@ class Operator(StorableObject):
         using `self.sampler` as the sampling approach.
 
         Operators can override this to use shortcuts with various types of
-        samplers.
+        samplers. If a :class:`.MemoCache` is enabled, the operator and
+        sampler values go through it.
         """
-        retval = self(snapshot) / sampler(snapshot) * sampler.norm
+        retval = (memoized(self, snapshot) / memoized(sampler, snapshot)
+                  * sampler.norm)
         # TODO: add checks for TypeError if self.sampler isn't callable?
         return retval
 
+    def correction_batch(self, sampler, coords, momenta, elec_coords=None,
+                         elec_momenta=None):
+        """`correction` for each sample in a stacked ensemble.
+
+        Samplers can only be evaluated one snapshot at a time, so this is
+        only available where the operator has a closed form for the ratio,
+        i.e., when `sampler` came from the operator's `default_sampler`.
+        Arrays are as in `evaluate_batch`.
+        """
+        raise NotImplementedError("No batched correction for this sampler")
+
+    def log_value(self, snapshot):
+        """Wigner function as (sign, log of its magnitude).
+
+        Operators that are products of many factors override this to sum
+        exponents, so that the result doesn't underflow.
+        """
+        return signed_log(self(snapshot))
+
+    def log_value_batch(self, coords, momenta, elec_coords=None,
+                        elec_momenta=None):
+        """`log_value` for each sample in a stacked ensemble.
+
+        Returns
+        -------
+        tuple
+            (signs, log_magnitudes), each with shape (n_samples,)
+        """
+        return signed_log(self.evaluate_batch(coords, momenta, elec_coords,
+                                              elec_momenta))
+
+    def log_correction(self, snapshot, sampler):
+        """`correction` as (sign, log of its magnitude)"""
+        (sign, log_value) = self.log_value(snapshot)
+        log_value += np.log(sampler.norm) - np.log(sampler(snapshot))
+        return (sign, log_value)
+
+    def log_correction_batch(self, sampler, coords, momenta,
+                             elec_coords=None, elec_momenta=None):
+        """`correction_batch` as (signs, log_magnitudes)"""
+        return signed_log(self.correction_batch(sampler, coords, momenta,
+                                                elec_coords, elec_momenta))
+
+    def log_sampler_density_batch(self, sampler, coords, momenta,
+                                  elec_coords=None, elec_momenta=None):
+        """log(sampler(snapshot) / sampler.norm) for each sample.
+
+        Like `correction_batch`, this is only available when `sampler`
+        came from the operator's `default_sampler`.
+        """
+        raise NotImplementedError("No batched density for this sampler")
+
+    def _mark_default_sampler(self, sampler, details):
+        """Tag `sampler` as having been made by this operator.
+
+        `details` is whatever the operator needs to compute `correction`
+        in closed form; get it back with `_default_sampler_details`.
+        """
+        sampler._pywigner_default_for = (self, details)
+        return sampler
+
+    def _default_sampler_details(self, sampler):
+        """Details from `_mark_default_sampler`, or None if `sampler`
+        wasn't made by this operator."""
+        try:
+            (operator, details) = sampler._pywigner_default_for
+        except AttributeError:
+            return None
+        if operator is not self:
+            return None
+        return details
+
     def __call__(self, snapshot):
         raise NotImplementedError("No Wigner function for abstract operator")
 
+    def evaluate_batch(self, coords, momenta, elec_coords=None,
+                       elec_momenta=None):
+        """Wigner function for each sample in a stacked ensemble.
+
+        Parameters
+        ----------
+        coords : array-like
+            coordinates, shape (n_samples, ...), one sample per row
+        momenta : array-like
+            momenta, same shape as `coords`
+        elec_coords : array-like or None
+            electronic (MMST) coordinates, shape (n_samples, ...)
+        elec_momenta : array-like or None
+            electronic (MMST) momenta, same shape as `elec_coords`
+
+        Returns
+        -------
+        numpy.array
+            Wigner function value for each sample, shape (n_samples,)
+        """
+        raise NotImplementedError("No Wigner function for abstract operator")
+
     def default_sampler(self):
         raise NotImplementedError("No default sampler for abstract operator")
 
+    def phase_space_integral(self):
+        """Integral of the Wigner function over the operator's dofs"""
+        raise NotImplementedError("No phase space integral for this operator")
+
 
 class ProductOperator(Operator):
+    """Product of operators.
+
+    For evaluation, the operators are compiled into as few factors as
+    possible: nested products are flattened, and operators that can be
+    fused (e.g., all the nuclear coherent projections) become a single
+    kernel. So `op1 * op2 * op3` costs about one evaluation.
+    """
     def __init__(self, operators):
         super(ProductOperator, self).__init__()
         self.operators = operators
+        self._compiled = (None, None)
         # NOTE: we don't check any orthogonality here, but it will show up
         # if you try to use the default sampler.
 
+    @property
+    def _version(self):
+        # changes when any factor changes, so that memo cache entries for
+        # the product are invalidated along with those of its factors
+        return tuple((id(op), getattr(op, '_version', None))
+                     for op in self.operators)
+
+    def _flattened_operators(self):
+        for op in self.operators:
+            if isinstance(op, ProductOperator):
+                for sub_op in op._flattened_operators():
+                    yield sub_op
+            else:
+                yield op
+
+    def _factors(self):
+        """Compiled factors; each supports the evaluation methods"""
+        operators = list(self._flattened_operators())
+        key = tuple((id(op), getattr(op, '_version', None))
+                    for op in operators)
+        (compiled_key, factors) = self._compiled
+        if compiled_key == key:
+            return factors
+
+        factors = []
+        fusable = {}
+        for op in operators:
+            if op._fusion_key is None:
+                factors.append(op)
+            else:
+                fusable.setdefault(op._fusion_key, []).append(op)
+        for fusion_key in sorted(fusable.keys()):
+            group = fusable[fusion_key]
+            if len(group) == 1:
+                factors.extend(group)
+            else:
+                factors.append(type(group[0])._fuse(group))
+        self._compiled = (key, factors)
+        return factors
+
     def __call__(self, snapshot):
+        cache = active_cache()
         result = 1.0
-        for op in self.operators:
-            result *= op(snapshot)
+        for factor in self._factors():
+            if cache is None:
+                result *= factor(snapshot)
+            else:
+                result *= cache.lookup(factor, snapshot)
+        return result
+
+    def evaluate_batch(self, coords, momenta, elec_coords=None,
+                       elec_momenta=None):
+        result = 1.0
+        for factor in self._factors():
+            result = result * factor.evaluate_batch(coords, momenta,
+                                                    elec_coords,
+                                                    elec_momenta)
         return result
 
     def __mul__(self, other):
+        if isinstance(other, numbers.Number):
+            return SumOperator([self], [other])
         return ProductOperator(self.operators + [other])
 
-    def default_sampler(self):
-        return samplers.OrthogonalInitialConditions(
-            [op.default_sampler() for op in self.operators]
+    @staticmethod
+    def _log_product(factors):
+        sign = 1.0
+        log_value = 0.0
+        for (op_sign, op_log_value) in factors:
+            sign = sign * op_sign
+            log_value = log_value + op_log_value
+        return (sign, log_value)
+
+    def log_value(self, snapshot):
+        return self._log_product(factor.log_value(snapshot)
+                                 for factor in self._factors())
+
+    def log_value_batch(self, coords, momenta, elec_coords=None,
+                        elec_momenta=None):
+        return self._log_product(
+            factor.log_value_batch(coords, momenta, elec_coords,
+                                   elec_momenta)
+            for factor in self._factors()
+        )
+
+    def log_correction(self, snapshot, sampler):
+        op_samplers = self._default_sampler_details(sampler)
+        if op_samplers is None:
+            return super(ProductOperator, self).log_correction(snapshot,
+                                                               sampler)
+        return self._log_product(
+            op.log_correction(snapshot, op_sampler)
+            for (op, op_sampler) in zip(self.operators, op_samplers)
+        )
+
+    def log_correction_batch(self, sampler, coords, momenta,
+                             elec_coords=None, elec_momenta=None):
+        op_samplers = self._default_sampler_details(sampler)
+        if op_samplers is None:
+            return super(ProductOperator, self).log_correction_batch(
+                sampler, coords, momenta, elec_coords, elec_momenta
+            )
+        return self._log_product(
+            op.log_correction_batch(op_sampler, coords, momenta,
+                                    elec_coords, elec_momenta)
+            for (op, op_sampler) in zip(self.operators, op_samplers)
         )
+
+    def correction(self, snapshot, sampler):
+        op_samplers = self._default_sampler_details(sampler)
+        if op_samplers is None:
+            return super(ProductOperator, self).correction(snapshot, sampler)
+        # the default sampler is orthogonal, so the correction factorizes
+        result = 1.0
+        for (op, op_sampler) in zip(self.operators, op_samplers):
+            result *= op.correction(snapshot, op_sampler)
+        return result
+
+    def correction_batch(self, sampler, coords, momenta, elec_coords=None,
+                         elec_momenta=None):
+        op_samplers = self._default_sampler_details(sampler)
+        if op_samplers is None:
+            return super(ProductOperator, self).correction_batch(
+                sampler, coords, momenta, elec_coords, elec_momenta
+            )
+        result = 1.0
+        for (op, op_sampler) in zip(self.operators, op_samplers):
+            result = result * op.correction_batch(op_sampler, coords,
+                                                  momenta, elec_coords,
+                                                  elec_momenta)
+        return result
+
+    def phase_space_integral(self):
+        # assumes the operators act on different dofs, as for the default
+        # sampler
+        return np.prod([op.phase_space_integral() for op in self.operators])
+
+    def log_sampler_density_batch(self, sampler, coords, momenta,
+                                  elec_coords=None, elec_momenta=None):
+        op_samplers = self._default_sampler_details(sampler)
+        if op_samplers is None:
+            return super(ProductOperator, self).log_sampler_density_batch(
+                sampler, coords, momenta, elec_coords, elec_momenta
+            )
+        return sum(op.log_sampler_density_batch(op_sampler, coords, momenta,
+                                                elec_coords, elec_momenta)
+                   for (op, op_sampler) in zip(self.operators, op_samplers))
+
+    def default_sampler(self, qmc=None, random_state=None):
+        """Orthogonal product of the operators' default samplers.
+
+        Parameters
+        ----------
+        qmc : 'sobol', 'halton', or None
+            if given, the operators' samplers are QMC samplers (see
+            :meth:`.CoherentProjection.default_sampler`), and they are
+            drawn jointly from one randomized sequence, randomized from
+            `random_state`
+        """
+        if qmc:
+            op_samplers = [op.default_sampler(qmc=qmc)
+                           for op in self.operators]
+            from pywigner.qmc import QMCGaussianSampler
+            sampler = QMCGaussianSampler.orthogonal(
+                op_samplers, method=qmc, random_state=random_state
+            )
+        else:
+            op_samplers = [op.default_sampler() for op in self.operators]
+            from dynamiq_samplers import OrthogonalInitialConditions
+            sampler = OrthogonalInitialConditions(op_samplers)
+        return self._mark_default_sampler(sampler, op_samplers)
+
+
+class SumOperator(Operator):
+    """Linear combination of operators.
+
+    Made by `op1 + op2`, `op1 - op2`, and `c * op`. Nested sums are
+    flattened, and repeated operators have their coefficients combined.
+    For evaluation, each term that is a product is split into its factors;
+    every distinct factor (by identity) is evaluated once per snapshot or
+    batch, and shared by all the terms that use it. So, e.g.,
+    `nuc * elec_1 - nuc * elec_2` evaluates `nuc` once.
+
+    Parameters
+    ----------
+    operators : list of :class:`.Operator`
+        the terms
+    coefficients : list of float or None
+        coefficient of each term; default all 1
+    """
+    def __init__(self, operators, coefficients=None):
+        super(SumOperator, self).__init__()
+        if coefficients is None:
+            coefficients = [1.0] * len(operators)
+        terms = []
+        for (op, coeff) in zip(operators, coefficients):
+            if isinstance(op, SumOperator):
+                terms.extend((sub_op, coeff * sub_coeff)
+                             for (sub_op, sub_coeff) in zip(op.operators,
+                                                            op.coefficients))
+            else:
+                terms.append((op, coeff))
+        self.operators = []
+        merged = []
+        for (op, coeff) in terms:
+            for (i, known) in enumerate(self.operators):
+                if known is op:
+                    merged[i] += coeff
+                    break
+            else:
+                self.operators.append(op)
+                merged.append(coeff)
+        self.coefficients = np.array(merged, dtype=float)
+        self._compiled = (None, None)
+
+    @property
+    def _version(self):
+        # as for ProductOperator, plus the coefficients
+        return (tuple((id(op), getattr(op, '_version', None))
+                      for op in self.operators),
+                tuple(self.coefficients))
+
+    def __mul__(self, other):
+        if isinstance(other, numbers.Number):
+            return SumOperator([self], [other])
+        return ProductOperator([self, other])
+
+    def _shared_factors(self):
+        """(factors, term_factors): the distinct factors of all the terms,
+        and for each term, the indices of its factors in that list"""
+        term_ops = [list(op._flattened_operators())
+                    if isinstance(op, ProductOperator) else [op]
+                    for op in self.operators]
+        key = tuple(tuple(id(op) for op in ops) for ops in term_ops)
+        (compiled_key, compiled) = self._compiled
+        if compiled_key == key:
+            return compiled
+        factors = []
+        index = {}
+        term_factors = []
+        for ops in term_ops:
+            indices = []
+            for op in ops:
+                if id(op) not in index:
+                    index[id(op)] = len(factors)
+                    factors.append(op)
+                indices.append(index[id(op)])
+            term_factors.append(indices)
+        compiled = (factors, term_factors)
+        self._compiled = (key, compiled)
+        return compiled
+
+    def _combine(self, values, term_factors):
+        result = 0.0
+        for (coeff, indices) in zip(self.coefficients, term_factors):
+            term = coeff
+            for i in indices:
+                term = term * values[i]
+            result = result + term
+        return result
+
+    def __call__(self, snapshot):
+        (factors, term_factors) = self._shared_factors()
+        values = [memoized(factor, snapshot) for factor in factors]
+        return self._combine(values, term_factors)
+
+    def evaluate_batch(self, coords, momenta, elec_coords=None,
+                       elec_momenta=None):
+        (factors, term_factors) = self._shared_factors()
+        values = [factor.evaluate_batch(coords, momenta, elec_coords,
+                                        elec_momenta)
+                  for factor in factors]
+        return self._combine(values, term_factors)
+
+    def phase_space_integral(self):
+        return sum(coeff * op.phase_space_integral()
+                   for (coeff, op) in zip(self.coefficients, self.operators))
+
+    def default_sampler(self):
+        """Mixture of the terms' default samplers.
+
+        Each term's sampler is picked with probability proportional to the
+        magnitude of its coefficient; see :class:`.MixtureSampler` for the
+        density and norm.
+        """
+        op_samplers = [op.default_sampler() for op in self.operators]
+        from pywigner.samplers import MixtureSampler
+        sampler = MixtureSampler(op_samplers, np.abs(self.coefficients))
+        return self._mark_default_sampler(sampler, op_samplers)
+
+    def log_sampler_density_batch(self, sampler, coords, momenta,
+                                  elec_coords=None, elec_momenta=None):
+        op_samplers = self._default_sampler_details(sampler)
+        if op_samplers is None:
+            return super(SumOperator, self).log_sampler_density_batch(
+                sampler, coords, momenta, elec_coords, elec_momenta
+            )
+        # log(sum_i w_i norm_i q_i / norm_i) - log(norm), with the
+        # components in the log domain so that they don't underflow
+        with np.errstate(divide='ignore'):
+            log_terms = np.array([
+                np.log(w) + np.log(op_sampler.norm)
+                + op.log_sampler_density_batch(op_sampler, coords, momenta,
+                                               elec_coords, elec_momenta)
+                for (op, op_sampler, w) in zip(self.operators, op_samplers,
+                                               sampler.weights)
+            ])
+        peak = np.max(log_terms, axis=0)
+        return (peak + np.log(np.sum(np.exp(log_terms - peak), axis=0))
+                - np.log(sampler.norm))
+
+    def correction_batch(self, sampler, coords, momenta, elec_coords=None,
+                         elec_momenta=None):
+        log_density = self.log_sampler_density_batch(sampler, coords,
+                                                     momenta, elec_coords,
+                                                     elec_momenta)
+        values = self.evaluate_batch(coords, momenta, elec_coords,
+                                     elec_momenta)
+        return values * np.exp(-log_density)
@@ -0,0 +1,167 @@
+from pywigner.tools import as_batch, DofIndex
+from pywigner.operators.operators import Operator
+import numpy as np
+
+
+class PolynomialOperator(Operator):
+    """Polynomial in the positions and momenta of some dofs.
+
+    .. math::
+        A_W(x, p) = \\sum_t c_t \\prod_d x_d^{a_{td}} p_d^{b_{td}}
+
+    The polynomial is the Wigner function (Weyl symbol) itself, so, e.g.,
+    `x**2` is :math:`\\hat{x}^2`, and `x p` is the symmetrized
+    :math:`(\\hat{x}\\hat{p} + \\hat{p}\\hat{x})/2`. On a batch, the
+    powers of each dof are computed once, and all terms are evaluated in
+    one array expression.
+
+    Parameters
+    ----------
+    coefficients : array-like
+        :math:`c_t`, one per term
+    x_powers : array-like of int
+        :math:`a_{td}`, shape (n_terms, n_dofs)
+    p_powers : array-like of int
+        :math:`b_{td}`, shape (n_terms, n_dofs)
+    dofs : list or None
+        dofs the polynomial acts on; None for all
+    """
+    # snapshot attributes read by this operator (see _snapshot_features)
+    _feature_names = ('coordinates', 'momenta')
+
+    def __init__(self, coefficients, x_powers, p_powers, dofs=None):
+        super(PolynomialOperator, self).__init__()
+        self.coefficients = np.atleast_1d(np.asarray(coefficients,
+                                                     dtype=float))
+        self.x_powers = np.atleast_2d(np.asarray(x_powers, dtype=int))
+        self.p_powers = np.atleast_2d(np.asarray(p_powers, dtype=int))
+        n_terms = len(self.coefficients)
+        if (self.x_powers.shape[0] != n_terms
+                or self.p_powers.shape != self.x_powers.shape):
+            raise ValueError("Need x and p powers for each term and dof")
+        if np.any(self.x_powers < 0) or np.any(self.p_powers < 0):
+            raise ValueError("Powers must be nonnegative")
+        self.n_dofs = self.x_powers.shape[1]
+        if dofs is not None:
+            assert(len(dofs) == self.n_dofs)
+        self.dofs = dofs
+        self._dof_index = DofIndex(dofs)
+
+    @classmethod
+    def kinetic_energy(cls, masses, dofs=None):
+        """:math:`\\sum_d p_d^2 / 2 m_d`"""
+        masses = np.atleast_1d(np.asarray(masses, dtype=float))
+        n_dofs = len(masses)
+        return cls(0.5 / masses, np.zeros((n_dofs, n_dofs)),
+                   2 * np.eye(n_dofs), dofs)
+
+    @classmethod
+    def harmonic_energy(cls, masses, omegas, dofs=None):
+        """:math:`\\sum_d p_d^2 / 2 m_d + m_d \\omega_d^2 x_d^2 / 2`"""
+        (masses, omegas) = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(masses, dtype=float)),
+            np.atleast_1d(np.asarray(omegas, dtype=float))
+        )
+        n_dofs = len(masses)
+        squares = 2 * np.eye(n_dofs)
+        return cls(np.concatenate([0.5 / masses, 0.5 * masses * omegas**2]),
+                   np.vstack([np.zeros((n_dofs, n_dofs)), squares]),
+                   np.vstack([squares, np.zeros((n_dofs, n_dofs))]), dofs)
+
+    def to_dict(self):
+        return {'coefficients': self.coefficients,
+                'x_powers': self.x_powers,
+                'p_powers': self.p_powers,
+                'dofs': self.dofs}
+
+    def _snapshot_features(self, snapshot):
+        return (snapshot.coordinates, snapshot.momenta)
+
+    def _batch_features(self, coords, momenta, elec_coords, elec_momenta):
+        return (coords, momenta)
+
+    @staticmethod
+    def _monomials(values, powers):
+        # (n_samples, n_terms): prod_d values[:, d]**powers[t, d], with
+        # each power of each dof computed once
+        max_power = powers.max() if powers.size else 0
+        table = np.empty(values.shape + (max_power + 1,))
+        table[..., 0] = 1.0
+        for k in range(1, max_power + 1):
+            table[..., k] = table[..., k - 1] * values
+        dofs = np.arange(values.shape[1])
+        return np.prod(table[:, dofs, powers], axis=2)
+
+    def _evaluate(self, x, p):
+        x = self._dof_index(x)
+        p = self._dof_index(p)
+        terms = self._monomials(x, self.x_powers)
+        terms *= self._monomials(p, self.p_powers)
+        return np.dot(terms, self.coefficients)
+
+    def evaluate_batch(self, coords, momenta, elec_coords=None,
+                       elec_momenta=None):
+        (x, p) = self._batch_features(coords, momenta, elec_coords,
+                                      elec_momenta)
+        return self._evaluate(as_batch(x), as_batch(p))
+
+    def __call__(self, snapshot):
+        (x, p) = self._snapshot_features(snapshot)
+        return self._evaluate(
+            np.asarray(x, dtype=float).ravel()[np.newaxis],
+            np.asarray(p, dtype=float).ravel()[np.newaxis]
+        )[0]
+
+
+class ElectronicPolynomialOperator(PolynomialOperator):
+    """:class:`PolynomialOperator` in the electronic (MMST) variables"""
+    _feature_names = ('electronic_coordinates', 'electronic_momenta')
+
+    def _snapshot_features(self, snapshot):
+        return (snapshot.electronic_coordinates, snapshot.electronic_momenta)
+
+    def _batch_features(self, coords, momenta, elec_coords, elec_momenta):
+        if elec_coords is None or elec_momenta is None:
+            raise ValueError("ElectronicPolynomialOperator requires "
+                             + "elec_coords and elec_momenta")
+        return (elec_coords, elec_momenta)
+
+
+class PositionOperator(PolynomialOperator):
+    """:math:`x_d^n` for one dof
+
+    Parameters
+    ----------
+    dof : int
+        the dof
+    power : int
+        the power n
+    """
+    def __init__(self, dof=0, power=1):
+        super(PositionOperator, self).__init__([1.0], [[power]], [[0]],
+                                               dofs=[dof])
+        self.dof = dof
+        self.power = power
+
+    def to_dict(self):
+        return {'dof': self.dof, 'power': self.power}
+
+
+class MomentumOperator(PolynomialOperator):
+    """:math:`p_d^n` for one dof
+
+    Parameters
+    ----------
+    dof : int
+        the dof
+    power : int
+        the power n
+    """
+    def __init__(self, dof=0, power=1):
+        super(MomentumOperator, self).__init__([1.0], [[0]], [[power]],
+                                               dofs=[dof])
+        self.dof = dof
+        self.power = power
+
+    def to_dict(self):
+        return {'dof': self.dof, 'power': self.power}
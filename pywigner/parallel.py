@@ -0,0 +1,150 @@
+"""
+Parallel sampling of ensembles with reproducible random number streams.
+
+The ensemble is split into blocks of fixed size. Block `i` gets its own
+random stream, seeded from `(master_seed, i)`, and the blocks' partial
+results are merged in block order. Since neither the blocks nor the merge
+order depend on the number of workers, the result for a given seed is
+bitwise identical however many workers are used.
+"""
+import collections
+import multiprocessing
+import numpy as np
+from pywigner.correlation import CorrelationFunction
+
+def stream_seed(master_seed, block):
+    """Seed of the random stream for a block of the ensemble.
+
+    This can be passed to `numpy.random.seed` or `numpy.random.RandomState`,
+    which hash it into an independent initial state.
+    """
+    return [int(master_seed), int(block)]
+
+
+def block_sizes(n_samples, block_size):
+    """Number of samples in each block"""
+    n_full = n_samples // block_size
+    sizes = [block_size] * n_full
+    if n_samples % block_size:
+        sizes.append(n_samples % block_size)
+    return sizes
+
+
+class EnsembleTask(object):
+    """Sample and accumulate one block of an ensemble.
+
+    This is the unit of work sent to the worker processes, so it (and the
+    operators, sampler, and `propagate` it holds) must be picklable.
+
+    Parameters
+    ----------
+    a_operator : :class:`.Operator`
+        the operator at time 0
+    b_operators : :class:`.Operator` or list of :class:`.Operator`
+        the operator(s) at time t
+    sampler :
+        initial condition sampler, e.g., `a_operator.default_sampler()`;
+        draws from the global `numpy.random` state
+    template : snapshot
+        snapshot passed to `sampler.generate_initial_snapshot`
+    propagate : callable or None
+        `propagate(snapshot)` gives the trajectory (an iterable of
+        snapshots) starting from `snapshot`. If None, only time 0 is
+        evaluated, i.e., the result is an observable estimate.
+    """
+    def __init__(self, a_operator, b_operators, sampler, template,
+                 propagate=None):
+        self.a_operator = a_operator
+        self.b_operators = b_operators
+        self.sampler = sampler
+        self.template = template
+        self.propagate = propagate
+
+    def __call__(self, n_samples, seed):
+        # the sampler draws from the global state; when the blocks run in
+        # the caller's process, leave the caller's stream as it was
+        state = np.random.get_state()
+        np.random.seed(seed)
+        try:
+            result = CorrelationFunction(self.a_operator, self.b_operators,
+                                         self.sampler)
+            for _ in range(n_samples):
+                snapshot = self.sampler.generate_initial_snapshot(
+                    self.template
+                )
+                if self.propagate is None:
+                    trajectory = [snapshot]
+                else:
+                    trajectory = self.propagate(snapshot)
+                result.add_trajectory(trajectory)
+        finally:
+            np.random.set_state(state)
+        return result
+
+
+def iter_block_results(task, sizes, seeds, max_workers=None):
+    """Results of the blocks, in block order, as they become available.
+
+    With more than one worker, one block per worker is kept in flight, so
+    work stops being submitted soon after the caller stops asking (closing
+    the generator cancels the blocks not yet started).
+    """
+    if max_workers == 1:
+        for (n, seed) in zip(sizes, seeds):
+            yield task(n, seed)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        n_ahead = max_workers or multiprocessing.cpu_count()
+        pending = collections.deque()
+        try:
+            for (n, seed) in zip(sizes, seeds):
+                pending.append(pool.submit(task, n, seed))
+                if len(pending) >= n_ahead:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def run_ensemble(task, n_samples, master_seed, block_size=1000,
+                 max_workers=None):
+    """Run an ensemble, in parallel over a process pool.
+
+    Parameters
+    ----------
+    task : callable
+        `task(n_samples, seed)` returns a partial result with a `merge`
+        method, e.g., an :class:`.EnsembleTask`; must be picklable
+    n_samples : int
+        total number of samples
+    master_seed : int
+        seed from which all the block streams are derived
+    block_size : int
+        samples per block; the result depends on this (but not on
+        `max_workers`)
+    max_workers : int or None
+        number of worker processes; 1 runs serially in this process, and
+        None uses one per CPU
+
+    Returns
+    -------
+    the merged result of all blocks
+    """
+    sizes = block_sizes(n_samples, block_size)
+    seeds = [stream_seed(master_seed, i) for i in range(len(sizes))]
+    if max_workers == 1:
+        partials = [task(n, seed) for (n, seed) in zip(sizes, seeds)]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            partials = list(pool.map(task, sizes, seeds))
+
+    if len(partials) == 0:
+        return None
+    result = partials[0]
+    for partial in partials[1:]:
+        result.merge(partial)
+    return result
@@ -0,0 +1,299 @@
+"""
+Quasi-Monte Carlo initial conditions for Gaussian samplers.
+
+The default samplers of the coherent projections are products of
+Gaussians, so they can be sampled by mapping points of a randomized
+low-discrepancy sequence through the inverse Gaussian CDF. For smooth
+integrands, the error of the mean then falls off close to 1/N instead of
+1/sqrt(N). Because the points aren't independent, the sample variance
+doesn't give the error; instead, :func:`replica_estimate` repeats the
+estimate with independently randomized replicas of the sequence and uses
+the spread of the replica means.
+"""
+import collections
+import warnings
+
+import numpy as np
+
+from pywigner.tools import stack_snapshots
+
+# order of the feature arrays in a batch, as in `stack_snapshots`
+BATCH_FEATURES = ['coordinates', 'momenta',
+                  'electronic_coordinates', 'electronic_momenta']
+
+QMC_METHODS = ['sobol', 'halton']
+
+GaussianBlock = collections.namedtuple(
+    'GaussianBlock',
+    ['x_feature', 'p_feature', 'dofs', 'x0', 'alpha_x', 'p0', 'alpha_p']
+)
+"""Gaussian on some dofs of a pair of features.
+
+The (unnormalized) density is
+:math:`\\exp(-\\alpha_x (x - x_0)^2 - \\alpha_p (p - p_0)^2)`, summed over
+the dofs; `dofs` is None for all of them.
+"""
+
+
+def _random_state(random_state):
+    if isinstance(random_state, np.random.RandomState):
+        return random_state
+    return np.random.RandomState(random_state)
+
+
+def primes(n):
+    """The first `n` prime numbers"""
+    found = []
+    candidate = 2
+    while len(found) < n:
+        if all(candidate % p for p in found if p*p <= candidate):
+            found.append(candidate)
+        candidate += 1
+    return np.array(found, dtype=int)
+
+
+class ShiftedHalton(object):
+    """Halton sequence with a random shift modulo 1 (Cranley-Patterson).
+
+    Every point of the shifted sequence is uniform on the unit cube, so
+    averages over it are unbiased. Pure numpy; used when SciPy's
+    `scipy.stats.qmc` isn't available, or when asked for.
+
+    Parameters
+    ----------
+    dimension : int
+        dimension of the points
+    seed : int or None
+        seed for the shift
+    """
+    def __init__(self, dimension, seed=None):
+        self.bases = primes(dimension)
+        self.shift = np.random.RandomState(seed).random_sample(dimension)
+        self._index = 0
+
+    def random(self, n):
+        """The next `n` points, shape (n, dimension)"""
+        index = np.arange(self._index, self._index + n)
+        self._index += n
+        points = np.empty((n, len(self.bases)))
+        for (dim, base) in enumerate(self.bases):
+            remaining = index.copy()
+            value = np.zeros(n)
+            scale = 1.0 / base
+            while np.any(remaining > 0):
+                value += (remaining % base) * scale
+                remaining //= base
+                scale /= base
+            points[:, dim] = value
+        return np.mod(points + self.shift, 1.0)
+
+
+def _scrambled_sobol(dimension, seed):
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        raise ImportError("Sobol points need scipy.stats.qmc (SciPy 1.7+);"
+                          + " use qmc='halton' instead")
+    try:
+        return qmc.Sobol(dimension, scramble=True, rng=seed)
+    except TypeError:  # SciPy before 1.15
+        return qmc.Sobol(dimension, scramble=True, seed=seed)
+
+
+class QMCGaussianSampler(object):
+    """Product of Gaussians, sampled from a randomized QMC sequence.
+
+    Follows the interface of the dynamiq_samplers initial conditions:
+    `sampler(snapshot)` is the normalized density and `sampler.norm` its
+    normalization, so `sampler(snapshot) / sampler.norm` is the unnormalized
+    Gaussian of the blocks. Points are taken from the sequence in order, by
+    :meth:`generate_initial_snapshot` (one at a time) or
+    :meth:`generate_batch`.
+
+    Each copy of the sampler continues its own sequence, so don't use it
+    to generate independent blocks in different processes (e.g., with
+    :func:`.run_ensemble`); use :meth:`replica` for independent
+    randomizations.
+
+    Parameters
+    ----------
+    blocks : list of :class:`GaussianBlock`
+        Gaussians to sample; together, they use one point of dimension
+        twice the total number of dofs
+    method : 'sobol' or 'halton'
+        scrambled Sobol' points (needs SciPy 1.7+) or randomly shifted
+        Halton points
+    random_state : int, numpy.random.RandomState, or None
+        source of the randomization
+    """
+    def __init__(self, blocks, method='sobol', random_state=None):
+        if method not in QMC_METHODS:
+            raise ValueError("Unknown QMC method: " + str(method))
+        self.blocks = list(blocks)
+        self.method = method
+        self.dimension = 2 * sum(len(b.x0) for b in self.blocks)
+        log_norm = sum(0.5 * np.sum(np.log(b.alpha_x / np.pi))
+                       + 0.5 * np.sum(np.log(b.alpha_p / np.pi))
+                       for b in self.blocks)
+        self.norm = np.exp(log_norm)
+        self.seed = _random_state(random_state).randint(2**31 - 1)
+        self._sequence = None
+
+    @classmethod
+    def orthogonal(cls, samplers, method='sobol', random_state=None):
+        """Joint sampler for the blocks of several QMC samplers.
+
+        The blocks share one sequence of higher dimension; drawing each
+        sampler from its own sequence would lose the low discrepancy of
+        the joint points.
+        """
+        blocks = sum([list(s.blocks) for s in samplers], [])
+        return cls(blocks, method=method, random_state=random_state)
+
+    def replica(self, random_state=None):
+        """Independently randomized copy of this sampler.
+
+        The copy keeps the closed-form correction of the operator that
+        made this sampler, if any.
+        """
+        copy = type(self)(self.blocks, method=self.method,
+                          random_state=random_state)
+        try:
+            copy._pywigner_default_for = self._pywigner_default_for
+        except AttributeError:
+            pass
+        return copy
+
+    def uniform(self, n_samples):
+        """Next `n_samples` points of the sequence in the unit cube"""
+        if self._sequence is None:
+            if self.method == 'sobol':
+                self._sequence = _scrambled_sobol(self.dimension, self.seed)
+            else:
+                self._sequence = ShiftedHalton(self.dimension, self.seed)
+        with warnings.catch_warnings():
+            # Sobol' balance is best for powers of 2, but any n works
+            warnings.simplefilter('ignore')
+            points = self._sequence.random(n_samples)
+        # keep the inverse CDF finite
+        tiny = np.finfo(float).tiny
+        return np.clip(points, tiny, 1.0 - np.finfo(float).epsneg)
+
+    def normal(self, n_samples):
+        """Next `n_samples` points as standard normal deviates"""
+        from scipy.special import ndtri
+        return ndtri(self.uniform(n_samples))
+
+    def _fill(self, features, normals):
+        # features: dict of name to (n_samples, n_features) arrays
+        column = 0
+        for block in self.blocks:
+            n_dofs = len(block.x0)
+            z_x = normals[:, column:column + n_dofs]
+            z_p = normals[:, column + n_dofs:column + 2*n_dofs]
+            column += 2 * n_dofs
+            dofs = slice(None) if block.dofs is None else block.dofs
+            features[block.x_feature][:, dofs] = (
+                block.x0 + z_x * np.sqrt(0.5 / block.alpha_x)
+            )
+            features[block.p_feature][:, dofs] = (
+                block.p0 + z_p * np.sqrt(0.5 / block.alpha_p)
+            )
+
+    def generate_batch(self, n_samples, template):
+        """Next `n_samples` initial conditions as stacked features.
+
+        Features that aren't sampled come from `template`.
+
+        Parameters
+        ----------
+        n_samples : int
+            number of samples
+        template : snapshot
+            snapshot giving the shape and unsampled values of the features
+
+        Returns
+        -------
+        tuple
+            (coords, momenta, elec_coords, elec_momenta), as from
+            :func:`.stack_snapshots`
+        """
+        template_features = stack_snapshots([template])
+        features = {}
+        for (name, values) in zip(BATCH_FEATURES, template_features):
+            if values is not None:
+                features[name] = np.repeat(values, n_samples, axis=0)
+        self._fill(features, self.normal(n_samples))
+        return tuple(features.get(name) for name in BATCH_FEATURES)
+
+    def generate_initial_snapshot(self, snapshot):
+        """Copy of `snapshot` with the next point of the sequence"""
+        new_snapshot = snapshot.copy()
+        features = {}
+        for block in self.blocks:
+            for name in [block.x_feature, block.p_feature]:
+                if name not in features:
+                    features[name] = np.array(getattr(snapshot, name),
+                                              dtype=float).ravel()[np.newaxis]
+        self._fill(features, self.normal(1))
+        for (name, values) in features.items():
+            setattr(new_snapshot, name, values[0])
+        return new_snapshot
+
+    def __call__(self, snapshot):
+        exponent = 0.0
+        for block in self.blocks:
+            x = np.asarray(getattr(snapshot, block.x_feature)).ravel()
+            p = np.asarray(getattr(snapshot, block.p_feature)).ravel()
+            if block.dofs is not None:
+                x = x[block.dofs]
+                p = p[block.dofs]
+            exponent += np.dot((x - block.x0)**2, block.alpha_x)
+            exponent += np.dot((p - block.p0)**2, block.alpha_p)
+        return self.norm * np.exp(-exponent)
+
+
+def replica_estimate(function, sampler, template, n_samples, n_replicas=8,
+                     random_state=None):
+    """Mean and error of a QMC estimate from randomized replicas.
+
+    Each replica is an independent randomization of `sampler`'s sequence
+    (see :meth:`QMCGaussianSampler.replica`); the estimate is the mean of
+    the replica means, and its standard error comes from their spread.
+
+    Parameters
+    ----------
+    function : callable
+        `function(sampler, coords, momenta, elec_coords, elec_momenta)`
+        giving the integrand for each sample of a batch, with the samples
+        along the first axis; e.g., the correction weights
+        `a_op.correction_batch(sampler, ...)` times `b_op.evaluate_batch`
+    sampler : :class:`QMCGaussianSampler`
+        the sampler to replicate
+    template : snapshot
+        template for :meth:`QMCGaussianSampler.generate_batch`
+    n_samples : int
+        samples per replica; powers of 2 work best with Sobol' points
+    n_replicas : int
+        number of replicas, at least 2
+    random_state : int, numpy.random.RandomState, or None
+        source of the replica randomizations
+
+    Returns
+    -------
+    tuple
+        (mean, standard_error), each with the shape of one sample of
+        `function`
+    """
+    if n_replicas < 2:
+        raise ValueError("Need at least 2 replicas for an error estimate")
+    random_state = _random_state(random_state)
+    means = []
+    for _ in range(n_replicas):
+        replica = sampler.replica(random_state)
+        batch = replica.generate_batch(n_samples, template)
+        values = np.asarray(function(replica, *batch), dtype=float)
+        means.append(values.mean(axis=0))
+    means = np.array(means)
+    return (means.mean(axis=0),
+            means.std(axis=0, ddof=1) / np.sqrt(n_replicas))
@@ -0,0 +1,42 @@
+"""
+Samplers built from other samplers.
+"""
+import numpy as np
+
+
+class MixtureSampler(object):
+    """Mixture of samplers: pick a component, then sample from it.
+
+    Follows the sampler convention of dynamiq_samplers: `sampler(snapshot)`
+    is the normalized density, :math:`\\sum_i w_i q_i`, and `norm` is
+    :math:`\\sum_i w_i \\mathrm{norm}_i`, so a mixture of one sampler
+    behaves like that sampler. Components are picked with `numpy.random`,
+    which is what the dynamiq samplers draw from, so seeding it makes runs
+    reproducible.
+
+    Parameters
+    ----------
+    samplers : list
+        component samplers
+    weights : array-like
+        nonnegative weight of each component; normalized to sum to 1
+    """
+    def __init__(self, samplers, weights):
+        self.samplers = list(samplers)
+        weights = np.asarray(weights, dtype=float)
+        if len(weights) != len(self.samplers):
+            raise ValueError("Need one weight per sampler")
+        if np.any(weights < 0) or not np.sum(weights) > 0:
+            raise ValueError("Weights must be nonnegative, not all zero")
+        self.weights = weights / np.sum(weights)
+        self.norm = sum(w * s.norm
+                        for (w, s) in zip(self.weights, self.samplers))
+
+    def __call__(self, snapshot):
+        return sum(w * s(snapshot)
+                   for (w, s) in zip(self.weights, self.samplers)
+                   if w > 0)
+
+    def generate_initial_snapshot(self, snapshot):
+        component = np.random.choice(len(self.samplers), p=self.weights)
+        return self.samplers[component].generate_initial_snapshot(snapshot)
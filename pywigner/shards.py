@@ -0,0 +1,68 @@
+"""
+On-disk partial results ("shards") of ensemble accumulations.
+
+Each shard holds the running statistics (counts, means, and sums of
+squared deviations) of one independent job, along with a key identifying
+the A-operator, B-operators, and sampler that produced it. Shards are
+stored as compressed numpy `.npz` files and can be reduced with
+:mod:`pywigner.merge`.
+"""
+import os
+import numpy as np
+from pywigner.accumulators import RunningStatistics
+from pywigner.tools import fingerprint
+
+SHARD_FORMAT_VERSION = 1
+
+
+class ShardMismatchError(ValueError):
+    """Raised when combining shards from different operators/samplers"""
+    pass
+
+
+def correlation_key(correlation):
+    """Key identifying the operators and sampler of a correlation"""
+    return fingerprint([correlation.a_operator, correlation.b_operators,
+                        correlation.sampler])
+
+
+def write_statistics(filename, key, statistics):
+    """Write running statistics to a shard file.
+
+    The file is written to a temporary name and then renamed, so a shard
+    is either complete or absent.
+    """
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, 'wb') as f:
+        np.savez_compressed(f, format_version=SHARD_FORMAT_VERSION,
+                            key=np.array(key), count=statistics.count,
+                            mean=statistics.mean, m2=statistics.m2)
+    os.rename(tmp_filename, filename)
+
+
+def write_shard(filename, correlation):
+    """Write a :class:`.CorrelationFunction`'s statistics to a shard"""
+    write_statistics(filename, correlation_key(correlation),
+                     correlation.statistics)
+
+
+def read_shard(filename):
+    """Read a shard file.
+
+    Returns
+    -------
+    tuple
+        (key, statistics) with statistics a :class:`.RunningStatistics`
+    """
+    with np.load(filename) as data:
+        version = int(data['format_version'])
+        if version != SHARD_FORMAT_VERSION:
+            raise ShardMismatchError(
+                "%s has shard format %d; expected %d"
+                % (filename, version, SHARD_FORMAT_VERSION)
+            )
+        key = str(data['key'])
+        statistics = RunningStatistics.from_dict(
+            {'count': data['count'], 'mean': data['mean'], 'm2': data['m2']}
+        )
+    return (key, statistics)
@@ -0,0 +1,88 @@
+import numpy as np
+from pywigner.accumulators import RunningStatistics, RunningCovariance
+
+from pywigner.tests.tools import *
+
+class testRunningStatistics(object):
+    def setup(self):
+        self.values = np.array([[1.0, 2.0], [3.0, 5.0], [2.0, 2.0],
+                                [7.0, -1.0]])
+
+    def test_add(self):
+        stats = RunningStatistics((2,))
+        for value in self.values:
+            stats.add(value)
+        assert_array_almost_equal(stats.count, [4, 4])
+        assert_array_almost_equal(stats.mean, self.values.mean(axis=0))
+        assert_array_almost_equal(stats.variance,
+                                  self.values.var(axis=0, ddof=1))
+        assert_array_almost_equal(
+            stats.standard_error,
+            np.sqrt(self.values.var(axis=0, ddof=1) / 4.0)
+        )
+
+    def test_add_batch_and_merge(self):
+        stats_a = RunningStatistics((2,))
+        stats_a.add_batch(self.values[:1])
+        stats_b = RunningStatistics((2,))
+        stats_b.add_batch(self.values[1:])
+        stats_a.merge(stats_b)
+        assert_array_almost_equal(stats_a.mean, self.values.mean(axis=0))
+        assert_array_almost_equal(stats_a.variance,
+                                  self.values.var(axis=0, ddof=1))
+
+    def test_ragged_samples(self):
+        stats = RunningStatistics((0,))
+        stats.add([1.0, 2.0, 3.0])
+        stats.add([3.0])
+        stats.add([2.0], offset=2)
+        assert_array_almost_equal(stats.count, [2, 1, 2])
+        assert_array_almost_equal(stats.mean, [2.0, 2.0, 2.5])
+        assert_equal(np.isnan(stats.variance[1]), True)
+
+    def test_scalar(self):
+        stats = RunningStatistics(())
+        stats.add_batch([1.0, 2.0, 3.0])
+        stats.add(6.0)
+        assert_equal(stats.count, 4)
+        assert_almost_equal(stats.mean, 3.0)
+        assert_almost_equal(stats.variance, 14.0 / 3.0)
+
+    def test_dict_round_trip(self):
+        stats = RunningStatistics((2,))
+        stats.add_batch(self.values)
+        reloaded = RunningStatistics.from_dict(stats.to_dict())
+        assert_array_almost_equal(reloaded.mean, stats.mean)
+        assert_array_almost_equal(reloaded.m2, stats.m2)
+        assert_array_almost_equal(reloaded.count, stats.count)
+
+
+class testRunningCovariance(object):
+    def setup(self):
+        self.controls = np.array([[0.1, 1.0], [0.5, -1.0], [0.2, 0.3],
+                                  [0.9, 0.0], [-0.4, 2.0]])
+        self.values = np.array([[1.0, 2.0], [3.0, 5.0], [2.0, 2.0],
+                                [7.0, -1.0], [0.5, 0.0]])
+
+    def test_add_batch_and_merge(self):
+        stats = RunningCovariance(2, (2,))
+        stats.add_batch(self.controls[:2], self.values[:2])
+        other = RunningCovariance(2, (2,))
+        other.add_batch(self.controls[2:], self.values[2:])
+        stats.merge(other)
+        joint = np.cov(np.concatenate([self.controls, self.values],
+                                      axis=1).T)
+        assert_equal(stats.count, 5)
+        assert_array_almost_equal(stats.control_mean,
+                                  self.controls.mean(axis=0))
+        assert_array_almost_equal(stats.mean, self.values.mean(axis=0))
+        assert_array_almost_equal(stats.control_m2 / 4.0, joint[:2, :2])
+        assert_array_almost_equal(stats.cross_m2 / 4.0, joint[:2, 2:])
+        assert_array_almost_equal(stats.m2 / 4.0, np.diag(joint)[2:])
+
+    def test_to_dict_roundtrip(self):
+        stats = RunningCovariance(2, (2,))
+        stats.add_batch(self.controls, self.values)
+        copy = RunningCovariance.from_dict(stats.to_dict())
+        assert_equal(copy.count, 5)
+        assert_array_almost_equal(copy.cross_m2, stats.cross_m2)
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+from pywigner.benchmarks import *
+
+from pywigner.tests.tools import *
+
+class testBenchmarks(object):
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.history = os.path.join(self.tmpdir, "history.jsonl")
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cases(self):
+        names = [name for (name, func) in benchmark_cases(**QUICK)]
+        assert_equal(len(names), len(set(names)))
+        assert_equal(
+            "CoherentProjection.__call__[n_dofs=10,excitons=single]" 
+            in names, True
+        )
+        for (name, func) in benchmark_cases(**QUICK):
+            func()
+
+    def test_batch_cap(self):
+        names = [name for (name, func) in benchmark_cases(
+            n_dofs=[200], exciton_patterns=['ground'], product_depths=[],
+            n_samples=[100, 10000]
+        )]
+        assert_equal(
+            "CoherentProjection.evaluate_batch[n_dofs=200,n_samples=100]"
+            in names, True
+        )
+        assert_equal(any("n_samples=10000" in name for name in names),
+                     False)
+
+    def test_compare(self):
+        baseline = {'results': {'a': 1.0, 'b': 1.0, 'c': 1.0}}
+        current = {'results': {'a': 1.1, 'b': 3.0, 'c': 1.5, 'd': 9.0}}
+        regressions = compare_results(baseline, current, threshold=1.2)
+        assert_equal([r[0] for r in regressions], ['b', 'c'])
+
+    def test_run_and_compare(self):
+        cases = [(name, func) for (name, func)
+                 in benchmark_cases(n_dofs=[1], exciton_patterns=['ground'],
+                                    product_depths=[], n_samples=[])]
+        for _ in range(2):
+            append_history(self.history,
+                           run_benchmarks(cases, min_time=0.0, repeat=1))
+        history = load_history(self.history)
+        assert_equal(len(history), 2)
+        assert_equal(set(history[0]['results'].keys()),
+                     set(name for (name, func) in cases))
+        assert_equal(main(['compare', '--history', self.history,
+                           '--threshold', '1e9']), 0)
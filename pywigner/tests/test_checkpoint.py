@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from pywigner.parallel import run_ensemble
+from pywigner.shards import read_shard, ShardMismatchError
+from pywigner.checkpoint import *
+from pywigner.tests.test_parallel import testRunEnsemble
+
+from pywigner.tests.tools import *
+
+class Preempted(Exception):
+    pass
+
+
+class PreemptedTask(object):
+    # the wrapped task, killed after a number of blocks
+    def __init__(self, task, n_blocks):
+        self.task = task
+        self.n_blocks = n_blocks
+
+    def __call__(self, n_samples, seed):
+        if n_samples > 0:
+            if self.n_blocks == 0:
+                raise Preempted()
+            self.n_blocks -= 1
+        return self.task(n_samples, seed)
+
+
+class testCheckpoint(object):
+    def setup(self):
+        ensemble = testRunEnsemble()
+        ensemble.setup()
+        self.task = ensemble.task
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "checkpoint.npz")
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _preempted_run(self, n_blocks, every=1):
+        try:
+            run_with_checkpoints(PreemptedTask(self.task, n_blocks), 25,
+                                 master_seed=5, filename=self.filename,
+                                 block_size=4, every=every)
+        except Preempted:
+            pass
+        else:
+            raise AssertionError("Run wasn't preempted")
+
+    def test_restart_reproduces(self):
+        expected = run_ensemble(self.task, 25, master_seed=5, block_size=4,
+                                max_workers=1)
+        self._preempted_run(3)
+        (position, _) = read_checkpoint(self.filename)
+        assert_equal((position['n_blocks'], position['n_done']), (3, 12))
+        result = run_with_checkpoints(self.task, 25, master_seed=5,
+                                      filename=self.filename, block_size=4)
+        assert_equal(result.n_trajectories, 25)
+        assert_equal(np.array_equal(result.mean, expected.mean), True)
+        assert_equal(np.array_equal(result.statistics.m2,
+                                    expected.statistics.m2), True)
+        # the final checkpoint is a complete shard
+        (key, statistics) = read_shard(self.filename)
+        assert_equal(np.array_equal(statistics.mean, expected.mean), True)
+
+    def test_every(self):
+        # killed after 3 blocks, with checkpoints every 2: redo block 2
+        self._preempted_run(3, every=2)
+        (position, _) = read_checkpoint(self.filename)
+        assert_equal(position['n_blocks'], 2)
+        expected = run_ensemble(self.task, 25, master_seed=5, block_size=4,
+                                max_workers=1)
+        result = run_with_checkpoints(self.task, 25, master_seed=5,
+                                      filename=self.filename, block_size=4,
+                                      every=2, asynchronous=False)
+        assert_equal(np.array_equal(result.mean, expected.mean), True)
+
+    def test_extend(self):
+        run_with_checkpoints(self.task, 16, master_seed=5,
+                             filename=self.filename, block_size=4)
+        result = run_with_checkpoints(self.task, 25, master_seed=5,
+                                      filename=self.filename, block_size=4)
+        expected = run_ensemble(self.task, 25, master_seed=5, block_size=4,
+                                max_workers=1)
+        assert_equal(np.array_equal(result.mean, expected.mean), True)
+
+    def test_parallel_restart(self):
+        self._preempted_run(2)
+        result = run_with_checkpoints(self.task, 25, master_seed=5,
+                                      filename=self.filename, block_size=4,
+                                      max_workers=2)
+        expected = run_ensemble(self.task, 25, master_seed=5, block_size=4,
+                                max_workers=1)
+        assert_equal(np.array_equal(result.mean, expected.mean), True)
+
+    @raises(ShardMismatchError)
+    def test_other_seed(self):
+        self._preempted_run(2)
+        run_with_checkpoints(self.task, 25, master_seed=6,
+                             filename=self.filename, block_size=4)
+
+    @raises(ShardMismatchError)
+    def test_fewer_samples(self):
+        run_with_checkpoints(self.task, 10, master_seed=5,
+                             filename=self.filename, block_size=4)
+        run_with_checkpoints(self.task, 25, master_seed=5,
+                             filename=self.filename, block_size=4)
+
+    def test_writer(self):
+        with CheckpointWriter(self.filename) as writer:
+            for i in range(5):
+                writer.submit({'format_version': 1, 'key': np.array('k'),
+                               'master_seed': 0, 'block_size': 1,
+                               'n_blocks': i, 'n_done': i,
+                               'mean': np.arange(i)})
+            writer.flush()
+            assert_equal(writer.n_written >= 1, True)
+        (position, statistics) = read_checkpoint(self.filename)
+        assert_equal(position['n_blocks'], 4)
+        assert_array_almost_equal(statistics['mean'], np.arange(4))
+        assert_equal(os.path.exists(self.filename + ".tmp"), False)
+
+    @raises(IOError)
+    def test_writer_error(self):
+        filename = os.path.join(self.tmpdir, "missing", "checkpoint.npz")
+        writer = CheckpointWriter(filename)
+        writer.submit({'n_blocks': 0})
+        writer.close()
@@ -0,0 +1,87 @@
+import numpy as np
+from pywigner.operators import *
+from pywigner.parallel import run_ensemble
+from pywigner.convergence import *
+from pywigner.tests.test_parallel import testRunEnsemble
+
+from pywigner.tests.tools import *
+
+class testRunUntilConverged(object):
+    def setup(self):
+        # same task as the parallel tests: 3 frames, 1 B-operator
+        ensemble = testRunEnsemble()
+        ensemble.setup()
+        self.task = ensemble.task
+
+    def test_tolerance_ratio(self):
+        ratio = tolerance_ratio(np.array([2.0, -4.0, 1.0]),
+                                np.array([0.1, 0.1, np.nan]),
+                                atol=0.05, rtol=0.1)
+        assert_array_almost_equal(ratio[:2], [0.4, 0.2222222222])
+        assert_equal(ratio[2], np.inf)
+
+    def test_converges(self):
+        report = run_until_converged(self.task, master_seed=3, rtol=0.2,
+                                     block_size=10, max_samples=1000,
+                                     max_workers=1)
+        assert_equal(report.converged, True)
+        assert_equal(report.n_samples < 1000, True)
+        assert_equal(report.n_samples, 10 * report.n_blocks)
+        assert_equal(report.result.n_trajectories, report.n_samples)
+        assert_equal(len(report.history), report.n_blocks)
+        assert_equal(report.history[-1][1] <= 1.0, True)
+        assert_equal(report.history[-2][1] > 1.0, True)
+        # same as running that many samples directly
+        direct = run_ensemble(self.task, report.n_samples, master_seed=3,
+                              block_size=10, max_workers=1)
+        assert_equal(np.array_equal(direct.mean, report.result.mean), True)
+
+    def test_stops_sampling(self):
+        # blocks after convergence are never run
+        calls = []
+        def task(n_samples, seed):
+            calls.append(n_samples)
+            return self.task(n_samples, seed)
+        report = run_until_converged(task, master_seed=3, rtol=0.2,
+                                     block_size=10, max_samples=1000,
+                                     max_workers=1)
+        assert_equal(len(calls), report.n_blocks)
+
+    def test_budget(self):
+        report = run_until_converged(self.task, master_seed=3, atol=1e-6,
+                                     block_size=10, max_samples=35,
+                                     max_workers=1)
+        assert_equal(report.converged, False)
+        assert_equal(report.n_samples, 35)
+        assert_equal(report.to_dict()['n_blocks'], 4)
+
+    def test_min_samples_and_targets(self):
+        loose = run_until_converged(self.task, master_seed=3, atol=10.0,
+                                    block_size=10, max_samples=1000,
+                                    min_samples=30, max_workers=1)
+        assert_equal(loose.n_samples, 30)
+        # only time 0 must converge: stops no later than for all times
+        targets = np.array([[True], [False], [False]])
+        first_only = run_until_converged(self.task, master_seed=3,
+                                         rtol=0.1, block_size=10,
+                                         max_samples=2000, targets=targets,
+                                         max_workers=1)
+        every = run_until_converged(self.task, master_seed=3, rtol=0.1,
+                                    block_size=10, max_samples=2000,
+                                    max_workers=1)
+        assert_equal(first_only.n_samples <= every.n_samples, True)
+
+    def test_independent_of_workers(self):
+        serial = run_until_converged(self.task, master_seed=3, rtol=0.2,
+                                     block_size=10, max_samples=1000,
+                                     max_workers=1)
+        parallel = run_until_converged(self.task, master_seed=3, rtol=0.2,
+                                       block_size=10, max_samples=1000,
+                                       max_workers=3)
+        assert_equal(parallel.n_samples, serial.n_samples)
+        assert_equal(np.array_equal(parallel.result.mean,
+                                    serial.result.mean), True)
+
+    @raises(ValueError)
+    def test_needs_tolerance(self):
+        run_until_converged(self.task, master_seed=3)
@@ -0,0 +1,74 @@
+import dynamiq_engine as dynq
+import numpy as np
+from pywigner.operators import *
+from pywigner.correlation import CorrelationFunction
+from pywigner.tools import stack_snapshots
+
+from pywigner.tests.tools import *
+
+class testCorrelationFunction(object):
+    def setup(self):
+        self.a_op = CoherentProjection(x0=np.array([0.5]),
+                                       p0=np.array([0.0]),
+                                       gamma=np.array([1.0]))
+        self.b_op = CoherentProjection(x0=np.array([0.0]),
+                                       p0=np.array([1.0]),
+                                       gamma=np.array([2.0]))
+        self.sampler = self.a_op.default_sampler()
+        self.trajectories = [
+            [dynq.Snapshot(coordinates=np.array([x]),
+                           momenta=np.array([p]))
+             for (x, p) in traj]
+            for traj in [[(0.5, 0.0), (0.6, 0.5), (0.8, 1.0)],
+                         [(1.0, 0.2), (0.9, -0.1), (0.7, -0.4)],
+                         [(0.0, -0.5), (0.1, 0.3)]]
+        ]
+
+    def _expected(self):
+        values = {}
+        for traj in self.trajectories:
+            weight = self.a_op.correction(traj[0], self.sampler)
+            for (t, snap) in enumerate(traj):
+                values.setdefault(t, []).append(weight * self.b_op(snap))
+        return values
+
+    def test_add_trajectory(self):
+        corr = CorrelationFunction(self.a_op, self.b_op, self.sampler)
+        for traj in self.trajectories:
+            corr.add_trajectory(traj)
+        expected = self._expected()
+        assert_equal(corr.n_trajectories, 3)
+        assert_array_almost_equal(corr.statistics.count[:, 0], [3, 3, 2])
+        assert_array_almost_equal(
+            corr.mean[:, 0], [np.mean(expected[t]) for t in range(3)]
+        )
+        assert_almost_equal(
+            corr.standard_error[2, 0],
+            np.std(expected[2], ddof=1) / np.sqrt(2.0)
+        )
+
+    def test_add_batch(self):
+        trajectories = self.trajectories[:2]
+        corr = CorrelationFunction(self.a_op, [self.b_op, self.a_op],
+                                   self.sampler)
+        frames = (stack_snapshots([traj[t] for traj in trajectories])
+                  for t in range(3))
+        corr.add_batch(frames)
+        serial = CorrelationFunction(self.a_op, [self.b_op, self.a_op],
+                                     self.sampler)
+        for traj in trajectories:
+            serial.add_trajectory(traj)
+        assert_array_almost_equal(corr.mean, serial.mean)
+        assert_array_almost_equal(corr.statistics.m2, serial.statistics.m2)
+
+    def test_merge(self):
+        corr_a = CorrelationFunction(self.a_op, self.b_op, self.sampler)
+        corr_b = CorrelationFunction(self.a_op, self.b_op, self.sampler)
+        corr_a.add_trajectory(self.trajectories[0])
+        for traj in self.trajectories[1:]:
+            corr_b.add_trajectory(traj)
+        corr_a.merge(corr_b)
+        expected = self._expected()
+        assert_array_almost_equal(
+            corr_a.mean[:, 0], [np.mean(expected[t]) for t in range(3)]
+        )
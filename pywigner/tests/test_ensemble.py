@@ -0,0 +1,94 @@
+import shutil
+import tempfile
+import os
+import dynamiq_engine as dynq
+import numpy as np
+from pywigner.operators import *
+from pywigner.ensemble import EnsembleStore
+from pywigner.correlation import CorrelationFunction
+
+from pywigner.tests.tools import *
+
+class testEnsembleStore(object):
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmpdir, "ensemble")
+        self.store = EnsembleStore.create(self.directory, n_frames=3,
+                                          n_coordinates=2, n_electronic=2)
+        self.coords = np.arange(24.0).reshape(4, 3, 2)
+        self.momenta = -np.arange(24.0).reshape(4, 3, 2)
+        self.elec_coords = 0.1 * np.arange(24.0).reshape(4, 3, 2)
+        self.elec_momenta = 0.2 * np.arange(24.0).reshape(4, 3, 2)
+        self.store.append(self.coords[:3], self.momenta[:3],
+                          self.elec_coords[:3], self.elec_momenta[:3])
+        self.store.append(self.coords[3:], self.momenta[3:],
+                          self.elec_coords[3:], self.elec_momenta[3:])
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_reopen(self):
+        store = EnsembleStore(self.directory)
+        assert_equal(store.n_samples, 4)
+        assert_equal(store.n_frames, 3)
+        assert_array_almost_equal(store.feature('coordinates'), self.coords)
+        assert_array_almost_equal(store.feature('electronic_momenta'),
+                                  self.elec_momenta)
+
+    def test_frame(self):
+        (coords, momenta, elec_x, elec_p) = self.store.frame(1,
+                                                             slice(1, 3))
+        assert_array_almost_equal(coords, self.coords[1:3, 1])
+        assert_array_almost_equal(elec_p, self.elec_momenta[1:3, 1])
+        assert_equal(isinstance(coords, np.memmap), True)
+
+    def test_evaluate_from_store(self):
+        op = ElectronicCoherentProjection.with_n_dofs(2).excite(0)
+        values = op.evaluate_batch(*self.store.frame(2))
+        expected = op.evaluate_batch(self.coords[:, 2], self.momenta[:, 2],
+                                     self.elec_coords[:, 2],
+                                     self.elec_momenta[:, 2])
+        assert_array_almost_equal(values, expected)
+
+    def test_chunks(self):
+        a_op = ElectronicCoherentProjection.with_n_dofs(2)
+        b_op = CoherentProjection(x0=np.zeros(2), p0=np.zeros(2),
+                                  gamma=np.array([0.01, 0.01]))
+        sampler = a_op.default_sampler()
+        chunked = CorrelationFunction(a_op, b_op, sampler)
+        for frames in self.store.chunks(3):
+            chunked.add_batch(frames)
+        whole = CorrelationFunction(a_op, b_op, sampler)
+        whole.add_batch(self.store.frames())
+        assert_equal(chunked.n_trajectories, 4)
+        assert_array_almost_equal(chunked.mean, whole.mean)
+
+    def test_append_trajectories(self):
+        store = EnsembleStore.create(os.path.join(self.tmpdir, "snaps"),
+                                     n_frames=2, n_coordinates=2)
+        trajs = [[dynq.Snapshot(coordinates=self.coords[i, t],
+                                momenta=self.momenta[i, t])
+                  for t in range(2)]
+                 for i in range(2)]
+        store.append_trajectories(trajs)
+        assert_equal(store.features, ['coordinates', 'momenta'])
+        assert_array_almost_equal(store.feature('momenta'),
+                                  self.momenta[:2, :2])
+        assert_equal(store.frame(0)[2], None)
+
+    def test_bad_chunk_leaves_store_aligned(self):
+        try:
+            self.store.append(self.coords[:2], self.momenta[:3],
+                              self.elec_coords[:2], self.elec_momenta[:2])
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Expected ValueError")
+        assert_equal(os.path.getsize(os.path.join(self.directory,
+                                                  'coordinates.dat')),
+                     self.coords.nbytes)
+        self.store.append(self.coords[:1], self.momenta[:1],
+                          self.elec_coords[:1], self.elec_momenta[:1])
+        store = EnsembleStore(self.directory)
+        assert_array_almost_equal(store.feature('momenta')[4],
+                                  self.momenta[0])
@@ -0,0 +1,107 @@
+import os
+import pickle
+import shutil
+import tempfile
+import dynamiq_engine as dynq
+import numpy as np
+from pywigner.operators import *
+from pywigner.operators.grid_wigner import *
+
+from pywigner.tests.tools import *
+
+def harmonic_state(x, x0, p0, gamma, n=0):
+    # harmonic oscillator eigenstate (n = 0 or 1), displaced to (x0, p0)
+    dx = x - x0
+    psi = ((gamma / np.pi)**0.25 * np.exp(-0.5 * gamma * dx**2
+                                          + 1j * p0 * dx))
+    if n == 1:
+        psi = psi * np.sqrt(2.0 * gamma) * dx
+    return psi
+
+
+class testGridWignerOperator(object):
+    def setup(self):
+        self.x_axis = np.linspace(-16.0, 16.0, 512)
+        self.ground = GridWignerOperator(
+            self.x_axis, harmonic_state(self.x_axis, 0.5, 1.0, 2.0), dof=1
+        )
+        self.excited = GridWignerOperator(
+            self.x_axis, harmonic_state(self.x_axis, -0.5, 0.0, 1.0, n=1)
+        )
+        rng = np.random.RandomState(3)
+        self.batch = (rng.normal(scale=0.7, size=(20, 2)),
+                      rng.normal(scale=0.7, size=(20, 2)), None, None)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_matches_coherent_projection(self):
+        ground = CoherentProjection(x0=[0.5], p0=[1.0], gamma=[2.0],
+                                    dofs=[1])
+        excited = CoherentProjection(x0=[-0.5], p0=[0.0], gamma=[1.0],
+                                     dofs=[0], excitons=1)
+        for (op, exact) in [(self.ground, ground), (self.excited, excited)]:
+            assert_array_almost_equal(op.evaluate_batch(*self.batch),
+                                      exact.evaluate_batch(*self.batch),
+                                      decimal=2)
+            assert_almost_equal(op.phase_space_integral(), 2.0 * np.pi,
+                                places=4)
+        snap = dynq.Snapshot(coordinates=self.batch[0][0],
+                             momenta=self.batch[1][0])
+        assert_almost_equal(self.ground(snap),
+                            self.ground.evaluate_batch(*self.batch)[0])
+
+    def test_density_and_off_grid(self):
+        psi = harmonic_state(self.x_axis, 0.5, 1.0, 2.0)
+        op = GridWignerOperator(self.x_axis, density=np.outer(psi,
+                                                              psi.conj()),
+                                dof=1)
+        assert_array_almost_equal(op.table, self.ground.table)
+        assert_equal(op.value_batch(np.array([17.0]), np.array([0.0]))[0],
+                     0.0)
+
+    def test_cache(self):
+        psi = harmonic_state(self.x_axis, 0.5, 1.0, 2.0)
+        op = GridWignerOperator(self.x_axis, psi, dof=1,
+                                cache_dir=self.tmpdir)
+        table = op.table
+        assert_equal(os.path.exists(op.cache_file), True)
+        assert_equal(isinstance(table, np.memmap), True)
+        assert_array_almost_equal(table, self.ground.table)
+        assert_equal(os.listdir(self.tmpdir),
+                     [os.path.basename(op.cache_file)])
+        # a copy (e.g., in a worker) loads the cached table, and doesn't
+        # carry the wavefunction
+        copy = pickle.loads(pickle.dumps(op))
+        assert_equal(copy._table, None)
+        assert_equal(copy.wavefunction, None)
+        assert_equal(copy.cache_file, op.cache_file)
+        assert_array_almost_equal(copy.table, table)
+
+    def test_default_sampler(self):
+        np.random.seed(1)
+        sampler = self.ground.default_sampler()
+        template = dynq.Snapshot(coordinates=np.zeros(2),
+                                 momenta=np.zeros(2))
+        batch = sampler.generate_batch(4000, template)
+        assert_array_almost_equal(batch[0][:, 0], np.zeros(4000))
+        assert_almost_equal(np.mean(batch[0][:, 1]), 0.5, places=1)
+        assert_almost_equal(np.mean(batch[1][:, 1]), 1.0, places=1)
+        # correction matches the generic one
+        snap = sampler.generate_initial_snapshot(template)
+        assert_almost_equal(self.ground.correction(snap, sampler),
+                            self.ground(snap) / sampler(snap)
+                            * sampler.norm)
+        # <1> = integral / Z
+        weights = self.ground.correction_batch(sampler, *batch)
+        assert_almost_equal(np.mean(weights) / sampler.norm,
+                            self.ground.phase_space_integral(), places=1)
+        density = self.ground.log_sampler_density_batch(sampler, *batch)
+        assert_array_almost_equal(np.exp(density),
+                                  sampler.weight_batch(batch[0][:, 1],
+                                                       batch[1][:, 1]))
+
+    @raises(ValueError)
+    def test_nonuniform_grid(self):
+        GridWignerOperator(self.x_axis**3, np.ones(512))
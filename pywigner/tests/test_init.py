@@ -0,0 +1,24 @@
+import pywigner
+from pywigner.benchmarks import run_python
+
+from pywigner.tests.tools import *
+
+class testLazyImports(object):
+    def test_import_is_light(self):
+        # raises CalledProcessError if the assertion fails
+        run_python(
+            "import sys, pywigner\n"
+            "heavy = ['openpathsampling', 'dynamiq_samplers',\n"
+            "         'pywigner.operators']\n"
+            "assert not [m for m in heavy if m in sys.modules]\n"
+        )
+
+    def test_lazy_attributes(self):
+        from pywigner.operators import CoherentProjection
+        assert_equal(pywigner.CoherentProjection is CoherentProjection,
+                     True)
+        assert_equal('CorrelationFunction' in dir(pywigner), True)
+
+    @raises(AttributeError)
+    def test_missing_attribute(self):
+        pywigner.not_an_attribute
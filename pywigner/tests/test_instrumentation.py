@@ -0,0 +1,66 @@
+import json
+import dynamiq_engine as dynq
+import numpy as np
+from pywigner.operators import *
+from pywigner.instrumentation import *
+
+from pywigner.tests.tools import *
+
+class testInstrumentation(object):
+    def setup(self):
+        self.op = CoherentProjection(x0=np.array([0.5, 0.0]),
+                                     p0=np.array([0.0, 1.0]),
+                                     gamma=np.array([1.0, 2.0]))
+        self.snap = dynq.Snapshot(coordinates=np.array([0.4, 0.1]),
+                                  momenta=np.array([0.2, 0.9]))
+
+    def test_disabled_is_untouched(self):
+        original = CoherentProjection.__dict__['__call__']
+        inst = Instrumentation()
+        with inst:
+            assert_equal(CoherentProjection.__dict__['__call__'] is original,
+                         False)
+        assert_equal(CoherentProjection.__dict__['__call__'] is original,
+                     True)
+        self.op(self.snap)
+        assert_equal(inst.statistics, {})
+
+    def test_counts_and_weights(self):
+        with Instrumentation() as inst:
+            sampler = self.op.default_sampler()
+            for _ in range(3):
+                self.op(self.snap)
+            weights = [self.op.correction(self.snap, sampler)
+                       for _ in range(2)]
+            sampler.generate_initial_snapshot(self.snap)
+        stats = inst.statistics_for(self.op)
+        assert_equal(stats.timings['__call__'].count, 3)
+        assert_equal(stats.timings['correction'].count, 2)
+        assert_equal(stats.timings['default_sampler'].count, 1)
+        assert_equal(
+            stats.timings['sampler.generate_initial_snapshot'].count, 1
+        )
+        assert_equal(stats.weights.count, 2)
+        assert_almost_equal(stats.weights.mean, weights[0])
+        assert_almost_equal(stats.weights.effective_sample_size, 2.0)
+
+    def test_fallback_not_double_counted(self):
+        other_sampler = CoherentProjection(
+            x0=np.array([0.0, 0.0]), p0=np.array([0.0, 0.0]),
+            gamma=np.array([1.0, 1.0])
+        ).default_sampler()
+        with Instrumentation() as inst:
+            self.op.correction(self.snap, other_sampler)
+        stats = inst.statistics_for(self.op)
+        assert_equal(stats.timings['correction'].count, 1)
+        assert_equal(stats.weights.count, 1)
+
+    def test_to_json(self):
+        with Instrumentation() as inst:
+            self.op(self.snap)
+            self.op.evaluate_batch(np.zeros((4, 2)), np.zeros((4, 2)))
+        report = json.loads(inst.to_json())
+        assert_equal(len(report), 1)
+        assert_equal(report[0]['timings']['__call__']['count'], 1)
+        assert_equal(report[0]['timings']['evaluate_batch']['count'], 1)
+        assert_equal('p90' in report[0]['timings']['__call__'], True)
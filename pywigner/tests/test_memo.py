@@ -0,0 +1,122 @@
+import dynamiq_engine as dynq
+import numpy as np
+from pywigner.operators import *
+from pywigner.memo import *
+from pywigner.correlation import CorrelationFunction
+
+from pywigner.tests.tools import *
+
+class CountingProjection(CoherentProjection):
+    # counts evaluations, to check what the cache saves
+    def __init__(self, *args, **kwargs):
+        super(CountingProjection, self).__init__(*args, **kwargs)
+        self.n_calls = 0
+
+    def __call__(self, snapshot):
+        self.n_calls += 1
+        return super(CountingProjection, self).__call__(snapshot)
+
+
+class testMemoCache(object):
+    def setup(self):
+        self.nuclear = CountingProjection(x0=np.array([0.5]),
+                                          p0=np.array([0.0]),
+                                          gamma=np.array([1.0]), dofs=[0])
+        # electronic, so that they aren't fused with the nuclear one
+        self.other_1 = ElectronicCoherentProjection(x0=np.array([1.0]),
+                                                    p0=np.array([0.5]),
+                                                    gamma=np.array([2.0]))
+        self.other_2 = ElectronicCoherentProjection(x0=np.array([0.0]),
+                                                    p0=np.array([-0.5]),
+                                                    gamma=np.array([1.0]))
+        self.snaps = [
+            dynq.MMSTSnapshot(coordinates=np.array([x, 0.5]),
+                              momenta=np.array([0.1, x]),
+                              electronic_coordinates=np.array([0.2]),
+                              electronic_momenta=np.array([x]))
+            for x in [0.0, 0.3, 0.6]
+        ]
+
+    def test_lru(self):
+        cache = MemoCache(max_size=2)
+        cache.lookup(self.nuclear, self.snaps[0])
+        cache.lookup(self.nuclear, self.snaps[1])
+        cache.lookup(self.nuclear, self.snaps[0])  # now most recent
+        cache.lookup(self.nuclear, self.snaps[2])  # evicts snaps[1]
+        assert_equal(len(cache), 2)
+        assert_equal((cache.hits, cache.misses, cache.evictions), (1, 3, 1))
+        assert_equal(self.nuclear.n_calls, 3)
+        cache.lookup(self.nuclear, self.snaps[0])
+        cache.lookup(self.nuclear, self.snaps[1])
+        assert_equal((cache.hits, cache.misses), (2, 4))
+        assert_almost_equal(cache.hit_rate, 2.0 / 6.0)
+
+    def test_disabled_by_default(self):
+        assert_equal(active_cache(), None)
+        memoized(self.nuclear, self.snaps[0])
+        memoized(self.nuclear, self.snaps[0])
+        assert_equal(self.nuclear.n_calls, 2)
+
+    def test_shared_factors(self):
+        op_1 = self.nuclear * self.other_1
+        op_2 = self.nuclear * self.other_2
+        expected = [(op_1(s), op_2(s)) for s in self.snaps]
+        self.nuclear.n_calls = 0
+        with MemoCache() as cache:
+            assert_equal(cache.enabled, True)
+            values = [(op_1(s), op_2(s)) for s in self.snaps]
+        assert_equal(cache.enabled, False)
+        assert_array_almost_equal(values, expected)
+        assert_equal(self.nuclear.n_calls, 3)
+        assert_equal(cache.hits, 3)
+
+    def test_correction(self):
+        # a sampler that isn't the operator's default: generic correction,
+        # which evaluates the operator at the first frame, as does the
+        # B-operator
+        sampler = self.other_1.default_sampler()
+        corr = CorrelationFunction(self.nuclear, self.nuclear, sampler)
+        with MemoCache() as cache:
+            corr.add_trajectory(self.snaps)
+        assert_equal(self.nuclear.n_calls, 3)
+        assert_equal(cache.to_dict()['hits'], 1)
+        first = self.snaps[0]
+        assert_almost_equal(corr.mean[0, 0],
+                            self.nuclear(first)**2 / sampler(first)
+                            * sampler.norm)
+
+    def test_excite_invalidates(self):
+        with MemoCache():
+            ground = self.nuclear(self.snaps[1])
+            assert_almost_equal(memoized(self.nuclear, self.snaps[1]),
+                                ground)
+            self.nuclear.excite(0)
+            excited = memoized(self.nuclear, self.snaps[1])
+        assert_not_equal(excited, ground)
+        assert_almost_equal(excited, self.nuclear(self.snaps[1]))
+
+    def test_composite_invalidates(self):
+        product = self.other_1 * self.other_2
+        total = self.other_1 + 2.0 * self.other_2
+        snap = self.snaps[1]
+        with MemoCache():
+            memoized(product, snap)
+            memoized(total, snap)
+            self.other_1.excite(0)
+            assert_almost_equal(memoized(product, snap), product(snap))
+            assert_almost_equal(memoized(total, snap), total(snap))
+            total.coefficients = np.array([1.0, 3.0])
+            assert_almost_equal(memoized(total, snap), total(snap))
+
+    def test_nested(self):
+        outer = MemoCache()
+        inner = MemoCache()
+        with outer:
+            with inner:
+                assert_equal(active_cache() is inner, True)
+            assert_equal(active_cache() is outer, True)
+        assert_equal(active_cache(), None)
+
+    @raises(ValueError)
+    def test_bad_size(self):
+        MemoCache(max_size=0)
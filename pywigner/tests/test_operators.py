@@ -3,7 +3,10 @@ import pywigner as lsc
 import dynamiq_engine as dynq
 import numpy as np
 from pywigner.operators import *
-from pywigner.operators.coherent_states import raveled_numpyify
+from pywigner.operators.coherent_states import (
+    raveled_numpyify, fock_coefficients, default_exciton_sampling_ratio
+)
+from pywigner.tools import stack_snapshots, fingerprint
 import dynamiq_engine.tests as dynq_tests
 
 from pywigner.tests.tools import *
@@ -33,6 +36,10 @@ class testOperator(OperatorTester):
     def test_call(self):
         self.op(self.previous_trajectory[0])
 
+    @raises(NotImplementedError)
+    def test_evaluate_batch(self):
+        self.op.evaluate_batch(*stack_snapshots(self.previous_trajectory))
+
 class testProductOperator(OperatorTester):
     def setup(self):
         self.nuclear = CoherentProjection(
@@ -71,6 +78,90 @@ class testProductOperator(OperatorTester):
         assert_equal(len(op.operators), 2)
         assert_almost_equal(op2(self.snap0), nuc_contrib**2 * elect_contrib)
 
+    def test_evaluate_batch(self):
+        snap1 = dynq.MMSTSnapshot(
+            coordinates=np.array([1.5, 1.0]),
+            momenta=np.array([0.5, 3.0]),
+            electronic_coordinates=np.array([0.0, 1.0]),
+            electronic_momenta=np.array([0.0, 0.0]),
+            topology=None
+        )
+        snaps = [self.snap0, snap1]
+        values = self.op.evaluate_batch(*stack_snapshots(snaps))
+        assert_equal(values.shape, (2,))
+        assert_array_almost_equal(values, [self.op(s) for s in snaps])
+
+    def test_fused_overlapping_dofs(self):
+        shifted = CoherentProjection(
+            x0=np.array([0.5, 2.0]),
+            p0=np.array([1.0, -1.0]),
+            gamma=np.array([2.0, 0.5])
+        ).excite(0)
+        partial = CoherentProjection(
+            x0=np.array([0.9]), p0=np.array([6.5]), gamma=np.array([3.0]),
+            dofs=[1], excitons=[1]
+        )
+        nested = self.op * (shifted * partial)
+        factors = nested._factors()
+        assert_equal(len(factors), 2)  # one nuclear, one electronic
+        expected = (self.nuclear(self.snap0) * self.electronic(self.snap0)
+                    * shifted(self.snap0) * partial(self.snap0))
+        assert_almost_equal(nested(self.snap0), expected)
+        (sign, log_value) = nested.log_value(self.snap0)
+        assert_almost_equal(sign * np.exp(log_value), expected)
+        batch = stack_snapshots([self.snap0, self.snap0])
+        assert_array_almost_equal(nested.evaluate_batch(*batch),
+                                  [expected, expected])
+
+    def test_recompile_after_excite(self):
+        op = self.nuclear * self.nuclear
+        before = op(self.snap0)
+        factors = op._factors()
+        assert_equal(op._factors() is factors, True)
+        self.nuclear.excite(0)
+        assert_equal(op._factors() is factors, False)
+        assert_almost_equal(op(self.snap0), self.nuclear(self.snap0)**2)
+        self.nuclear.excite(0, 0)
+        assert_almost_equal(op(self.snap0), before)
+
+    def test_recompile_after_set_parameters(self):
+        op = self.nuclear * self.nuclear
+        op(self.snap0)
+        self.nuclear.x0 = np.array([2.0, 1.0])
+        assert_almost_equal(op(self.snap0), self.nuclear(self.snap0)**2)
+
+    @raises(ValueError)
+    def test_parameters_read_only(self):
+        # in-place changes would bypass the recompile
+        self.nuclear.x0[0] = 2.0
+
+    def test_correction(self):
+        sampler = self.op.default_sampler()
+        generic = Operator.correction(self.op, self.snap0, sampler)
+        assert_almost_equal(self.op.correction(self.snap0, sampler),
+                            generic)
+        batch = stack_snapshots([self.snap0, self.snap0])
+        assert_array_almost_equal(self.op.correction_batch(sampler, *batch),
+                                  [generic, generic])
+
+    def test_log_value(self):
+        (sign, log_value) = self.op.log_value(self.snap0)
+        assert_equal(sign, 1.0)
+        assert_almost_equal(log_value, np.log(self.op(self.snap0)))
+        sampler = self.op.default_sampler()
+        (sign, log_corr) = self.op.log_correction(self.snap0, sampler)
+        assert_almost_equal(log_corr,
+                            np.log(self.op.correction(self.snap0, sampler)))
+        batch = stack_snapshots([self.snap0])
+        (signs, log_values) = self.op.log_correction_batch(sampler, *batch)
+        assert_array_almost_equal(log_values, [log_corr])
+
+    @raises(NotImplementedError)
+    def test_correction_batch_foreign_sampler(self):
+        sampler = self.nuclear.default_sampler()
+        self.op.correction_batch(sampler,
+                                 *stack_snapshots([self.snap0]))
+
     def test_default_sampler(self):
         sampler = self.op.default_sampler()
         snap = sampler.generate_initial_snapshot(self.snap0)
@@ -86,6 +177,338 @@ class testProductOperator(OperatorTester):
                           self.snap0.electronic_momenta):
             assert_not_equal(a,b)
 
+class CountingProjection(ElectronicCoherentProjection):
+    # counts evaluations, to check that shared factors are reused
+    def __init__(self, *args, **kwargs):
+        super(CountingProjection, self).__init__(*args, **kwargs)
+        self.n_calls = 0
+
+    def __call__(self, snapshot):
+        self.n_calls += 1
+        return super(CountingProjection, self).__call__(snapshot)
+
+    def evaluate_batch(self, *args):
+        self.n_calls += 1
+        return super(CountingProjection, self).evaluate_batch(*args)
+
+
+class testSumOperator(OperatorTester):
+    def setup(self):
+        self.nuclear = CoherentProjection(
+            x0=np.array([1.5, 1.0]),
+            p0=np.array([0.5, 3.0]),
+            gamma=np.array([4.0, 5.0])
+        )
+        self.shared = CountingProjection(x0=np.array([0.5]),
+                                         p0=np.array([0.0]),
+                                         gamma=np.array([1.0]), dofs=[0])
+        self.pop_1 = ElectronicCoherentProjection(
+            x0=np.array([1.0]), p0=np.array([0.0]), gamma=np.array([1.0]),
+            dofs=[1]
+        )
+        self.pop_2 = ElectronicCoherentProjection(
+            x0=np.array([0.0]), p0=np.array([1.0]), gamma=np.array([1.0]),
+            dofs=[1]
+        ).excite(0)
+        self.snaps = [
+            dynq.MMSTSnapshot(coordinates=np.array([1.0, 0.75]),
+                              momenta=np.array([2.0, 6.0]),
+                              electronic_coordinates=np.array([0.5, 0.75]),
+                              electronic_momenta=np.array([0.4, 0.3]),
+                              topology=None),
+            dynq.MMSTSnapshot(coordinates=np.array([1.5, 1.0]),
+                              momenta=np.array([0.5, 3.0]),
+                              electronic_coordinates=np.array([0.0, 1.0]),
+                              electronic_momenta=np.array([0.1, -0.2]),
+                              topology=None)
+        ]
+
+    def test_arithmetic(self):
+        diff = self.pop_1 - self.pop_2
+        assert_equal(isinstance(diff, SumOperator), True)
+        assert_array_almost_equal(diff.coefficients, [1.0, -1.0])
+        scaled = 0.5 * (self.pop_1 + self.pop_2) * 2.0 - self.pop_2
+        assert_equal(scaled.operators, [self.pop_1, self.pop_2])
+        assert_array_almost_equal(scaled.coefficients, [1.0, 0.0])
+        assert_array_almost_equal((-self.pop_1).coefficients, [-1.0])
+        product = diff * self.nuclear
+        assert_equal(isinstance(product, ProductOperator), True)
+        snap = self.snaps[0]
+        assert_almost_equal(product(snap),
+                            (self.pop_1(snap) - self.pop_2(snap))
+                            * self.nuclear(snap))
+
+    def test_call(self):
+        op = 3.0 * self.pop_1 - 0.5 * self.pop_2 + self.nuclear
+        for snap in self.snaps:
+            assert_almost_equal(op(snap), 3.0 * self.pop_1(snap)
+                                - 0.5 * self.pop_2(snap)
+                                + self.nuclear(snap))
+
+    def test_shared_factors(self):
+        op = (self.shared * self.pop_1 - self.shared * self.pop_2
+              + self.shared * self.nuclear)
+        (factors, term_factors) = op._shared_factors()
+        assert_equal(len(factors), 4)
+        expected = [self.shared(s) * (self.pop_1(s) - self.pop_2(s)
+                                      + self.nuclear(s))
+                    for s in self.snaps]
+        self.shared.n_calls = 0
+        assert_almost_equal(op(self.snaps[0]), expected[0])
+        assert_equal(self.shared.n_calls, 1)
+        values = op.evaluate_batch(*stack_snapshots(self.snaps))
+        assert_array_almost_equal(values, expected)
+        assert_equal(self.shared.n_calls, 2)
+
+    def test_default_sampler(self):
+        op = self.nuclear * (2.0 * self.pop_1 - self.pop_2)
+        sampler = op.default_sampler()
+        mixture = sampler.samplers[1]
+        assert_array_almost_equal(mixture.weights, [2.0/3.0, 1.0/3.0])
+        np.random.seed(2)
+        snap = sampler.generate_initial_snapshot(self.snaps[0])
+        assert_not_equal(snap.electronic_coordinates[1],
+                         self.snaps[0].electronic_coordinates[1])
+        # batched correction agrees with the generic one
+        snaps = self.snaps + [snap]
+        generic = [Operator.correction(op, s, sampler) for s in snaps]
+        assert_array_almost_equal(
+            op.correction_batch(sampler, *stack_snapshots(snaps)), generic
+        )
+        assert_almost_equal(op.correction(snap, sampler), generic[-1])
+
+    def test_mixture_of_one(self):
+        op = 2.0 * self.pop_1
+        sampler = op.default_sampler()
+        own = self.pop_1.default_sampler()
+        assert_almost_equal(sampler.norm, own.norm)
+        batch = stack_snapshots(self.snaps)
+        assert_array_almost_equal(
+            op.correction_batch(sampler, *batch),
+            2.0 * self.pop_1.correction_batch(own, *batch)
+        )
+
+    def test_phase_space_integral(self):
+        op = self.pop_1 - 0.5 * self.pop_2
+        assert_almost_equal(op.phase_space_integral(),
+                            self.pop_1.phase_space_integral()
+                            - 0.5 * self.pop_2.phase_space_integral())
+
+
+class testOperatorBank(OperatorTester):
+    def setup(self):
+        n_states = 4
+        self.populations = [
+            ElectronicCoherentProjection.with_n_dofs(n_states).excite(k)
+            for k in range(n_states)
+        ]
+        self.ground = ElectronicCoherentProjection.with_n_dofs(n_states)
+        self.shifted = ElectronicCoherentProjection(
+            x0=np.array([0.5, 0.0, 0.0, 1.0]), p0=np.zeros(4),
+            gamma=np.ones(4), excitons=[2, 0, 1, 0]
+        )
+        self.nuclear = CoherentProjection(x0=np.array([1.0]),
+                                          p0=np.array([0.5]),
+                                          gamma=np.array([2.0]), dofs=[1])
+        self.product = self.nuclear * self.populations[0]
+        self.operators = (self.populations
+                          + [self.ground, self.shifted, self.nuclear,
+                             self.product])
+        self.bank = OperatorBank(self.operators)
+        rng = np.random.RandomState(4)
+        self.batch = (rng.normal(size=(6, 2)), rng.normal(size=(6, 2)),
+                      rng.normal(size=(6, 4)), rng.normal(size=(6, 4)))
+        # a factor exactly zero: 2 r^2 = 1 on dof 0 of the first sample
+        self.batch[2][0, 0] = 0.5
+        self.batch[3][0, 0] = 0.5
+
+    def test_groups(self):
+        (groups, others) = self.bank._groups()
+        # same features, dofs, and widths: one group, even if the centers
+        # differ
+        assert_equal([list(g.columns) for g in groups],
+                     [[0, 1, 2, 3, 4, 5], [6]])
+        assert_equal(others, [(7, self.product)])
+
+    def test_evaluate_batch(self):
+        values = self.bank.evaluate_batch(*self.batch)
+        assert_equal(values.shape, (6, len(self.operators)))
+        expected = np.array([op.evaluate_batch(*self.batch)
+                             for op in self.operators]).T
+        assert_array_almost_equal(values, expected)
+        assert_equal(values[0, 0], 0.0)
+
+    def test_evaluate_trajectory(self):
+        trajectory = [
+            dynq.MMSTSnapshot(coordinates=self.batch[0][i],
+                              momenta=self.batch[1][i],
+                              electronic_coordinates=self.batch[2][i],
+                              electronic_momenta=self.batch[3][i],
+                              topology=None)
+            for i in range(3)
+        ]
+        values = self.bank.evaluate_trajectory(trajectory)
+        assert_equal(values.shape, (3, len(self.operators)))
+        assert_array_almost_equal(self.bank(trajectory[1]), values[1])
+        assert_array_almost_equal(values[2],
+                                  [op(trajectory[2])
+                                   for op in self.operators])
+
+    def test_recompile(self):
+        before = self.bank.evaluate_batch(*self.batch)
+        self.ground.excite(1, 2)
+        after = self.bank.evaluate_batch(*self.batch)
+        assert_array_almost_equal(after[:, 4],
+                                  self.ground.evaluate_batch(*self.batch))
+        assert_array_almost_equal(after[:, :4], before[:, :4])
+
+
+class testProjectionGrid(object):
+    def setup(self):
+        self.grid = ProjectionGrid(x_axes=[-1.0, 0.0, 0.5],
+                                   p_axes=[0.0, 2.0], gamma=2.0, dofs=[1])
+        self.grid_2d = ProjectionGrid(x_axes=[[0.0, 1.0], [0.5]],
+                                      p_axes=[[0.0], [-1.0, 0.0, 1.0]],
+                                      gamma=[1.0, 0.5])
+        rng = np.random.RandomState(2)
+        self.batch = (rng.normal(size=(5, 2)), rng.normal(size=(5, 2)),
+                      None, None)
+
+    def test_projections(self):
+        assert_equal(self.grid.shape, (3, 2))
+        assert_equal(len(self.grid), 6)
+        assert_array_almost_equal(self.grid[3].x0, [0.0])
+        assert_array_almost_equal(self.grid[3].p0, [2.0])
+        assert_equal(self.grid[3].dofs, [1])
+        assert_equal(self.grid_2d.shape, (2, 1, 1, 3))
+        (x0, p0) = self.grid_2d.centers()
+        assert_array_almost_equal(x0[4], [1.0, 0.5])
+        assert_array_almost_equal(p0[4], [0.0, 0.0])
+
+    def test_evaluate_batch(self):
+        for grid in [self.grid, self.grid_2d]:
+            values = grid.evaluate_batch(*self.batch)
+            assert_equal(values.shape, (5,) + grid.shape)
+            expected = np.array([op.evaluate_batch(*self.batch)
+                                 for op in grid]).T
+            assert_array_almost_equal(values, grid.reshape(expected))
+            (signs, log_values) = grid.log_value_batch(*self.batch)
+            assert_array_almost_equal(signs * np.exp(log_values), values)
+            # through a bank, from the per-dof tables
+            bank = OperatorBank(list(grid))
+            assert_equal(len(bank._groups()[0]), 1)
+            assert_array_almost_equal(bank.evaluate_batch(*self.batch),
+                                      expected)
+
+    def test_call(self):
+        snap = dynq.Snapshot(coordinates=self.batch[0][0],
+                             momenta=self.batch[1][0])
+        assert_array_almost_equal(self.grid(snap),
+                                  self.grid.reshape([op(snap)
+                                                     for op in self.grid]))
+
+    def test_electronic(self):
+        grid = ProjectionGrid([0.0, 1.0], [0.0], gamma=1.0, dofs=[0],
+                              projection_class=ElectronicCoherentProjection)
+        batch = (np.zeros((2, 1)), np.zeros((2, 1)),
+                 np.array([[0.0], [1.0]]), np.array([[0.0], [0.0]]))
+        assert_array_almost_equal(grid.evaluate_batch(*batch)[:, :, 0],
+                                  [[2.0, 2.0*np.exp(-1.0)],
+                                   [2.0*np.exp(-1.0), 2.0]])
+
+    @raises(ValueError)
+    def test_mismatched_axes(self):
+        ProjectionGrid(x_axes=[[0.0], [1.0]], p_axes=[0.0], gamma=1.0)
+
+
+class testPolynomialOperator(object):
+    def setup(self):
+        rng = np.random.RandomState(5)
+        self.batch = (rng.normal(size=(7, 3)), rng.normal(size=(7, 3)),
+                      rng.normal(size=(7, 2)), rng.normal(size=(7, 2)))
+        self.snap = dynq.MMSTSnapshot(coordinates=self.batch[0][0],
+                                      momenta=self.batch[1][0],
+                                      electronic_coordinates=self.batch[2][0],
+                                      electronic_momenta=self.batch[3][0],
+                                      topology=None)
+        # 2 x_0 p_2^2 - x_2^3 + 0.5
+        self.poly = PolynomialOperator([2.0, -1.0, 0.5],
+                                       x_powers=[[1, 0], [0, 3], [0, 0]],
+                                       p_powers=[[0, 2], [0, 0], [0, 0]],
+                                       dofs=[0, 2])
+
+    def test_evaluate_batch(self):
+        (x, p) = self.batch[:2]
+        assert_array_almost_equal(self.poly.evaluate_batch(*self.batch),
+                                  2.0 * x[:, 0] * p[:, 2]**2
+                                  - x[:, 2]**3 + 0.5)
+        assert_almost_equal(self.poly(self.snap),
+                            self.poly.evaluate_batch(*self.batch)[0])
+
+    def test_position_momentum(self):
+        (x, p) = self.batch[:2]
+        assert_array_almost_equal(
+            PositionOperator(1).evaluate_batch(*self.batch), x[:, 1]
+        )
+        assert_array_almost_equal(
+            MomentumOperator(2, power=2).evaluate_batch(*self.batch),
+            p[:, 2]**2
+        )
+        assert_almost_equal(PositionOperator(0, power=0)(self.snap), 1.0)
+
+    def test_energies(self):
+        (x, p) = self.batch[:2]
+        kinetic = PolynomialOperator.kinetic_energy([1.0, 2.0], dofs=[0, 1])
+        assert_array_almost_equal(kinetic.evaluate_batch(*self.batch),
+                                  0.5 * p[:, 0]**2 + 0.25 * p[:, 1]**2)
+        harmonic = PolynomialOperator.harmonic_energy(2.0, [1.0, 3.0])
+        assert_equal(harmonic.n_dofs, 2)
+        assert_array_almost_equal(
+            harmonic.evaluate_batch(x[:, :2], p[:, :2]),
+            np.sum(0.25 * p[:, :2]**2 + np.array([1.0, 9.0]) * x[:, :2]**2,
+                   axis=1)
+        )
+
+    def test_electronic(self):
+        op = ElectronicPolynomialOperator([1.0], [[2]], [[1]], dofs=[1])
+        (q, p) = self.batch[2:]
+        assert_array_almost_equal(op.evaluate_batch(*self.batch),
+                                  q[:, 1]**2 * p[:, 1])
+        assert_almost_equal(op(self.snap), q[0, 1]**2 * p[0, 1])
+
+    def test_product_and_bank(self):
+        projection = ElectronicCoherentProjection.with_n_dofs(2).excite(0)
+        flux = PositionOperator(0) * MomentumOperator(0)
+        product = projection * flux
+        expected = (projection.evaluate_batch(*self.batch)
+                    * self.batch[0][:, 0] * self.batch[1][:, 0])
+        assert_array_almost_equal(product.evaluate_batch(*self.batch),
+                                  expected)
+        assert_almost_equal(product(self.snap), expected[0])
+        (signs, log_values) = product.log_value_batch(*self.batch)
+        assert_array_almost_equal(signs * np.exp(log_values), expected)
+        bank = OperatorBank([self.poly, projection, product])
+        assert_equal(len(bank._groups()[0]), 1)
+        assert_array_almost_equal(bank.evaluate_batch(*self.batch)[:, 2],
+                                  expected)
+
+    def test_dict_round_trip(self):
+        for op in [self.poly, PositionOperator(2, power=2),
+                   MomentumOperator(1, power=3),
+                   ElectronicPolynomialOperator([1.0], [[2]], [[1]],
+                                                dofs=[1])]:
+            copy = type(op).from_dict(op.to_dict())
+            assert_array_almost_equal(copy.evaluate_batch(*self.batch),
+                                      op.evaluate_batch(*self.batch))
+            assert_equal(fingerprint(copy), fingerprint(op))
+        assert_not_equal(fingerprint(PositionOperator(2, power=2)),
+                         fingerprint(PositionOperator(2)))
+
+    @raises(ValueError)
+    def test_mismatched_powers(self):
+        PolynomialOperator([1.0, 2.0], [[1]], [[0]])
+
+
 class test_raveled_numpyify(object):
     def setup(self):
         self.test_array = [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]
@@ -122,6 +545,23 @@ class testCoherentProjection(OperatorTester):
             dofs=[1]
         )
 
+    def test_scattered_dofs(self):
+        op = CoherentProjection(x0=np.array([1.0, 1.5]),
+                                p0=np.array([3.0, 0.5]),
+                                gamma=np.array([5.0, 4.0]),
+                                dofs=[1, 0])
+        snap = dynq.Snapshot(
+            coordinates=np.array([1.0, 0.75]),
+            momenta=np.array([2.0, 6.0]),
+            topology=self.topology
+        )
+        # same as self.op with the dofs swapped
+        assert_almost_equal(op(snap), self.op(snap))
+        assert_almost_equal(op(snap), self.op(snap))  # buffer reuse
+        batch = stack_snapshots([snap, self.snap0])
+        assert_array_almost_equal(op.evaluate_batch(*batch),
+                                  self.op.evaluate_batch(*batch))
+
     def test_initialization(self):
         # do we set up gamma, inv_gamma, etc correctly? (ravelled)
         for (g, i_g) in zip(self.op.gamma, self.op.inv_gamma):
@@ -136,17 +576,17 @@ class testCoherentProjection(OperatorTester):
 
     def test_set_excitons(self):
         assert_equal(self.op.excitons, [0,0])
-        assert_equal(self.op._excitons, [0,0])
+        assert_equal(list(self.op._excitons), [0,0])
         assert_equal(self.op._exciton_dict, {})
 
         self.op.excitons = [1, 0]
         assert_equal(self.op.excitons, [1,0])
-        assert_equal(self.op._excitons, [1,0])
+        assert_equal(list(self.op._excitons), [1,0])
         assert_equal(self.op._exciton_dict, {0: 1})
 
         self.op.excite(dof=0, excitons=0)
         assert_equal(self.op.excitons, [0,0])
-        assert_equal(self.op._excitons, [0,0])
+        assert_equal(list(self.op._excitons), [0,0])
         assert_equal(self.op._exciton_dict, {})
     
     def test_sample_initial_conditions(self):
@@ -162,6 +602,78 @@ class testCoherentProjection(OperatorTester):
             2.0**self.op.n_dofs
         )
 
+    def test_correction_closed_form(self):
+        self.op.excite(dof=1)
+        sampler = self.op.default_sampler()
+        snap = dynq.Snapshot(
+            coordinates=np.array([1.0, 0.75]),
+            momenta=np.array([2.0, 6.0]),
+            topology=self.topology
+        )
+        generic = Operator.correction(self.op, snap, sampler)
+        assert_almost_equal(self.op.correction(snap, sampler), generic)
+        # dof0 is sampled from its own Gaussian: cancels exactly
+        # excited dof1 is sampled with alpha = gamma/3:
+        # exp(-2/3*(5.0*(0.75-1.0)^2 + 1/5.0*(6.0-3.0)^2)) = 0.244550527901713
+        assert_almost_equal(generic / 0.244550527901713, 2.0**2*17.125)
+
+    def test_correction_far_from_center(self):
+        # both Gaussians underflow, but the closed form doesn't care
+        sampler = self.op.default_sampler()
+        coords = np.array([[1.5, 1.0], [101.5, 1.0]])
+        momenta = np.array([[0.5, 3.0], [0.5, 3.0]])
+        assert_array_almost_equal(
+            self.op.correction_batch(sampler, coords, momenta),
+            [2.0**2, 2.0**2]
+        )
+        other_sampler = self.op.default_sampler()
+        assert_array_almost_equal(
+            self.op.correction_batch(other_sampler, coords, momenta),
+            [2.0**2, 2.0**2]
+        )
+
+    def test_log_value(self):
+        snap = dynq.Snapshot(
+            coordinates=np.array([1.0, 0.75]),
+            momenta=np.array([2.0, 6.0]),
+            topology=self.topology
+        )
+        self.op.excite(dof=0)
+        # dof0 excited correction = 2*((1.0-1.5)^2 + (2.0-0.5)^2 - 0.5) = 4.0
+        (sign, log_value) = self.op.log_value(self.previous_trajectory[0])
+        assert_almost_equal(log_value,
+                            np.log(abs(self.op(self.previous_trajectory[0]))))
+        assert_equal(sign, np.sign(self.op(self.previous_trajectory[0])))
+        (sign, log_value) = self.op.log_value(snap)
+        assert_equal(sign, 1.0)
+        assert_almost_equal(log_value, np.log(2.0**2*0.0253494055227250*4.0))
+
+    def test_log_value_many_dofs(self):
+        n_dofs = 500
+        op = CoherentProjection(x0=np.zeros(n_dofs), p0=np.zeros(n_dofs),
+                                gamma=np.ones(n_dofs), excitons=1)
+        coords = np.ones((2, n_dofs))
+        momenta = np.zeros((2, n_dofs))
+        momenta[1] = 1.0
+        # excited part is 2*(1.0 - 0.5) = 1 per dof for sample 0
+        # and 2*(2.0 - 0.5) = 3 per dof for sample 1
+        (signs, log_values) = op.log_value_batch(coords, momenta)
+        assert_array_almost_equal(signs, [1.0, 1.0])
+        assert_array_almost_equal(
+            log_values,
+            [n_dofs*(np.log(2.0) - 1.0),
+             n_dofs*(np.log(2.0) - 2.0 + np.log(3.0))]
+        )
+
+        sampler = op.default_sampler()
+        (signs, log_corr) = op.log_correction_batch(sampler, coords, momenta)
+        # sampled with alpha = gamma/3: exp(-2/3 * r^2) per dof
+        assert_array_almost_equal(
+            log_corr,
+            [n_dofs*(np.log(2.0) - 2.0/3.0), 
+             n_dofs*(np.log(2.0) - 4.0/3.0 + np.log(3.0))]
+        )
+
     def test_call(self):
         norm_op = 2.0**2
         norm_dof_op = 2.0**1
@@ -178,6 +690,24 @@ class testCoherentProjection(OperatorTester):
         # dof1 * dof2 = 0.0253494055227250
         assert_almost_equal(self.op(snap), norm_op*0.0253494055227250)
         assert_almost_equal(self.dof_op(snap), norm_dof_op*0.120935250070417)
+
+    def test_evaluate_batch(self):
+        coords = np.array([[1.5, 1.0], [1.0, 0.75]])
+        momenta = np.array([[0.5, 3.0], [2.0, 6.0]])
+        assert_array_almost_equal(
+            self.op.evaluate_batch(coords, momenta),
+            [2.0**2, 2.0**2*0.0253494055227250]
+        )
+        assert_array_almost_equal(
+            self.dof_op.evaluate_batch(coords, momenta),
+            [2.0, 2.0*0.120935250070417]
+        )
+        self.op.excite(dof=1)
+        # see test_excited for the excited correction
+        assert_array_almost_equal(
+            self.op.evaluate_batch(coords, momenta),
+            [2.0**2*2.0*(-0.5), 2.0**2*0.0253494055227250*17.125]
+        )
         
 
     def test_excited(self):
@@ -198,6 +728,132 @@ class testCoherentProjection(OperatorTester):
         self.op.excite(dof=1, excitons=0)
         assert_almost_equal(self.op(snap), unexcited)
 
+    def test_multiply_excited(self):
+        snap = dynq.Snapshot(
+            coordinates=np.array([1.0, 0.75]),
+            momenta=np.array([2.0, 6.0]),
+            topology=self.topology
+        )
+        unexcited = self.op(snap)
+        self.op.excite(dof=1, excitons=2)
+        # z = 2*((0.75-1.0)**2 + (6.0-3.0)**2) = 18.125
+        # L_2(z) = 1 - 2*z + z**2/2 = 129.0078125
+        assert_almost_equal(self.op(snap) / unexcited, 129.0078125)
+        coords = np.array([snap.coordinates]*2)
+        momenta = np.array([snap.momenta]*2)
+        assert_array_almost_equal(
+            self.op.evaluate_batch(coords, momenta) / unexcited,
+            [129.0078125, 129.0078125]
+        )
+
+        sampler = self.op.default_sampler()
+        ratio = default_exciton_sampling_ratio(2)
+        assert_almost_equal(ratio, 0.2)
+        assert_almost_equal(
+            self.op.correction(snap, sampler),
+            Operator.correction(self.op, snap, sampler)
+        )
+
+    def test_tune_exciton_sampling_ratios(self):
+        self.op.excitons = [0, 1]
+        tuned = self.op.tune_exciton_sampling_ratios(n_pilot=4000,
+                                                     random_state=1)
+        # ground state: sampling the operator itself is exact
+        assert_almost_equal(tuned[0], 1.0)
+        # n=1 with gamma=1: analytic optimum of 
+        # (8/a^3 - 4/a^2 + 1/a) / r with a = 2 - r is r = 0.461
+        op = CoherentProjection(x0=[0.0], p0=[0.0], gamma=[1.0],
+                                excitons=1)
+        tuned = op.tune_exciton_sampling_ratios(n_pilot=4000,
+                                                random_state=1)
+        assert_equal(0.3 <= tuned[1] <= 0.6, True)
+        assert_equal(0.3 <= default_exciton_sampling_ratio(1) <= 0.6, True)
+
+    def test_sampler_widens_with_excitons(self):
+        op = CoherentProjection(x0=np.zeros(5), p0=np.zeros(5),
+                                gamma=np.ones(5), excitons=[0, 1, 2, 3, 4])
+        (coeff_x, coeff_p) = op._default_sampler_details(op.default_sampler())
+        # alpha - gamma: the sampling variance 1/(2 alpha) grows with n
+        alpha = coeff_x + 1.0
+        assert_array_almost_equal(alpha, 1.0 / (2*np.arange(5) + 1))
+        assert_equal(np.all(np.diff(1.0 / alpha) > 0), True)
+
+    def test_adaptive_default_sampler(self):
+        self.op.excitons = [0, 1]
+        sampler = self.op.default_sampler(adaptive=True, random_state=1)
+        tuned = self.op.tune_exciton_sampling_ratios(random_state=1)
+        (coeff_x, coeff_p) = self.op._default_sampler_details(sampler)
+        assert_array_almost_equal(coeff_x, 
+                                  [0.0, (tuned[1] - 1.0) * 5.0])
+        assert_equal(self.op.exciton_sampling_ratios, {0: 1.0})
+
+    def test_fock_coefficients(self):
+        table = fock_coefficients([2, 0, 1])
+        assert_array_almost_equal(table, [[1.0, -2.0, 0.5],
+                                          [1.0, 0.0, 0.0],
+                                          [-1.0, 1.0, 0.0]])
+        # 10th Laguerre polynomial: last coefficient is 1/10!
+        assert_almost_equal(fock_coefficients([10])[0, -1] * 3628800.0, 1.0)
+
+    def test_packed_parameters(self):
+        assert_equal(self.op._parameters.shape, (4, 2))
+        assert_equal(self.op.x0.base is self.op._parameters, True)
+        assert_equal('x0' in vars(self.op), False)
+        self.op.gamma = [2.0, 0.5]
+        assert_array_almost_equal(self.op.inv_gamma, [0.5, 2.0])
+        # in-place changes would leave inv_gamma stale
+        assert_equal(self.op.gamma.flags.writeable, False)
+        # constructor copies its input
+        x0 = np.array([1.0, 2.0])
+        op = CoherentProjection(x0=x0, p0=x0, gamma=np.ones(2))
+        x0[0] = 5.0
+        assert_array_almost_equal(op.x0, [1.0, 2.0])
+
+    @raises(ValueError)
+    def test_set_parameter_wrong_length(self):
+        self.op.x0 = 3.0
+
+    def test_from_arrays(self):
+        x0 = np.array([[1.5, 1.0], [0.0, 0.5], [1.5, 1.0]])
+        excitons = [[0, 0], [1, 0], [0, 0]]
+        ops = CoherentProjection.from_arrays(x0, self.op.p0, self.op.gamma,
+                                             excitons=excitons)
+        assert_equal(len(ops), 3)
+        assert_equal(ops[1].excitons, [1, 0])
+        assert_equal(ops[0]._excited is ops[2]._excited, True)
+        batch = stack_snapshots([self.snap0])
+        for (op, x, n) in zip(ops, x0, excitons):
+            single = CoherentProjection(x0=x, p0=self.op.p0,
+                                        gamma=self.op.gamma, excitons=n)
+            assert_almost_equal(op(self.snap0), single(self.snap0))
+            assert_array_almost_equal(op.evaluate_batch(*batch),
+                                      single.evaluate_batch(*batch))
+        # exciting one leaves the others alone
+        ops[0].excite(1)
+        assert_equal(ops[2].excitons, [0, 0])
+        dof_ops = ElectronicCoherentProjection.from_arrays(
+            [1.0], [3.0], [[5.0], [2.0]], dofs=[1]
+        )
+        assert_equal(type(dof_ops[0]), ElectronicCoherentProjection)
+        assert_array_almost_equal(dof_ops[1].inv_gamma, [0.5])
+        assert_equal(dof_ops[1].dofs, [1])
+
+    def test_dict_round_trip(self):
+        self.dof_op.excite(0, 2)
+        self.dof_op.exciton_sampling_ratios = {0: 1.0, 2: 0.7}
+        dct = self.dof_op.to_dict()
+        assert_equal(dct['parameters'].shape, (3, 1))
+        assert_equal(dct['excitons'].dtype.kind, 'i')
+        op = CoherentProjection.from_dict(dct)
+        assert_array_almost_equal(op._parameters, self.dof_op._parameters)
+        assert_equal(op.dofs, [1])
+        assert_equal(op.excitons, [2])
+        assert_equal(op.exciton_sampling_ratios, {0: 1.0, 2: 0.7})
+        assert_almost_equal(op(self.snap0), self.dof_op(self.snap0))
+        assert_equal(fingerprint(op), fingerprint(self.dof_op))
+        assert_equal(CoherentProjection.from_dict(self.op.to_dict()).dofs,
+                     None)
+
     def test_with_paths_snapshot(self):
         # NOTE: this will have to wait until `paths.Snapshot` has a
         # `momenta` property.
@@ -224,6 +880,30 @@ class testElectronicCoherentProjection(OperatorTester):
         # total = stadard*excited= 0.105405179535977
         assert_almost_equal(self.op(self.snap0), norm_op*0.105405179535977)
 
+    def test_evaluate_batch(self):
+        (coords, momenta, elec_coords, elec_momenta) = stack_snapshots(
+            [self.snap0, self.snap0]
+        )
+        assert_array_almost_equal(
+            self.op.evaluate_batch(coords, momenta, elec_coords,
+                                   elec_momenta),
+            [2.0**2*0.105405179535977]*2
+        )
+
+    @raises(ValueError)
+    def test_evaluate_batch_no_electronic(self):
+        self.op.evaluate_batch(np.zeros((1, 0)), np.zeros((1, 0)))
+
     def test_sample_initial_conditions(self):
         sampler = self.op.default_sampler()
         snap = sampler.generate_initial_snapshot(self.snap0)
+
+    def test_correction(self):
+        sampler = self.op.default_sampler()
+        assert_almost_equal(self.op.correction(self.snap0, sampler),
+                            Operator.correction(self.op, self.snap0, sampler))
+        batch = stack_snapshots([self.snap0])
+        assert_array_almost_equal(
+            self.op.correction_batch(sampler, *batch),
+            [self.op.correction(self.snap0, sampler)]
+        )
@@ -0,0 +1,62 @@
+import dynamiq_engine as dynq
+import numpy as np
+from pywigner.operators import *
+from pywigner.parallel import *
+
+from pywigner.tests.tools import *
+
+def drift(snapshot):
+    # stand-in for an MD engine: free particle with unit mass
+    frames = [snapshot]
+    for _ in range(2):
+        last = frames[-1]
+        frames.append(dynq.Snapshot(coordinates=last.coordinates
+                                    + 0.1*last.momenta,
+                                    momenta=last.momenta.copy()))
+    return frames
+
+
+class testRunEnsemble(object):
+    def setup(self):
+        a_op = CoherentProjection(x0=np.array([0.5, 0.0]),
+                                  p0=np.array([0.0, 1.0]),
+                                  gamma=np.array([1.0, 2.0]))
+        b_op = CoherentProjection(x0=np.array([0.0, 0.0]),
+                                  p0=np.array([0.0, 0.0]),
+                                  gamma=np.array([1.0, 1.0]))
+        template = dynq.Snapshot(coordinates=np.zeros(2),
+                                 momenta=np.zeros(2))
+        self.task = EnsembleTask(a_op, b_op, a_op.default_sampler(),
+                                 template, propagate=drift)
+
+    def test_block_sizes(self):
+        assert_equal(block_sizes(10, 4), [4, 4, 2])
+        assert_equal(block_sizes(8, 4), [4, 4])
+
+    def test_reproducible(self):
+        serial = run_ensemble(self.task, 25, master_seed=5, block_size=4,
+                              max_workers=1)
+        again = run_ensemble(self.task, 25, master_seed=5, block_size=4,
+                             max_workers=1)
+        assert_equal(serial.n_trajectories, 25)
+        assert_equal(np.array_equal(serial.mean, again.mean), True)
+        other_seed = run_ensemble(self.task, 25, master_seed=6,
+                                  block_size=4, max_workers=1)
+        assert_equal(np.array_equal(serial.mean, other_seed.mean), False)
+
+    def test_independent_of_workers(self):
+        serial = run_ensemble(self.task, 25, master_seed=5, block_size=4,
+                              max_workers=1)
+        parallel = run_ensemble(self.task, 25, master_seed=5, block_size=4,
+                                max_workers=3)
+        assert_equal(np.array_equal(serial.mean, parallel.mean), True)
+        assert_equal(np.array_equal(serial.statistics.m2,
+                                    parallel.statistics.m2), True)
+
+    def test_global_state_restored(self):
+        np.random.seed(11)
+        expected = np.random.random_sample(3)
+        np.random.seed(11)
+        run_ensemble(self.task, 10, master_seed=5, block_size=4,
+                     max_workers=1)
+        assert_array_almost_equal(np.random.random_sample(3), expected)
@@ -0,0 +1,122 @@
+import dynamiq_engine as dynq
+import numpy as np
+from pywigner.operators import *
+from pywigner.qmc import *
+from pywigner.tools import stack_snapshots
+
+from pywigner.tests.tools import *
+
+try:
+    from scipy.stats import qmc as _scipy_qmc
+except ImportError:  # SciPy before 1.7, e.g., on Python 2
+    _scipy_qmc = None
+
+def require_sobol():
+    if _scipy_qmc is None:
+        raise SkipTest("Sobol points need scipy.stats.qmc")
+
+
+class testQMCGaussianSampler(object):
+    def setup(self):
+        self.op = CoherentProjection(x0=np.array([0.5, 0.0, 1.0]),
+                                     p0=np.array([0.0, 1.0, -1.0]),
+                                     gamma=np.array([1.0, 2.0, 0.5]),
+                                     dofs=[0, 2, 3])
+        self.template = dynq.Snapshot(coordinates=np.array([7.0, 7.0, 0.0,
+                                                            0.0]),
+                                      momenta=np.zeros(4))
+
+    def test_primes(self):
+        assert_equal(list(primes(6)), [2, 3, 5, 7, 11, 13])
+
+    def test_halton_uniform(self):
+        points = ShiftedHalton(2, seed=3).random(64)
+        assert_equal(points.shape, (64, 2))
+        # low discrepancy: every quarter of each axis gets 16 points
+        for dim in range(2):
+            counts = np.histogram(points[:, dim], bins=4, range=(0, 1))[0]
+            assert_equal(list(counts), [16]*4)
+
+    def test_generate_batch(self):
+        for method in QMC_METHODS:
+            if method == 'sobol' and _scipy_qmc is None:
+                continue
+            sampler = self.op.default_sampler(qmc=method, random_state=1)
+            assert_equal(isinstance(sampler, QMCGaussianSampler), True)
+            (coords, momenta, elec_coords, elec_momenta) = \
+                    sampler.generate_batch(1024, self.template)
+            assert_equal(coords.shape, (1024, 4))
+            assert_equal(elec_coords, None)
+            # unsampled dofs come from the template
+            assert_equal(np.all(coords[:, 1] == 7.0), True)
+            assert_array_almost_equal(coords[:, [0, 2, 3]].mean(axis=0),
+                                      self.op.x0, decimal=3)
+            assert_array_almost_equal(momenta[:, [0, 2, 3]].var(axis=0),
+                                      0.5 / (1.0 * self.op.inv_gamma),
+                                      decimal=2)
+
+    def test_sequence_continues(self):
+        require_sobol()
+        sampler = self.op.default_sampler(qmc='sobol', random_state=1)
+        first = sampler.generate_batch(4, self.template)[0]
+        second = sampler.generate_batch(4, self.template)[0]
+        assert_equal(np.any(first[:, 0] == second[:, 0]), False)
+        again = self.op.default_sampler(qmc='sobol', random_state=1)
+        assert_array_almost_equal(
+            again.generate_batch(8, self.template)[0],
+            np.concatenate([first, second])
+        )
+
+    def test_correction_matches_density(self):
+        # closed form and generic correction agree
+        sampler = self.op.default_sampler(qmc='halton', random_state=2)
+        snap = sampler.generate_initial_snapshot(self.template)
+        assert_equal(snap.coordinates[1], 7.0)
+        generic = self.op(snap) / sampler(snap) * sampler.norm
+        assert_almost_equal(self.op.correction(snap, sampler), generic)
+        batch = stack_snapshots([snap])
+        assert_almost_equal(self.op.correction_batch(sampler, *batch)[0],
+                            generic)
+
+    def test_product_default_sampler(self):
+        require_sobol()
+        other = ElectronicCoherentProjection.with_n_dofs(2)
+        product = self.op * other
+        sampler = product.default_sampler(qmc='sobol', random_state=4)
+        assert_equal(sampler.dimension, 10)
+        template = dynq.MMSTSnapshot(coordinates=np.zeros(4),
+                                     momenta=np.zeros(4),
+                                     electronic_coordinates=np.zeros(2),
+                                     electronic_momenta=np.zeros(2))
+        snap = sampler.generate_initial_snapshot(template)
+        expected = (self.op.correction(snap, self.op.default_sampler())
+                    * other.correction(snap, other.default_sampler()))
+        assert_almost_equal(product.correction(snap, sampler), expected)
+        batch = sampler.generate_batch(3, template)
+        assert_equal(batch[2].shape, (3, 2))
+
+    def test_replica_estimate(self):
+        require_sobol()
+        # the mean correction under the default sampler is the integral of
+        # the operator times the sampler norm: 2 / 3 (excited dof, gamma
+        # 1) times 2 for each ground-state dof
+        self.op.excite(0)
+        sampler = self.op.default_sampler(qmc='sobol')
+        correction = lambda s, *batch: self.op.correction_batch(s, *batch)
+        (mean, error) = replica_estimate(correction, sampler, self.template,
+                                         256, n_replicas=8, random_state=0)
+        assert_equal(error > 0.0, True)
+        assert_equal(abs(mean - 8.0/3.0) < 5*error, True)
+        # much better than the Monte Carlo error for the same samples
+        mc_sampler = self.op.default_sampler()
+        np.random.seed(0)
+        snaps = [mc_sampler.generate_initial_snapshot(self.template)
+                 for _ in range(256)]
+        mc_values = self.op.correction_batch(mc_sampler,
+                                             *stack_snapshots(snaps))
+        mc_error = mc_values.std() / np.sqrt(8*256)
+        assert_equal(error < mc_error / 3.0, True)
+
+    @raises(ValueError)
+    def test_unknown_method(self):
+        self.op.default_sampler(qmc='lattice')
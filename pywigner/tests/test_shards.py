@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import dynamiq_engine as dynq
+import numpy as np
+from pywigner.operators import *
+from pywigner.correlation import CorrelationFunction
+from pywigner.shards import *
+from pywigner.merge import merge_shards, main
+
+from pywigner.tests.tools import *
+
+class testShards(object):
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.a_op = CoherentProjection(x0=np.array([0.5]),
+                                       p0=np.array([0.0]),
+                                       gamma=np.array([1.0]))
+        self.b_op = CoherentProjection(x0=np.array([0.0]),
+                                       p0=np.array([1.0]),
+                                       gamma=np.array([2.0]))
+        self.sampler = self.a_op.default_sampler()
+        self.correlations = []
+        for trajs in [[[(0.5, 0.0), (0.6, 0.5)], [(1.0, 0.2), (0.9, -0.1)]],
+                      [[(0.0, -0.5), (0.1, 0.3)]]]:
+            corr = CorrelationFunction(self.a_op, self.b_op, self.sampler)
+            for traj in trajs:
+                corr.add_trajectory([
+                    dynq.Snapshot(coordinates=np.array([x]),
+                                  momenta=np.array([p]))
+                    for (x, p) in traj
+                ])
+            self.correlations.append(corr)
+        self.filenames = [os.path.join(self.tmpdir, "shard%d.npz" % i)
+                          for i in range(len(self.correlations))]
+        for (filename, corr) in zip(self.filenames, self.correlations):
+            write_shard(filename, corr)
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        (key, stats) = read_shard(self.filenames[0])
+        assert_equal(key, correlation_key(self.correlations[0]))
+        assert_array_almost_equal(stats.mean,
+                                  self.correlations[0].statistics.mean)
+        assert_array_almost_equal(stats.count,
+                                  self.correlations[0].statistics.count)
+
+    def test_key_from_parameters(self):
+        # same parameters in a new object give the same key
+        a_op = CoherentProjection(x0=np.array([0.5]), p0=np.array([0.0]),
+                                  gamma=np.array([1.0]))
+        corr = CorrelationFunction(a_op, self.b_op, a_op.default_sampler())
+        assert_equal(correlation_key(corr),
+                     correlation_key(self.correlations[0]))
+        a_op.excite(0)
+        assert_not_equal(correlation_key(corr),
+                         correlation_key(self.correlations[0]))
+
+    def test_merge(self):
+        (key, merged) = merge_shards(self.filenames)
+        expected = self.correlations[0].merge(self.correlations[1])
+        assert_array_almost_equal(merged.mean, expected.mean)
+        assert_array_almost_equal(merged.standard_error,
+                                  expected.standard_error)
+        assert_array_almost_equal(merged.count[:, 0], [3, 3])
+
+    @raises(ShardMismatchError)
+    def test_merge_mismatch(self):
+        other = CorrelationFunction(self.b_op, self.a_op,
+                                    self.b_op.default_sampler())
+        filename = os.path.join(self.tmpdir, "other.npz")
+        write_shard(filename, other)
+        merge_shards(self.filenames + [filename])
+
+    def test_main(self):
+        output = os.path.join(self.tmpdir, "merged.npz")
+        main(["-o", output] + self.filenames)
+        (key, merged) = read_shard(output)
+        assert_array_almost_equal(merged.count[:, 0], [3, 3])
@@ -0,0 +1,85 @@
+import numpy as np
+from pywigner.tools import *
+
+from pywigner.tests.tools import *
+
+class testDofIndex(object):
+    def setup(self):
+        self.features = np.array([[0.0, 1.0, 2.0, 3.0],
+                                  [4.0, 5.0, 6.0, 7.0]])
+
+    def test_all_dofs(self):
+        index = DofIndex(None)
+        assert_equal(index.is_view, True)
+        assert_array_almost_equal(index(self.features), self.features)
+
+    def test_contiguous_dofs(self):
+        index = DofIndex([1, 2])
+        assert_equal(index.is_view, True)
+        selected = index(self.features)
+        assert_array_almost_equal(selected, [[1.0, 2.0], [5.0, 6.0]])
+        assert_equal(np.may_share_memory(selected, self.features), True)
+        assert_array_almost_equal(index(self.features[0]), [1.0, 2.0])
+
+    def test_scattered_dofs(self):
+        index = DofIndex([3, 0])
+        assert_equal(index.is_view, False)
+        assert_array_almost_equal(index(self.features),
+                                  [[3.0, 0.0], [7.0, 4.0]])
+        buf = np.empty(2)
+        result = index(self.features[1], out=buf)
+        assert_equal(result is buf, True)
+        assert_array_almost_equal(buf, [7.0, 4.0])
+
+    def test_contiguous_with_buffer(self):
+        buf = np.empty((2, 2))
+        DofIndex([2, 3])(self.features, out=buf)
+        assert_array_almost_equal(buf, [[2.0, 3.0], [6.0, 7.0]])
+
+
+class testStackSnapshots(object):
+    def test_stack(self):
+        class Snap(object):
+            def __init__(self, x, p):
+                self.coordinates = np.array(x)
+                self.momenta = np.array(p)
+        snaps = [Snap([[0.0, 1.0]], [[2.0, 3.0]]),
+                 Snap([[4.0, 5.0]], [[6.0, 7.0]])]
+        (coords, momenta, elec_x, elec_p) = stack_snapshots(snaps)
+        assert_array_almost_equal(coords, [[0.0, 1.0], [4.0, 5.0]])
+        assert_array_almost_equal(momenta, [[2.0, 3.0], [6.0, 7.0]])
+        assert_equal(elec_x, None)
+        assert_equal(elec_p, None)
+
+
+class Holder(object):
+    def __init__(self, value, random_state):
+        self.value = value
+        self.random_state = random_state
+
+    @property
+    def expensive(self):
+        raise AssertionError("fingerprint shouldn't evaluate properties")
+
+
+class testFingerprint(object):
+    def test_random_state(self):
+        # the RandomState only counts by class, so the fingerprint doesn't
+        # depend on its address or on how much of its stream was used
+        state = np.random.RandomState(1)
+        first = fingerprint(Holder(np.arange(3), state))
+        state.random_sample(10)
+        assert_equal(fingerprint(Holder(np.arange(3), state)), first)
+        assert_equal(fingerprint(Holder(np.arange(3),
+                                        np.random.RandomState(2))), first)
+        assert_not_equal(fingerprint(Holder(np.arange(4), state)), first)
+
+    def test_to_dict(self):
+        class Stored(object):
+            def __init__(self, x):
+                self._x = x
+
+            def to_dict(self):
+                return {'x': self._x}
+        assert_equal(fingerprint(Stored(1.0)), fingerprint(Stored(1.0)))
+        assert_not_equal(fingerprint(Stored(1.0)), fingerprint(Stored(2.0)))
@@ -0,0 +1,159 @@
+import dynamiq_engine as dynq
+import numpy as np
+from pywigner.operators import *
+from pywigner.variance_reduction import *
+from pywigner.tools import stack_snapshots
+
+from pywigner.tests.tools import *
+
+def drift_frames(coords, momenta, n_frames=3):
+    # free particle with unit mass, as stacked frames
+    return [(coords + 0.5*t*momenta, momenta, None, None)
+            for t in range(n_frames)]
+
+
+class LinearOperator(Operator):
+    # B(x, p) = x; with the ground state at x0 = 0.5, p0 = 0 as A (weight
+    # 2), the correlation function is 1.0 at all times
+    def evaluate_batch(self, coords, momenta, elec_coords=None,
+                       elec_momenta=None):
+        return np.asarray(coords)[:, 0]
+
+
+class testVarianceReduction(object):
+    def setup(self):
+        self.a_op = CoherentProjection(x0=np.array([0.5, -1.0]),
+                                       p0=np.array([0.0, 1.0]),
+                                       gamma=np.array([1.0, 2.0]),
+                                       dofs=[0, 2], excitons=[1, 0])
+        self.b_op = CoherentProjection(x0=np.array([1.0, 0.0, -0.5]),
+                                       p0=np.array([0.5, 0.0, 1.5]),
+                                       gamma=np.array([1.0, 1.0, 1.0]))
+        self.sampler = self.a_op.default_sampler()
+        np.random.seed(3)
+        self.coords = np.random.normal(size=(200, 3))
+        self.momenta = np.random.normal(size=(200, 3))
+
+    def test_reflect_batch(self):
+        (coords, momenta, elec_coords, elec_momenta) = \
+                reflect_batch(self.a_op, self.coords, self.momenta)
+        assert_equal(elec_coords, None)
+        assert_array_almost_equal(coords[:, 1], self.coords[:, 1])
+        assert_array_almost_equal(coords[:, [0, 2]],
+                                  2.0*self.a_op.x0 - self.coords[:, [0, 2]])
+        assert_array_almost_equal(momenta[:, [0, 2]],
+                                  2.0*self.a_op.p0
+                                  - self.momenta[:, [0, 2]])
+        # the correction weight is symmetric about the center
+        assert_array_almost_equal(
+            self.a_op.correction_batch(self.sampler, coords, momenta),
+            self.a_op.correction_batch(self.sampler, self.coords,
+                                       self.momenta)
+        )
+
+    def test_antithetic_sampler(self):
+        sampler = AntitheticSampler(self.sampler, self.a_op)
+        assert_equal(sampler.norm, self.sampler.norm)
+        template = dynq.Snapshot(coordinates=np.zeros(3),
+                                 momenta=np.zeros(3))
+        first = sampler.generate_initial_snapshot(template)
+        second = sampler.generate_initial_snapshot(template)
+        assert_array_almost_equal(first.coordinates[[0, 2]]
+                                  + second.coordinates[[0, 2]],
+                                  2.0*self.a_op.x0)
+        assert_equal(second.coordinates[1], 0.0)
+        # closed-form correction still applies through the wrapper
+        assert_almost_equal(self.a_op.correction(second, sampler),
+                            self.a_op.correction(second, self.sampler))
+
+    def test_phase_space_integral(self):
+        # ground state dof: 2 pi; one exciton with gamma 1: 2 pi too
+        assert_almost_equal(self.a_op.phase_space_integral(),
+                            (2.0*np.pi)**2)
+        product = self.a_op * ElectronicCoherentProjection.with_n_dofs(1)
+        assert_almost_equal(product.phase_space_integral(),
+                            (2.0*np.pi)**3)
+
+    def test_no_reduction_matches_plain(self):
+        frames = drift_frames(self.coords, self.momenta)
+        estimator = VarianceReducedCorrelation(self.a_op, self.b_op,
+                                               self.sampler)
+        estimator.add_batch(frames)
+        weights = self.a_op.correction_batch(self.sampler, *frames[0])
+        values = np.array([weights * self.b_op.evaluate_batch(*f)
+                           for f in frames])
+        assert_equal(estimator.n_trajectories, 200)
+        assert_array_almost_equal(estimator.mean[:, 0], values.mean(axis=1))
+        assert_array_almost_equal(estimator.standard_error[:, 0],
+                                  values.std(axis=1, ddof=1)/np.sqrt(200))
+        assert_array_almost_equal(estimator.variance_reduction, 1.0)
+
+    def test_control_variates(self):
+        frames = drift_frames(self.coords, self.momenta)
+        controls = [weight_control(self.a_op, self.sampler)]
+        controls += center_controls(self.a_op)
+        estimator = VarianceReducedCorrelation(self.a_op, self.b_op,
+                                               self.sampler,
+                                               controls=controls)
+        estimator.add_batch(drift_frames(self.coords[:50],
+                                         self.momenta[:50]))
+        estimator.add_batch(drift_frames(self.coords[50:],
+                                         self.momenta[50:]))
+        # same as a least-squares fit of values against the controls
+        c = np.concatenate([control(*frames[0]) for control in controls],
+                           axis=1)
+        known = np.concatenate([control.mean for control in controls])
+        weights = self.a_op.correction_batch(self.sampler, *frames[0])
+        for (t, frame) in enumerate(frames):
+            y = weights * self.b_op.evaluate_batch(*frame)
+            design = np.concatenate([np.ones((200, 1)), c - known], axis=1)
+            fit = np.linalg.lstsq(design, y, rcond=-1)[0]
+            assert_almost_equal(estimator.mean[t, 0], fit[0])
+        # the controls explain part of the variance
+        assert_equal(np.all(estimator.variance_reduction > 1.0), True)
+
+    def test_antithetic_reduces_variance(self):
+        # ground state: constant weights; B is linear in phase space, so
+        # antithetic pairs remove all of the variance
+        a_op = CoherentProjection(x0=np.array([0.5]), p0=np.array([0.0]),
+                                  gamma=np.array([1.0]))
+        sampler = a_op.default_sampler()
+        np.random.seed(5)
+        coords = np.random.normal(0.5, np.sqrt(0.5), size=(400, 1))
+        momenta = np.random.normal(0.0, np.sqrt(0.5), size=(400, 1))
+        batch = antithetic_batch(a_op, coords, momenta)
+        assert_equal(batch[0].shape, (800, 1))
+        plain = VarianceReducedCorrelation(a_op, LinearOperator(), sampler)
+        plain.add_batch(drift_frames(batch[0], batch[1]))
+        paired = VarianceReducedCorrelation(a_op, LinearOperator(), sampler,
+                                            antithetic=True)
+        paired.add_batch(drift_frames(batch[0], batch[1]))
+        assert_array_almost_equal(paired.mean, plain.mean)
+        assert_array_almost_equal(paired.mean[:, 0], [1.0, 1.0, 1.0])
+        assert_equal(paired.n_trajectories, 800)
+        assert_array_almost_equal(paired.standard_error, 0.0)
+        assert_equal(np.all(plain.standard_error > 0.01), True)
+
+    @raises(ValueError)
+    def test_antithetic_needs_pairs(self):
+        estimator = VarianceReducedCorrelation(self.a_op, self.b_op,
+                                               self.sampler, antithetic=True)
+        estimator.add_batch(drift_frames(self.coords[:3],
+                                         self.momenta[:3]))
+
+    @raises(TypeError)
+    def test_reflect_needs_projections(self):
+        reflect_batch(Operator(), self.coords, self.momenta)
+
+    def test_product_with_polynomial(self):
+        # polynomials read the same features, but have no center
+        product = PositionOperator(0) * self.a_op
+        for func in [lambda: reflect_batch(product, self.coords,
+                                           self.momenta),
+                     lambda: center_controls(product)]:
+            try:
+                func()
+            except TypeError:
+                pass
+            else:
+                raise AssertionError("Expected TypeError")
@@ -1,4 +1,6 @@
 import numpy as np
+import hashlib
+import numbers
 
 def clean_ravel(arr, n_dofs):
     try:
@@ -11,3 +13,146 @@ def clean_ravel(arr, n_dofs):
     return retval
 
 
+class DofIndex(object):
+    """Precompiled selection of a subset of dofs from a feature array.
+
+    Selection is along the last axis, so the same index works on raveled
+    snapshot features (n_features,) and on batches (n_samples, n_features).
+    Contiguous increasing dofs become a slice (selection is a view);
+    anything else is an integer array used with `numpy.take`.
+
+    Parameters
+    ----------
+    dofs : list or None
+        dofs to select; None selects everything
+    """
+    def __init__(self, dofs):
+        self.dofs = dofs
+        if dofs is None:
+            self.index = slice(None)
+        else:
+            index = np.asarray(dofs, dtype=int).ravel()
+            is_contiguous = (len(index) > 0 and index[0] >= 0
+                             and np.all(np.diff(index) == 1))
+            if is_contiguous:
+                self.index = slice(index[0], index[-1] + 1)
+            else:
+                self.index = index
+        self.is_view = isinstance(self.index, slice)
+
+    def __call__(self, features, out=None):
+        """Select the dofs from `features`.
+
+        Parameters
+        ----------
+        features : numpy.array
+            feature array, dofs along the last axis
+        out : numpy.array or None
+            reusable output buffer; if None, slice selections return views
+            and integer selections return a new array
+        """
+        if self.is_view:
+            selected = features[..., self.index]
+            if out is None:
+                return selected
+            out[...] = selected
+            return out
+        return np.take(features, self.index, axis=-1, out=out)
+
+
+def as_batch(arr):
+    """Reshape a stacked feature array to (n_samples, n_features).
+
+    The first axis of `arr` is the sample index; any further axes (e.g.,
+    atoms and spatial dimensions) are flattened in the same order as
+    `snapshot.coordinates.ravel()`.
+    """
+    arr = np.asarray(arr, dtype=float)
+    return arr.reshape(arr.shape[0], -1)
+
+
+def stack_snapshots(snapshots):
+    """Stack the phase-space features of snapshots for batch evaluation.
+
+    Returns
+    -------
+    tuple
+        (coords, momenta, elec_coords, elec_momenta), each with shape
+        (n_samples, n_features). Electronic features are None if the
+        snapshots don't have them.
+    """
+    snapshots = list(snapshots)
+    features = []
+    for attr in ['coordinates', 'momenta',
+                 'electronic_coordinates', 'electronic_momenta']:
+        try:
+            values = [np.asarray(getattr(s, attr)).ravel()
+                      for s in snapshots]
+        except AttributeError:
+            features.append(None)
+        else:
+            features.append(np.array(values, dtype=float))
+    return tuple(features)
+
+
+def signed_log(values):
+    """Split values into (sign, log(abs(value))).
+
+    Zeros give a sign of 0 and a log-magnitude of -inf.
+    """
+    values = np.asarray(values)
+    with np.errstate(divide='ignore'):
+        return (np.sign(values), np.log(np.abs(values)))
+
+
+def _canonical(obj, seen):
+    # reproducible text form of obj, for fingerprint
+    if obj is None or isinstance(obj, (numbers.Number, str, type(u''))):
+        return repr(obj)
+    if isinstance(obj, np.ndarray):
+        return "array(%s,%s,%s)" % (obj.dtype.str, obj.shape,
+                                    hashlib.sha1(
+                                        np.ascontiguousarray(obj).tobytes()
+                                    ).hexdigest())
+    if isinstance(obj, np.generic):
+        return _canonical(obj.item(), seen)
+    if isinstance(obj, (list, tuple)):
+        return "[%s]" % ",".join(_canonical(o, seen) for o in obj)
+    if isinstance(obj, dict):
+        items = sorted((repr(k), _canonical(v, seen))
+                       for (k, v) in obj.items())
+        return "{%s}" % ",".join("%s:%s" % kv for kv in items)
+    if id(obj) in seen:
+        return "<cycle>"
+    seen = seen | set([id(obj)])
+    name = "%s.%s" % (type(obj).__module__, type(obj).__name__)
+    if callable(getattr(obj, 'to_dict', None)):
+        # operators and samplers: what they would be stored as
+        return name + _canonical(obj.to_dict(), seen)
+    try:
+        attrs = vars(obj)
+    except TypeError:
+        # no inspectable contents (e.g., a RandomState, which changes as
+        # it is used): only the class is part of the identity
+        return name + "<opaque>"
+    public = dict((k, v) for (k, v) in attrs.items()
+                  if not k.startswith('_') and not callable(v))
+    return name + _canonical(public, seen)
+
+
+def fingerprint(obj):
+    """Identity of an object's contents, stable across processes.
+
+    Hashes the class and contents, recursively: `to_dict()` for objects
+    that have it (e.g., operators), and the public (non-underscore)
+    attributes otherwise. So two operators (or samplers) built from the
+    same parameters in different processes have the same fingerprint.
+    Objects with neither (e.g., a `numpy.random.RandomState`) count only
+    by their class.
+
+    Returns
+    -------
+    str
+        hex digest
+    """
+    return hashlib.sha1(_canonical(obj, set()).encode('utf-8')).hexdigest()
@@ -0,0 +1,321 @@
+"""
+Variance reduction for LSC-IVR averages: antithetic pairs and control
+variates.
+
+Antithetic sampling reflects each initial condition through the center of
+the A-operator, :math:`(x - x_0, p - p_0) \\to (x_0 - x, p_0 - p)`. The
+default samplers are symmetric about that center, so the reflected point
+is an equally valid sample with the same correction weight, and averaging
+each pair cancels the parts of the integrand that are odd about the
+center.
+
+Control variates are quantities whose average under the sampler is known
+exactly, e.g., the correction weights (their average is the sampler's norm
+times the operator's phase space integral) or the sampled coordinates
+(their average is the center of the sampler). Subtracting the optimal
+multiple of their deviation from the known mean removes the part of the
+estimator's variance that is correlated with them.
+"""
+import numpy as np
+
+from pywigner.accumulators import RunningStatistics, RunningCovariance
+from pywigner.operators.coherent_states import CoherentProjection
+from pywigner.tools import as_batch, stack_snapshots
+
+# order of the feature arrays in a batch, as in `stack_snapshots`
+BATCH_FEATURES = ['coordinates', 'momenta',
+                  'electronic_coordinates', 'electronic_momenta']
+
+
+def _projections(operator):
+    try:
+        operators = list(operator._flattened_operators())
+    except AttributeError:
+        operators = [operator]
+    for op in operators:
+        if not isinstance(op, CoherentProjection):
+            raise TypeError("Antithetic reflection and center controls "
+                            + "need coherent projections, not "
+                            + type(op).__name__)
+    return operators
+
+
+def reflect_batch(operator, coords, momenta, elec_coords=None,
+                  elec_momenta=None):
+    """Reflect stacked initial conditions through the operator's center.
+
+    Only the dofs of the operator's coherent projections are reflected;
+    arrays are as in :meth:`.Operator.evaluate_batch`, and the result has
+    the same form.
+    """
+    batch = dict(zip(BATCH_FEATURES,
+                     [coords, momenta, elec_coords, elec_momenta]))
+    reflected = dict((name, np.array(as_batch(values)))
+                     for (name, values) in batch.items()
+                     if values is not None)
+    for op in _projections(operator):
+        (x_name, p_name) = op._feature_names
+        dofs = op._global_dofs()
+        reflected[x_name][:, dofs] = (2.0 * op.x0
+                                      - as_batch(batch[x_name])[:, dofs])
+        reflected[p_name][:, dofs] = (2.0 * op.p0
+                                      - as_batch(batch[p_name])[:, dofs])
+    return tuple(None if batch[name] is None
+                 else reflected[name].reshape(np.shape(batch[name]))
+                 for name in BATCH_FEATURES)
+
+
+def antithetic_batch(operator, coords, momenta, elec_coords=None,
+                     elec_momenta=None):
+    """Stacked initial conditions followed by their reflections.
+
+    For n samples, the result has 2n: sample i + n is the reflection of
+    sample i, as expected by :class:`VarianceReducedCorrelation`.
+    """
+    batch = (coords, momenta, elec_coords, elec_momenta)
+    reflected = reflect_batch(operator, *batch)
+    return tuple(None if values is None
+                 else np.concatenate([np.asarray(values, dtype=float),
+                                      mirror])
+                 for (values, mirror) in zip(batch, reflected))
+
+
+def reflect(operator, snapshot):
+    """Copy of `snapshot`, reflected through the operator's center"""
+    reflected = reflect_batch(operator, *stack_snapshots([snapshot]))
+    new_snapshot = snapshot.copy()
+    for (name, values) in zip(BATCH_FEATURES, reflected):
+        if values is not None:
+            old = np.asarray(getattr(snapshot, name))
+            setattr(new_snapshot, name, values[0].reshape(old.shape))
+    return new_snapshot
+
+
+class AntitheticSampler(object):
+    """Sampler that returns each draw of `sampler` and then its reflection.
+
+    Everything else (evaluating the density, `norm`, and the closed-form
+    corrections of the operator that made `sampler`) is passed through to
+    `sampler`.
+
+    Parameters
+    ----------
+    sampler :
+        sampler symmetric about the center of `operator`, e.g.,
+        `operator.default_sampler()`
+    operator : :class:`.CoherentProjection` or :class:`.ProductOperator`
+        operator whose center is the reflection point
+    """
+    def __init__(self, sampler, operator):
+        self.sampler = sampler
+        self.operator = operator
+        self._partner = None
+
+    def __getattr__(self, name):
+        # only called for attributes not found normally
+        if name in ('sampler', 'operator', '_partner'):
+            raise AttributeError(name)
+        return getattr(self.sampler, name)
+
+    def __call__(self, snapshot):
+        return self.sampler(snapshot)
+
+    def generate_initial_snapshot(self, snapshot):
+        if self._partner is not None:
+            (partner, self._partner) = (self._partner, None)
+            return partner
+        new_snapshot = self.sampler.generate_initial_snapshot(snapshot)
+        self._partner = reflect(self.operator, new_snapshot)
+        return new_snapshot
+
+
+class Control(object):
+    """Quantity with a known average under the sampler.
+
+    Parameters
+    ----------
+    function : callable
+        `function(coords, momenta, elec_coords, elec_momenta)` giving the
+        control for each sample of a batch, shape (n_samples,) or
+        (n_samples, k)
+    mean : float or array-like
+        exact average of the control, shape () or (k,)
+    """
+    def __init__(self, function, mean):
+        self.function = function
+        self.mean = np.atleast_1d(np.asarray(mean, dtype=float))
+
+    def __call__(self, coords, momenta, elec_coords=None, elec_momenta=None):
+        values = np.asarray(self.function(coords, momenta, elec_coords,
+                                          elec_momenta), dtype=float)
+        return values.reshape(len(values), -1)
+
+
+def weight_control(operator, sampler):
+    """Correction weights of `operator`, with mean
+    `sampler.norm * operator.phase_space_integral()`.
+
+    Needs a batched correction, i.e., a default sampler of `operator`.
+    """
+    function = lambda *batch: operator.correction_batch(sampler, *batch)
+    return Control(function, sampler.norm * operator.phase_space_integral())
+
+
+def _feature_control(op, index, mean):
+    def function(coords, momenta, elec_coords, elec_momenta):
+        features = op._batch_features(coords, momenta, elec_coords,
+                                      elec_momenta)
+        return op._select_batch(features[index])
+    return Control(function, mean)
+
+
+def center_controls(operator):
+    """Sampled coordinates and momenta on the operator's dofs.
+
+    Their means are the operator's centers, which is exact for samplers
+    centered on the operator, such as its default sampler.
+    """
+    controls = []
+    for op in _projections(operator):
+        controls.append(_feature_control(op, 0, op.x0))
+        controls.append(_feature_control(op, 1, op.p0))
+    return controls
+
+
+class VarianceReducedCorrelation(object):
+    """:class:`.CorrelationFunction` estimate with variance reduction.
+
+    Accumulates the same contributions, `a_operator.correction` of the
+    first frame times `b_operator` at each frame, from batches of
+    trajectories. With `antithetic`, each batch of 2n trajectories is n
+    antithetic pairs (see :func:`antithetic_batch`), and each pair is one
+    sample of the estimator. With `controls`, the estimate is the
+    control-variate estimate with the optimal coefficients, fitted to all
+    the samples so far.
+
+    Plain running statistics of the individual trajectories are also
+    kept, so :attr:`variance_reduction` can report how much the estimator
+    gained over plain Monte Carlo with the same number of trajectories.
+
+    Parameters
+    ----------
+    a_operator : :class:`.Operator`
+        the operator at time 0
+    b_operators : :class:`.Operator` or list of :class:`.Operator`
+        the operator(s) at time t
+    sampler :
+        the sampler used to generate the initial conditions; needs a
+        batched correction for `a_operator`
+    controls : list of :class:`Control`
+        control variates, evaluated on the first frame
+    antithetic : bool
+        whether batches are made of antithetic pairs
+    """
+    def __init__(self, a_operator, b_operators, sampler, controls=None,
+                 antithetic=False):
+        self.a_operator = a_operator
+        try:
+            self.b_operators = list(b_operators)
+        except TypeError:
+            self.b_operators = [b_operators]
+        self.sampler = sampler
+        self.controls = list(controls) if controls is not None else []
+        self.antithetic = antithetic
+        self.known_means = np.concatenate(
+            [c.mean for c in self.controls] + [np.zeros(0)]
+        )
+        self.plain = RunningStatistics((0, len(self.b_operators)))
+        self.statistics = None  # RunningCovariance, once n_frames is known
+
+    def add_batch(self, frames):
+        """Add a batch of trajectories.
+
+        Parameters
+        ----------
+        frames : iterable of tuple
+            for each time index, (coords, momenta, elec_coords,
+            elec_momenta) stacked over the trajectories, as in
+            :meth:`.CorrelationFunction.add_batch`; every trajectory must
+            have the same number of frames
+        """
+        frames = list(frames)
+        if len(frames) == 0:
+            return
+        weights = self.a_operator.correction_batch(self.sampler, *frames[0])
+        values = np.array([[weights * b.evaluate_batch(*frame)
+                            for b in self.b_operators]
+                           for frame in frames])
+        values = values.transpose(2, 0, 1)  # (n_traj, n_frames, n_b)
+        controls = np.concatenate(
+            [c(*frames[0]) for c in self.controls]
+            + [np.zeros((len(values), 0))], axis=1
+        )
+        self.plain.add_batch(values)
+        if self.antithetic:
+            half = len(values) // 2
+            if 2 * half != len(values):
+                raise ValueError("Antithetic batches need an even number "
+                                 + "of trajectories")
+            values = 0.5 * (values[:half] + values[half:])
+            controls = 0.5 * (controls[:half] + controls[half:])
+        if self.statistics is None:
+            self.statistics = RunningCovariance(len(self.known_means),
+                                                values.shape[1:])
+        elif values.shape[1:] != self.statistics.shape:
+            raise ValueError("Batches must all have the same number of "
+                             + "frames")
+        self.statistics.add_batch(controls, values)
+
+    def merge(self, other):
+        """Add the trajectories accumulated by `other`."""
+        self.plain.merge(other.plain)
+        if self.statistics is None:
+            self.statistics = other.statistics
+        elif other.statistics is not None:
+            self.statistics.merge(other.statistics)
+        return self
+
+    @property
+    def n_trajectories(self):
+        count = self.plain.count
+        return int(count[0, 0]) if len(count) > 0 else 0
+
+    def _estimate(self):
+        # (mean, residual variance) of the control-variate estimator
+        stats = self.statistics
+        dof = max(stats.count - 1, 1)
+        variance = stats.m2 / dof
+        if len(self.known_means) == 0:
+            return (stats.mean, variance)
+        flat_cross = stats.cross_m2.reshape(len(self.known_means), -1)
+        coefficients = np.dot(np.linalg.pinv(stats.control_m2), flat_cross)
+        mean = stats.mean - np.dot(stats.control_mean - self.known_means,
+                                   coefficients).reshape(stats.shape)
+        explained = np.sum(flat_cross * coefficients, axis=0) / dof
+        # the fitted coefficients cost one degree of freedom each
+        residual = ((variance - explained.reshape(stats.shape))
+                    * dof / max(dof - len(self.known_means), 1))
+        return (mean, np.maximum(residual, 0.0))
+
+    @property
+    def mean(self):
+        """Estimate of C_AB(t), shape (n_frames, n_b_operators)"""
+        return self._estimate()[0]
+
+    @property
+    def standard_error(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.sqrt(self._estimate()[1] / self.statistics.count)
+
+    @property
+    def plain_standard_error(self):
+        """Standard error of plain Monte Carlo with as many trajectories"""
+        return self.plain.standard_error
+
+    @property
+    def variance_reduction(self):
+        """Factor by which the estimator's variance is smaller than that
+        of plain Monte Carlo with the same number of trajectories; this
+        is also the factor saved in the number of trajectories."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (self.plain_standard_error / self.standard_error)**2